@@ -60,16 +60,59 @@ import string
 import sys
 import platform
 import subprocess
+import collections
+import hashlib
+import functools
+import threading
+import tempfile
+import time
+import socket
+import asyncio
+import array
+import csv
+import bisect
+import shlex
+import codecs
+import copy
+import difflib
+import struct
 
 # Determine the directory where this script is located
 default_directory = os.path.dirname(os.path.realpath(__file__))
 default_json_path = os.path.join(default_directory, "supported-gpus", "supported-gpus.json")
 install_json_path = "/usr/share/nvidia-driver-assistant/supported-gpus/supported-gpus.json"
 
+# The database may also be shipped compressed (e.g. supported-gpus.json.xz)
+compressed_json_suffixes = (".xz", ".gz")
+
+# Database merged with its overlay files, reused while none of them changes
+default_merged_database_path = "/var/cache/nvidia-driver-assistant/supported-gpus.merged.json"
+MERGED_DATABASE_FORMAT = 2
+
+# Name search index (see NameIndex), reused while the database is unchanged
+default_name_index_path = "/var/cache/nvidia-driver-assistant/name-index.json"
+NAME_INDEX_FORMAT = 1
+
+# How an overlay entry is merged with the entries of the same (devid, subvendorid, subdevid)
+overlay_merge_modes = ("override", "append", "update", "remove")
+
+# Last detection result, reused while the PCI topology and the database are unchanged
+default_state_cache_path = "/var/cache/nvidia-driver-assistant/detection.json"
+
+# Where --publish leaves the decision of the current boot for other tools
+default_publish_directory = "/run/nvidia-driver-assistant"
+published_result_name = "result.json"
+published_flavor_name = "module-flavor"
+STATE_CACHE_FORMAT = 7
+
 # VDPAU feature groups
 vdpau_group_a = [chr(x) for x in range(ord("a"), ord("c") + 1)]
 vdpau_group_b = [chr(x) for x in range(ord("d"), ord("i") + 1)]
 vdpau_group_c = [chr(x) for x in range(ord("j"), ord("l") + 1)]
+# The same groups as VDPAU levels (1 = feature set A, 0 = no feature set)
+vdpau_level_group_a = range(1, 4)
+vdpau_level_group_b = range(4, 10)
+vdpau_level_group_c = range(10, 13)
 
 # Driver type flags
 proprietary_required = "proprietary_required"
@@ -78,6 +121,16 @@ default = "open_required"
 open_supported = "kernelopen"
 support_flags = (open_supported, proprietary_supported)
 
+# Feature flags are interned into integer bits once, when the database is loaded.
+# The support flags get fixed bits, any other feature string found in
+# supported-gpus.json is assigned the next free bit on first sight.
+vdpau_feature_prefix = "vdpaufeatureset"
+FEATURE_KERNELOPEN = 1 << 0
+FEATURE_GSP_PROPRIETARY = 1 << 1
+_feature_bits = {open_supported: FEATURE_KERNELOPEN, proprietary_supported: FEATURE_GSP_PROPRIETARY}
+_feature_names = [open_supported, proprietary_supported]
+_feature_lock = threading.Lock()
+
 # ===== CONTROL VARIABLES (for distribution-specific overrides) =====
 # 1. Non-legacy cards (no legacybranch in JSON)
 #    Set to override default driver branch for modern GPUs (e.g., "535", "545", etc.)
@@ -271,6 +324,10 @@ simulated_gpus = {
 }
 
 
+class AssistantError(Exception):
+    """Error raised by the library functions instead of exiting the process"""
+
+
 class SystemInfo(object):
     def __init__(self, id, version_id, pretty_name):
         super(SystemInfo, self).__init__()
@@ -295,24 +352,288 @@ class SystemInfo(object):
             logging.debug("get_distro(): detected %s, setting to %s" % (self.original_id, self.id))
 
 
+_POLICY_FIELDS = (
+    "distro_non_legacy_default_branch",
+    "distro_580_legacy_override_branch",
+    "distro_legacy_override_branch",
+    "enable_legacy_openkernel_restriction",
+    "enable_architecture_check",
+    "open_capable_archs",
+    "open_unsupported_archs",
+    "architecture_min_driver",
+    "enable_strict_compatibility",
+    "require_confirmation",
+    "auto_fallback",
+    "max_branch_mismatch",
+)
+
+
+class Policy(collections.namedtuple("Policy", _POLICY_FIELDS)):
+    """Immutable set of the driver selection policy switches
+
+    Every field mirrors the module-level constant of the same name in upper
+    case (e.g. ``auto_fallback`` <-> ``AUTO_FALLBACK``). ``architecture_min_driver``
+    is stored as a sorted tuple of (architecture, branch) pairs so that the
+    policy stays hashable and can be used as a cache key.
+    """
+    __slots__ = ()
+
+    _branch_fields = (
+        "distro_non_legacy_default_branch",
+        "distro_580_legacy_override_branch",
+        "distro_legacy_override_branch",
+    )
+    _bool_fields = (
+        "enable_legacy_openkernel_restriction",
+        "enable_architecture_check",
+        "enable_strict_compatibility",
+        "require_confirmation",
+        "auto_fallback",
+    )
+    _arch_fields = ("open_capable_archs", "open_unsupported_archs")
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def default(cls):
+        """Get the policy of the module-level control variables
+
+        The policy is built once; every Device created without an explicit
+        policy shares it.
+        """
+        return cls.from_dict({})
+
+    @classmethod
+    def from_dict(cls, values):
+        """Build a policy from a dictionary, using the module-level control
+        variables for any missing key
+
+        Keys are accepted either as field names or as the upper case control
+        variable names. ``architecture_min_driver`` is merged over the default
+        table rather than replacing it.
+
+        Raises:
+            ValueError: On unknown keys or invalid values
+        """
+        fields = {
+            "distro_non_legacy_default_branch": DISTRO_NON_LEGACY_DEFAULT_BRANCH,
+            "distro_580_legacy_override_branch": DISTRO_580_LEGACY_OVERRIDE_BRANCH,
+            "distro_legacy_override_branch": DISTRO_LEGACY_OVERRIDE_BRANCH,
+            "enable_legacy_openkernel_restriction": ENABLE_LEGACY_OPENKERNEL_RESTRICTION,
+            "enable_architecture_check": ENABLE_ARCHITECTURE_CHECK,
+            "open_capable_archs": OPEN_CAPABLE_ARCHS,
+            "open_unsupported_archs": OPEN_UNSUPPORTED_ARCHS,
+            "architecture_min_driver": dict(ARCHITECTURE_MIN_DRIVER),
+            "enable_strict_compatibility": ENABLE_STRICT_COMPATIBILITY,
+            "require_confirmation": REQUIRE_CONFIRMATION,
+            "auto_fallback": AUTO_FALLBACK,
+            "max_branch_mismatch": MAX_BRANCH_MISMATCH,
+        }
+
+        for key, value in values.items():
+            field = key.lower()
+            if field not in fields:
+                raise ValueError("unknown policy key: %s" % key)
+            if field == "architecture_min_driver":
+                if not isinstance(value, dict):
+                    raise ValueError("%s must be a mapping" % key)
+                fields[field].update(value)
+            else:
+                fields[field] = value
+
+        for field in cls._branch_fields:
+            value = fields[field]
+            if value is None or value == "":
+                fields[field] = None
+                continue
+            value = str(value)
+            if not value.isdigit():
+                raise ValueError("%s: %s is not a driver branch" % (field, value))
+            fields[field] = value
+
+        for field in cls._bool_fields:
+            if not isinstance(fields[field], bool):
+                raise ValueError("%s must be true or false" % field)
+
+        for field in cls._arch_fields:
+            value = fields[field]
+            if isinstance(value, str):
+                raise ValueError("%s must be a list of architectures" % field)
+            try:
+                fields[field] = tuple(str(arch).lower() for arch in value)
+            except TypeError:
+                raise ValueError("%s must be a list of architectures" % field)
+
+        min_driver = {}
+        for arch, branch in fields["architecture_min_driver"].items():
+            branch = str(branch)
+            if not branch.isdigit():
+                raise ValueError("architecture_min_driver: %s has invalid branch %s" % (arch, branch))
+            min_driver[str(arch).lower()] = branch
+        fields["architecture_min_driver"] = tuple(sorted(min_driver.items()))
+
+        try:
+            fields["max_branch_mismatch"] = int(fields["max_branch_mismatch"])
+        except (TypeError, ValueError):
+            raise ValueError("max_branch_mismatch must be an integer")
+
+        return cls(**fields)
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a policy from a JSON configuration file
+
+        Args:
+            path: Path to a JSON file containing a single object
+
+        Raises:
+            ValueError: If the file cannot be parsed or contains invalid values
+        """
+        try:
+            with open(path, "r") as stream:
+                values = json.load(stream)
+        except (IOError, OSError) as e:
+            raise ValueError("cannot read policy file %s: %s" % (path, e))
+        except ValueError as e:
+            raise ValueError("cannot parse policy file %s: %s" % (path, e))
+        if not isinstance(values, dict):
+            raise ValueError("policy file %s must contain a JSON object" % path)
+        return cls.from_dict(values)
+
+    def min_driver(self, architecture):
+        """Get the minimum driver branch required by an architecture"""
+        for arch, branch in self.architecture_min_driver:
+            if arch == architecture:
+                return branch
+        return "390"
+
+    def to_dict(self):
+        """Get a JSON serializable representation of the policy"""
+        values = self._asdict()
+        values["open_capable_archs"] = list(self.open_capable_archs)
+        values["open_unsupported_archs"] = list(self.open_unsupported_archs)
+        values["architecture_min_driver"] = dict(self.architecture_min_driver)
+        return dict(values)
+
+    def fingerprint(self):
+        """Get a stable digest of the policy, usable as a cache key across processes"""
+        encoded = json.dumps(self.to_dict(), sort_keys=True).encode("utf-8")
+        return hashlib.sha1(encoded).hexdigest()
+
+
 class Device(object):
-    def __init__(self, id, name, features, legacy_branch, subvendorid=None, subdevid=None):
+    __slots__ = (
+        "policy", "id", "name", "feature_mask", "vdpau_level", "legacy_branch", "driver_hint",
+        "architecture", "chip_family", "subvendorid", "subdevid", "is_laptop_gpu", "pci_link",
+        "topology", "bar1", "sriov",
+    )
+
+    def __init__(self, id, name, features, legacy_branch, subvendorid=None, subdevid=None, policy=None,
+                 vdpau_level=0):
         super(Device, self).__init__()
+        self.policy = policy if policy is not None else Policy.default()
         self.id = id
         self.name = name
-        self.features = features
-        self.vdpau_feat = ""
+        if isinstance(features, int):
+            # Already interned (see Chip)
+            self.feature_mask = features
+            self.vdpau_level = vdpau_level
+        else:
+            self.feature_mask, self.vdpau_level = intern_features(features)
         self.legacy_branch = legacy_branch
         self.driver_hint = ""
-        self.architecture = "unknown"
         self.chip_family = ""
         self.subvendorid = subvendorid
         self.subdevid = subdevid
-        self.is_laptop_gpu = self._is_laptop_gpu(name)
-        self._determine_architecture()
-        self._parse_features(features)
+        self.pci_link = None
+        self.topology = []
+        self.bar1 = None
+        self.sriov = None
+        self.architecture, self.is_laptop_gpu = classify_device_name(name)
+        logging.debug("Device architecture determined: %s -> %s" % (self.name, self.architecture))
+        self._parse_features(self.feature_mask)
+
+    @classmethod
+    def from_chip(cls, chip, devid=None, policy=None):
+        """Build a device from a database record
+
+        Args:
+            chip: Chip record
+            devid: Device ID to report (defaults to the record's)
+            policy: Policy to evaluate the device with
+        """
+        return cls(
+            devid if devid else chip.devid, chip.name, chip.feature_mask, chip.legacy_branch,
+            chip.subvendorid, chip.subdevid, policy=policy, vdpau_level=chip.vdpau_level
+        )
+
+    # Read from sysfs on every run: link training, BAR sizes and VF counts
+    # change without changing the PCI topology fingerprint
+    _live_slots = ("pci_link", "topology", "bar1", "sriov")
+
+    def to_state(self):
+        """Get the evaluated state of this device (see from_state())
+
+        Features are stored by name since the bits of the non-support
+        features are only stable within one process. The live sysfs details
+        are not stored, only the PCI slots to read them from again (see
+        restore_devices()).
+        """
+        skipped = ("policy", "feature_mask") + self._live_slots
+        state = {slot: getattr(self, slot) for slot in self.__slots__ if slot not in skipped}
+        state["features"] = feature_names(self.feature_mask)
+        state["slots"] = [function["slot"] for function in self.topology]
+        return state
+
+    @classmethod
+    def from_state(cls, state, policy=None):
+        """Restore an evaluated device from to_state() without evaluating it again
+
+        The live sysfs details are left empty (see restore_devices()).
+
+        Raises:
+            KeyError: If the state is incomplete
+        """
+        device = cls.__new__(cls)
+        device.policy = policy if policy is not None else Policy.default()
+        device.feature_mask = intern_features(state["features"])[0]
+        for slot in cls.__slots__:
+            if slot not in ("policy", "feature_mask") + cls._live_slots:
+                setattr(device, slot, state[slot])
+        attach_pci_details(device, None)
+        return device
+
+    @property
+    def features(self):
+        """Feature strings (lower case) of this device"""
+        return feature_names(self.feature_mask, self.vdpau_level)
+
+    @property
+    def vdpau_feat(self):
+        """VDPAU feature set letter ("a", "b", ...) or "" if none"""
+        return chr(ord("a") + self.vdpau_level - 1) if self.vdpau_level else ""
     
-    def _is_laptop_gpu(self, name):
+    def to_dict(self):
+        """Get the JSON representation of this device (as used by --json)"""
+        min_driver, max_driver = self._get_supported_range(legacy_override=False)
+        return {
+            "pci_id": self.id,
+            "name": self.name,
+            "architecture": self.architecture,
+            "is_laptop": self.is_laptop_gpu,
+            "is_legacy": bool(self.legacy_branch),
+            "subsystem_vendor": self.subvendorid,
+            "subsystem_device": self.subdevid,
+            "supported_min_driver": min_driver,
+            "supported_max_driver": max_driver,
+            "legacy": self.legacy_branch if self.legacy_branch else None,
+            "pcie_link": self.pci_link,
+            "topology": self.topology,
+            "bar1": self.bar1,
+            "sriov": self.sriov,
+        }
+
+    @staticmethod
+    def _is_laptop_gpu(name):
         """Determine if this is a laptop/mobile GPU"""
         name_lower = name.lower()
         
@@ -367,7 +688,7 @@ class Device(object):
         
         Args:
             branch_major: Major driver version number (e.g., "470" for 470.xx)
-            legacy_override: Whether we're applying a legacy override (DISTRO_LEGACY_OVERRIDE_BRANCH or DISTRO_580_LEGACY_OVERRIDE_BRANCH)
+            legacy_override: Whether we're applying a legacy override (distro_legacy_override_branch or distro_580_legacy_override_branch)
         
         Returns:
             tuple: (compatible: bool, message: str)
@@ -379,7 +700,7 @@ class Device(object):
             requested = int(branch_major)
             
             # Check minimum requirement (applies to ALL devices)
-            min_driver = ARCHITECTURE_MIN_DRIVER.get(self.architecture, "390")
+            min_driver = self.policy.min_driver(self.architecture)
             min_required = int(min_driver)
             
             if requested < min_required:
@@ -416,7 +737,7 @@ class Device(object):
         Returns:
             tuple: (min_driver: str, max_driver: str)
         """
-        min_driver = ARCHITECTURE_MIN_DRIVER.get(self.architecture, "390")
+        min_driver = self.policy.min_driver(self.architecture)
         
         # Determine maximum driver version:
         # 1. If this is a legacy card (has legacybranch in JSON), use that as max
@@ -424,24 +745,37 @@ class Device(object):
         #    treat as legacy and use the override branch as max (but compatibility will be checked separately)
         # 3. Otherwise (non-legacy card), no upper limit (999)
         
-        if self.legacy_branch:
+        return min_driver, Device.get_max_driver(self.legacy_branch, legacy_override)
+
+    @staticmethod
+    def get_max_driver(legacy_branch, legacy_override=False):
+        """Get the maximum supported driver major for a legacybranch value
+
+        Args:
+            legacy_branch: legacybranch of the supported-gpus.json entry (None if not legacy)
+            legacy_override: Whether we're applying a legacy override
+
+        Returns:
+            str: Maximum driver major ("999" if there is no upper limit)
+        """
+        if legacy_branch:
             # Legacy card - maximum comes from JSON legacybranch
             try:
-                max_driver = self.legacy_branch.split('.')[0]
+                max_driver = legacy_branch.split('.')[0]
                 # Validate it's a number
                 int(max_driver)
-                return min_driver, max_driver
+                return max_driver
             except (ValueError, IndexError):
                 # If legacybranch format is invalid, use 470 as fallback for legacy cards
-                return min_driver, "470"
+                return "470"
         elif legacy_override:
             # Applying legacy override to non-legacy card
             # This is an error case - we shouldn't apply legacy override to non-legacy cards
             # But if we do, use 470 as maximum (legacy default)
-            return min_driver, "470"
+            return "470"
         else:
             # Non-legacy card - no upper limit
-            return min_driver, "999"
+            return "999"
     
     def _get_safe_fallback_branch(self, legacy_override=False):
         """Get a safe fallback branch for this GPU
@@ -458,7 +792,7 @@ class Device(object):
         if self.legacy_branch:
             try:
                 legacy_major = int(self.legacy_branch.split('.')[0])
-                min_required = int(ARCHITECTURE_MIN_DRIVER.get(self.architecture, "390"))
+                min_required = int(self.policy.min_driver(self.architecture))
                 
                 # If the JSON legacybranch is valid and >= minimum, use it
                 if legacy_major >= min_required:
@@ -471,6 +805,9 @@ class Device(object):
     
     def _parse_features(self, features):
         """Parse feature flags to determine which driver to use
+
+        Args:
+            features: Interned feature bitmask (see intern_features())
         
         This method implements the driver selection logic in priority order:
         1. Old variable backward compatibility override
@@ -480,26 +817,21 @@ class Device(object):
         5. Architecture-based check (if enabled)
         6. Normal JSON-based logic
         """
-        flags = []
-        for feat in features:
-            feat = feat.lower()
-            logging.debug("Device: has following feature: %s" % (feat))
-            if feat.find("vdpaufeatureset") != -1:
-                self.vdpau_feat = feat.replace("vdpaufeatureset", "")[0]
-            elif feat in support_flags:
-                flags.append(feat)
+        flags = [flag for flag in support_flags if features & _feature_bits[flag]]
 
         logging.debug("Device: has following flags: %s" % (flags))
 
+        policy = self.policy
+
         # ===== 1. OLD VARIABLE - BACKWARD COMPATIBILITY (deprecated) =====
-        if DISTRO_LEGACY_OVERRIDE_BRANCH:
+        if policy.distro_legacy_override_branch:
             # Legacy override applies - treat as legacy for compatibility check
             compatible, message = self._check_driver_compatibility(
-                DISTRO_LEGACY_OVERRIDE_BRANCH, 
+                policy.distro_legacy_override_branch, 
                 legacy_override=True
             )
             if compatible:
-                self.legacy_branch = DISTRO_LEGACY_OVERRIDE_BRANCH + ".00"
+                self.legacy_branch = policy.distro_legacy_override_branch + ".00"
                 self.driver_hint = proprietary_required
                 logging.info(
                     "Legacy override (old variable): %s forced to branch %s - %s"
@@ -512,25 +844,25 @@ class Device(object):
                     "SAFETY CHECK FAILED for %s (%s): %s",
                     self.name, self.architecture, message
                 )
-                if AUTO_FALLBACK:
+                if policy.auto_fallback:
                     safe_branch = self._get_safe_fallback_branch(legacy_override=True)
                     self.legacy_branch = safe_branch + ".00"
                     self.driver_hint = proprietary_required
                     logging.warning(
                         "Auto-fallback: %s using safe branch %s (original request: %s)",
-                        self.name, safe_branch, DISTRO_LEGACY_OVERRIDE_BRANCH
+                        self.name, safe_branch, policy.distro_legacy_override_branch
                     )
                 return
         
         # ===== 2. NON-LEGACY CARDS (no legacybranch in JSON) =====
-        if not self.legacy_branch and DISTRO_NON_LEGACY_DEFAULT_BRANCH:
+        if not self.legacy_branch and policy.distro_non_legacy_default_branch:
             # Non-legacy card - no upper limit (999)
             compatible, message = self._check_driver_compatibility(
-                DISTRO_NON_LEGACY_DEFAULT_BRANCH, 
+                policy.distro_non_legacy_default_branch, 
                 legacy_override=False
             )
             if compatible:
-                self.legacy_branch = DISTRO_NON_LEGACY_DEFAULT_BRANCH + ".00"
+                self.legacy_branch = policy.distro_non_legacy_default_branch + ".00"
                 self.driver_hint = proprietary_required
                 logging.info(
                     "Non-legacy default: %s set to branch %s - %s"
@@ -543,34 +875,34 @@ class Device(object):
                     "Non-legacy default FAILED for %s (%s): %s",
                     self.name, self.architecture, message
                 )
-                if AUTO_FALLBACK:
+                if policy.auto_fallback:
                     safe_branch = self._get_safe_fallback_branch(legacy_override=False)
                     self.legacy_branch = safe_branch + ".00"
                     self.driver_hint = proprietary_required
                     logging.warning(
                         "Auto-fallback: %s using safe branch %s (requested: %s)",
-                        self.name, safe_branch, DISTRO_NON_LEGACY_DEFAULT_BRANCH
+                        self.name, safe_branch, policy.distro_non_legacy_default_branch
                     )
                 return
         
         # ===== 3. 580+ LEGACY CARDS (JSON has "legacybranch": "580.xx" or higher) =====
         # This is the main safety net for 580+ legacy cards
-        if self.legacy_branch and DISTRO_580_LEGACY_OVERRIDE_BRANCH:
+        if self.legacy_branch and policy.distro_580_legacy_override_branch:
             legacy_major = self.legacy_branch.split('.')[0]
             try:
                 legacy_major_int = int(legacy_major)
                 if legacy_major_int >= 580:
                     # Check if the requested override is compatible
                     compatible, message = self._check_driver_compatibility(
-                        DISTRO_580_LEGACY_OVERRIDE_BRANCH,
+                        policy.distro_580_legacy_override_branch,
                         legacy_override=True
                     )
                     if compatible:
-                        self.legacy_branch = DISTRO_580_LEGACY_OVERRIDE_BRANCH + ".00"
+                        self.legacy_branch = policy.distro_580_legacy_override_branch + ".00"
                         self.driver_hint = proprietary_required
                         logging.info(
                             "580+ legacy override: %s changed from %s to %s - %s"
-                            % (self.name, legacy_major, DISTRO_580_LEGACY_OVERRIDE_BRANCH, message)
+                            % (self.name, legacy_major, policy.distro_580_legacy_override_branch, message)
                         )
                         return
                     else:
@@ -579,7 +911,7 @@ class Device(object):
                             "580+ legacy override FAILED for %s (%s): %s",
                             self.name, self.architecture, message
                         )
-                        if AUTO_FALLBACK:
+                        if policy.auto_fallback:
                             safe_branch = self._get_safe_fallback_branch(legacy_override=True)
                             
                             # Check if the original JSON legacybranch is actually valid
@@ -610,7 +942,7 @@ class Device(object):
         
         # ===== 4. LEGACY BRANCH OPENKERNEL RESTRICTION (NEW LOGIC) =====
         # If enabled, all legacy branches up to 580.xx cannot use open kernel modules
-        if self.legacy_branch and ENABLE_LEGACY_OPENKERNEL_RESTRICTION:
+        if self.legacy_branch and policy.enable_legacy_openkernel_restriction:
             legacy_major = self.legacy_branch.split('.')[0]
             try:
                 legacy_major_int = int(legacy_major)
@@ -627,8 +959,8 @@ class Device(object):
                 pass
         
         # ===== 5. ARCHITECTURE-BASED CHECK (only if enabled) =====
-        if ENABLE_ARCHITECTURE_CHECK:
-            if self.architecture in OPEN_CAPABLE_ARCHS:
+        if policy.enable_architecture_check:
+            if self.architecture in policy.open_capable_archs:
                 if open_supported in flags:
                     self.driver_hint = default
                 else:
@@ -659,10 +991,11 @@ class Device(object):
         This method analyzes the GPU name string to identify the architecture
         (e.g., Turing, Pascal, Maxwell, etc.) based on known naming patterns.
         """
-        self.architecture = self._get_architecture_from_device_name(self.name)
+        self.architecture = classify_device_name(self.name)[0]
         logging.debug("Device architecture determined: %s -> %s" % (self.name, self.architecture))
     
-    def _get_architecture_from_device_name(self, device_name):
+    @staticmethod
+    def _get_architecture_from_device_name(device_name):
         """Extract architecture from GPU device name
         
         Args:
@@ -749,6 +1082,18 @@ class Device(object):
         return "unknown"
 
 
+def get_os_release_path(root="/"):
+    """Get the os-release file of a root file system
+
+    /etc/os-release is preferred, /usr/lib/os-release is its standard fallback.
+    """
+    for candidate in ("etc/os-release", "usr/lib/os-release"):
+        path = os.path.join(root, candidate)
+        if os.path.exists(path):
+            return path
+    return os.path.join(root, "etc/os-release")
+
+
 def get_distro(path=None):
     """Get the Linux distribution from /etc/os-release
     
@@ -800,17 +1145,6 @@ def get_distro(path=None):
                 system_info.version_id,
             )
         )
-        print(
-            "Detected system:\n  %s %s\n"
-            % (
-                (
-                    system_info.pretty_name.replace(system_info.version_id, "").strip()
-                    if system_info.pretty_name
-                    else system_info.id
-                ),
-                system_info.version_id,
-            )
-        )
     else:
         logging.debug(
             "get_distro(): detected %s %s distribution is not supported"
@@ -820,7 +1154,7 @@ def get_distro(path=None):
             "Error: detected %s%s %s distribution is not supported"
             % (
                 system_info.original_id,
-                " (%s)" % system_info.id if system_info.id != self.original_id else "",
+                " (%s)" % system_info.id if system_info.id != system_info.original_id else "",
                 system_info.version_id,
             )
         )
@@ -829,6 +1163,25 @@ def get_distro(path=None):
     return system_info
 
 
+def print_detected_system(system_info):
+    """Print the detected (or overridden) distribution
+
+    Args:
+        system_info: SystemInfo object
+    """
+    print(
+        "Detected system:\n  %s %s\n"
+        % (
+            (
+                system_info.pretty_name.replace(system_info.version_id, "").strip()
+                if system_info.pretty_name
+                else system_info.id
+            ),
+            system_info.version_id,
+        )
+    )
+
+
 def override_distro(distro_override):
     """Process the --distro argument and return a SystemInfo object (for testing)
     
@@ -848,11 +1201,16 @@ def override_distro(distro_override):
     return SystemInfo(distro_id, version_id, "")
 
 
-def get_system_modaliases(sys_path=None):
+def get_system_modaliases(sys_path=None, duplicates=None):
     """Get a dictionary with modaliases and paths in the system
     
+    SR-IOV virtual functions are left out, they are accounted for with
+    their physical function (see get_sriov_info()).
+
     Args:
         sys_path: Optional alternative path to /sys (for testing)
+        duplicates: Optional dictionary collecting the paths of further
+            devices with an already seen modalias (e.g. identical GPUs)
         
     Returns:
         dict: Dictionary mapping modalias strings to device paths
@@ -861,26 +1219,111 @@ def get_system_modaliases(sys_path=None):
     devices = "/sys/devices" if not sys_path else "%s/devices" % (sys_path)
     
     for path, dirs, files in os.walk(devices):
-        modalias = None
-        if "modalias" in files:
-            try:
-                with open(os.path.join(path, "modalias")) as file:
-                    modalias = file.read().strip()
-            except IOError as e:
-                logging.debug("get_system_modaliases(): failed to read %s/modalias: %s", path, e)
-                continue
-
-        if not modalias:
+        if "modalias" not in files or "physfn" in dirs:
             continue
+        modalias = get_device_modalias(path)
+        if modalias:
+            if duplicates is not None and modalias in modaliases:
+                duplicates.setdefault(modalias, []).append(modaliases[modalias])
+            modaliases[modalias] = path
 
-        driver_path = os.path.join(path, "driver")
-        module_path = os.path.join(driver_path, "module")
+    return modaliases
 
-        if os.path.islink(driver_path) and not os.path.islink(module_path):
-            continue
-        modaliases[modalias] = path
 
-    return modaliases
+def get_device_modalias(path):
+    """Get the modalias of a single device in sysfs
+
+    Devices bound to a driver that is built into the kernel (no module) are
+    skipped, as in get_system_modaliases().
+
+    Args:
+        path: Device path in /sys
+
+    Returns:
+        str: Modalias, or None if it is missing or should be skipped
+    """
+    try:
+        with open(os.path.join(path, "modalias")) as file:
+            modalias = file.read().strip()
+    except IOError as e:
+        logging.debug("get_system_modaliases(): failed to read %s/modalias: %s", path, e)
+        return None
+
+    if not modalias:
+        return None
+
+    driver_path = os.path.join(path, "driver")
+    module_path = os.path.join(driver_path, "module")
+
+    if os.path.islink(driver_path) and not os.path.islink(module_path):
+        return None
+    return modalias
+
+
+# A PCI modalias has a fixed layout:
+#   pci:v<8 hex>d<8 hex>sv<8 hex>sd<8 hex>bc<2 hex>sc<2 hex>i<2 hex>
+# e.g. pci:v000010DEd00002783sv00001043sd00008894bc03sc00i00
+PCI_MODALIAS_LENGTH = 53
+NVIDIA_PCI_VENDOR = "10DE"
+
+# Vendors of the integrated GPUs NVIDIA GPUs are paired with in hybrid systems
+INTEGRATED_GPU_VENDORS = {"8086": "Intel", "1002": "AMD"}
+
+PciModalias = collections.namedtuple(
+    "PciModalias",
+    ["vendor", "devid", "subsys_vendor", "subsys_device", "base_class", "sub_class", "interface"],
+)
+
+
+def parse_pci_modalias(alias, vendor=NVIDIA_PCI_VENDOR):
+    """Parse a PCI modalias by slicing its fixed-width fields
+
+    Args:
+        alias: Modalias string as read from sysfs
+        vendor: 4 digit hex vendor ID to accept (NVIDIA by default), None for any vendor
+
+    Returns:
+        PciModalias: Parsed fields (IDs as "0x"-prefixed 4 digit hex strings, the
+        vendor and class codes without prefix), or None if the modalias is not a
+        PCI modalias of the requested vendor
+    """
+    prefix = "pci:v0000" + vendor if vendor else "pci:v0000"
+    if not alias.startswith(prefix):
+        # sysfs uses upper case hex digits, accept lower case ones as well
+        if not alias[:len(prefix)].upper() == prefix.upper():
+            return None
+        alias = alias.upper().replace("PCI:V", "pci:v", 1)
+    if (len(alias) < PCI_MODALIAS_LENGTH or alias[13] not in "dD" or alias[22:24].lower() != "sv"
+            or alias[32:34].lower() != "sd" or alias[42:44].lower() != "bc"
+            or alias[46:48].lower() != "sc" or alias[50] not in "iI"):
+        return None
+    return PciModalias(
+        alias[9:13],
+        "0x" + alias[18:22],
+        "0x" + alias[28:32],
+        "0x" + alias[38:42],
+        alias[44:46],
+        alias[48:50],
+        alias[51:53],
+    )
+
+
+def parse_pci_modaliases(aliases, vendor=NVIDIA_PCI_VENDOR):
+    """Parse many modaliases in one call, keeping only PCI ones of a vendor
+
+    Args:
+        aliases: Iterable of modalias strings (e.g. the keys of get_system_modaliases())
+        vendor: 4 digit hex vendor ID to accept (NVIDIA by default), None for any vendor
+
+    Returns:
+        list: (alias, PciModalias) tuples for the accepted modaliases
+    """
+    parsed = []
+    for alias in aliases:
+        details = parse_pci_modalias(alias, vendor)
+        if details is not None:
+            parsed.append((alias, details))
+    return parsed
 
 
 def get_pci_device_info(dev_path):
@@ -891,6 +1334,8 @@ def get_pci_device_info(dev_path):
         
     Returns:
         dict: Dictionary with device information including vendor, device, subsystem_vendor, subsystem_device
+        and the PCIe "link" of the device and its upstream bridge (see get_pcie_link()) and
+        its "topology" (see get_pci_topology()), "bars" (see get_pci_bars()) and "sriov" (see get_sriov_info())
     """
     info = {}
     try:
@@ -926,6 +1371,15 @@ def get_pci_device_info(dev_path):
                         info["pci_id"] = line.strip().split("=")[1]
                     elif line.startswith("PCI_SUBSYS_ID="):
                         info["pci_subsys_id"] = line.strip().split("=")[1]
+
+        link = get_pcie_link(dev_path)
+        if link:
+            bridge = get_upstream_bridge(dev_path)
+            link["bridge"] = get_pcie_link(bridge) if bridge else None
+            info["link"] = link
+        info["topology"] = get_pci_topology(dev_path)
+        info["bars"] = get_pci_bars(dev_path)
+        info["sriov"] = get_sriov_info(dev_path)
         
     except Exception as e:
         logging.debug(f"get_pci_device_info(): Failed to read device info from {dev_path}: {e}")
@@ -933,7 +1387,240 @@ def get_pci_device_info(dev_path):
     return info
 
 
-def select_best_gpu_match(matching_gpus, pci_info=None, suppress_warnings=False):
+# BAR1 aperture of GPUs without Resizable BAR
+legacy_bar1_size = 256 << 20
+
+pci_slot_pattern = re.compile(r"^[0-9a-f]{4}:[0-9a-f]{2}:[0-9a-f]{2}\.[0-7]$")
+
+
+def get_upstream_bridge(dev_path):
+    """Get the sysfs path of the PCI bridge a device sits behind, None at the root complex"""
+    parent = os.path.dirname(os.path.realpath(dev_path))
+    if pci_slot_pattern.match(os.path.basename(parent)):
+        return parent
+    return None
+
+
+def get_pci_topology(dev_path):
+    """Read where a PCI function sits in the NUMA and PCIe topology
+
+    The ancestry lists the bridges from the root port down to the function.
+    A function behind a PCIe switch has at least a root port, the switch
+    upstream port and a downstream port above it; the nearest switch is
+    identified by its upstream port.
+
+    Returns:
+        dict: slot, numa_node (None without NUMA), local_cpulist, iommu_group
+        (None without an IOMMU), ancestry and switch (None if attached to a root port)
+    """
+    path = os.path.realpath(dev_path)
+    ancestry = []
+    parent = os.path.dirname(path)
+    while pci_slot_pattern.match(os.path.basename(parent)):
+        ancestry.insert(0, os.path.basename(parent))
+        parent = os.path.dirname(parent)
+
+    numa_node = read_text(os.path.join(path, "numa_node"))
+    try:
+        numa_node = int(numa_node)
+    except (TypeError, ValueError):
+        numa_node = None
+    try:
+        iommu_group = int(os.path.basename(os.readlink(os.path.join(path, "iommu_group"))))
+    except (OSError, ValueError):
+        iommu_group = None
+
+    return {
+        "slot": os.path.basename(path),
+        "numa_node": numa_node if numa_node is not None and numa_node >= 0 else None,
+        "local_cpulist": (read_text(os.path.join(path, "local_cpulist")) or "").strip() or None,
+        "iommu_group": iommu_group,
+        "ancestry": ancestry,
+        "switch": ancestry[-2] if len(ancestry) >= 3 else None,
+    }
+
+
+def get_sriov_info(dev_path):
+    """Read the SR-IOV state of a physical function
+
+    Returns:
+        dict: physical_functions (1), total_vfs, enabled_vfs and the slots of
+        the virtual_functions, None if the function is not SR-IOV capable
+    """
+    total = read_text(os.path.join(dev_path, "sriov_totalvfs"))
+    if total is None:
+        return None
+    try:
+        total = int(total)
+        enabled = int(read_text(os.path.join(dev_path, "sriov_numvfs")) or 0)
+    except ValueError:
+        return None
+    slots = []
+    try:
+        for name in os.listdir(dev_path):
+            if name.startswith("virtfn"):
+                slots.append(os.path.basename(os.path.realpath(os.path.join(dev_path, name))))
+    except OSError:
+        pass
+    return {
+        "physical_functions": 1,
+        "total_vfs": total,
+        "enabled_vfs": enabled,
+        "virtual_functions": sorted(slots),
+    }
+
+
+def get_pci_bars(dev_path):
+    """Read the base address registers of a PCI function
+
+    The sizes come from the ``resource`` file (start, end and flags of one
+    resource per line, the first six being BAR0-5). Functions with the
+    Resizable BAR capability also expose ``resourceN_resize``, a bitmask
+    of the supported sizes (bit n set: 1 MiB << n).
+
+    Returns:
+        dict: {index: {"size": bytes, "supported_sizes": [bytes] or None}}
+        for the implemented BARs, empty if unreadable
+    """
+    bars = {}
+    text = read_text(os.path.join(dev_path, "resource"))
+    if not text:
+        return bars
+    for index, line in enumerate(text.splitlines()[:6]):
+        try:
+            start, end, flags = (int(field, 16) for field in line.split())
+        except ValueError:
+            continue
+        if not end:
+            continue
+        supported = None
+        resize = read_text(os.path.join(dev_path, "resource%d_resize" % index))
+        if resize:
+            try:
+                mask = int(resize.strip(), 16)
+            except ValueError:
+                pass
+            else:
+                supported = [(1 << 20) << bit for bit in range(mask.bit_length()) if mask & (1 << bit)]
+        bars[index] = {"size": end - start + 1, "supported_sizes": supported}
+    return bars
+
+
+def assess_bar1(bars, slot=None):
+    """Check whether the GPU's BAR1 aperture exposes more than the legacy window
+
+    Without Resizable BAR (or with it disabled in the firmware) the CPU sees
+    the video memory through a 256 MiB BAR1 window only.
+
+    Args:
+        bars: get_pci_bars() result
+        slot: PCI slot of the GPU function
+
+    Returns:
+        dict: slot, size, large (True if larger than the legacy window),
+        resizable (None if the capability is not exposed), max_size and
+        whether it can be enlarged ("enlargeable"); None if BAR1 is not
+        implemented
+    """
+    bar = bars.get(1)
+    if not bar:
+        return None
+    supported = bar["supported_sizes"]
+    max_size = max(supported) if supported else None
+    return {
+        "slot": slot,
+        "size": bar["size"],
+        "large": bar["size"] > legacy_bar1_size,
+        "resizable": bool(supported) if supported is not None else None,
+        "max_size": max_size,
+        "enlargeable": max_size is not None and bar["size"] < max_size,
+    }
+
+
+def format_size(size):
+    """Format a power of two sized aperture (256 MiB, 16 GiB)"""
+    for unit, shift in (("TiB", 40), ("GiB", 30), ("MiB", 20), ("KiB", 10)):
+        if size >= 1 << shift:
+            return "%g %s" % (size / (1 << shift), unit)
+    return "%d B" % size
+
+
+def parse_link_speed(value):
+    """Parse a sysfs link speed ("8.0 GT/s PCIe") into GT/s, None if unknown"""
+    try:
+        return float(value.split()[0])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def get_pcie_link(dev_path):
+    """Read the current and maximum PCIe link speed and width of a device
+
+    Returns:
+        dict: current_speed/max_speed in GT/s, current_width/max_width in
+        lanes, None if the device does not expose its link
+    """
+    values = {}
+    for attribute in ("current_link_speed", "max_link_speed", "current_link_width", "max_link_width"):
+        try:
+            with open(os.path.join(dev_path, attribute), "r") as f:
+                values[attribute] = f.read().strip()
+        except OSError:
+            values[attribute] = None
+    if values["current_link_speed"] is None and values["current_link_width"] is None:
+        return None
+
+    def width(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    return {
+        "current_speed": parse_link_speed(values["current_link_speed"]),
+        "current_width": width(values["current_link_width"]),
+        "max_speed": parse_link_speed(values["max_link_speed"]),
+        "max_width": width(values["max_link_width"]),
+    }
+
+
+def assess_pcie_link(link, slot=None):
+    """Compare a GPU's negotiated PCIe link with what the GPU and its slot support
+
+    The expected link is the lower of the GPU's and the upstream bridge's
+    maximum. A narrower link than expected is always a fault (riser, slot,
+    seating) and marks the link as degraded; a slower one is usually power
+    saving of an idle GPU and is only reported as "speed_reduced".
+
+    Args:
+        link: get_pcie_link() result with a "bridge" entry (see get_pci_device_info())
+        slot: PCI slot of the GPU function
+
+    Returns:
+        dict: The link with "slot", "expected_speed", "expected_width",
+        "degraded" and its "reasons" (width shortfalls), and "speed_reduced"
+    """
+    bridge = link.get("bridge") or {}
+    expected_speed = min(filter(None, (link["max_speed"], bridge.get("max_speed"))), default=None)
+    expected_width = min(filter(None, (link["max_width"], bridge.get("max_width"))), default=None)
+
+    reasons = []
+    if link["current_width"] and expected_width and link["current_width"] < expected_width:
+        reasons.append("width x%d < x%d" % (link["current_width"], expected_width))
+
+    report = dict(link)
+    report.update(
+        slot=slot,
+        expected_speed=expected_speed,
+        expected_width=expected_width,
+        degraded=bool(reasons),
+        reasons=reasons,
+        speed_reduced=bool(link["current_speed"] and expected_speed and link["current_speed"] < expected_speed),
+    )
+    return report
+
+
+def select_best_gpu_match(matching_gpus, pci_info=None, suppress_warnings=False, policy=None, is_laptop=None, notices=None):
     """Select the best GPU match from multiple possibilities
     
     Selection logic (in order of priority):
@@ -947,12 +1634,16 @@ def select_best_gpu_match(matching_gpus, pci_info=None, suppress_warnings=False)
     8. Original order (fallback)
     
     Args:
-        matching_gpus: List of GPU dicts from JSON
+        matching_gpus: List of Chip records from the database
         pci_info: Dictionary with PCI device information (vendor, device, subsystem_vendor, subsystem_device)
         suppress_warnings: Whether to suppress multiple match warnings (for MHWD/JSON output)
+        policy: Policy used to build the temporary Device objects (optional)
+        is_laptop: Whether the system is a laptop, or a callable answering it on demand
+            (probed with is_laptop_system() if None)
+        notices: Optional list collecting multiple match notices instead of printing them
         
     Returns:
-        dict: Selected GPU entry
+        Chip: Selected GPU entry
     """
     if len(matching_gpus) == 1:
         return matching_gpus[0]
@@ -960,7 +1651,7 @@ def select_best_gpu_match(matching_gpus, pci_info=None, suppress_warnings=False)
     logging.debug(f"select_best_gpu_match(): Found {len(matching_gpus)} matching GPUs")
     
     # Store the list of matching GPUs for warning message
-    all_matching_names = [gpu["name"] for gpu in matching_gpus]
+    all_matching_names = [gpu.name for gpu in matching_gpus]
     
     # Convert PCI subsystem IDs to hex strings for comparison
     if pci_info and 'subsystem_vendor' in pci_info and 'subsystem_device' in pci_info:
@@ -972,8 +1663,8 @@ def select_best_gpu_match(matching_gpus, pci_info=None, suppress_warnings=False)
     # 1. Try to match by exact subsystem vendor and device
     if pci_info and 'subsystem_vendor' in pci_info and 'subsystem_device' in pci_info:
         for gpu in matching_gpus:
-            gpu_subsys_vendor = gpu.get("subvendorid")
-            gpu_subsys_device = gpu.get("subdevid")
+            gpu_subsys_vendor = gpu.subvendorid
+            gpu_subsys_device = gpu.subdevid
             
             if gpu_subsys_vendor and gpu_subsys_device:
                 # Normalize the hex strings (remove 0x prefix and compare)
@@ -983,27 +1674,27 @@ def select_best_gpu_match(matching_gpus, pci_info=None, suppress_warnings=False)
                 pci_device_norm = subsys_device_hex.lower().replace("0x", "")
                 
                 if gpu_vendor_norm == pci_vendor_norm and gpu_device_norm == pci_device_norm:
-                    logging.debug(f"select_best_gpu_match(): Exact subsystem match: {gpu['name']}")
+                    logging.debug(f"select_best_gpu_match(): Exact subsystem match: {gpu.name}")
                     selected_gpu = gpu
                     # Show warning if multiple matches and not suppressing warnings
                     if len(matching_gpus) > 1 and not suppress_warnings:
-                        show_multiple_match_warning(pci_info.get('device'), selected_gpu["name"], all_matching_names)
+                        _report_multiple_match(notices, pci_info.get('device'), selected_gpu.name, all_matching_names)
                     return selected_gpu
     
     # 2. Try to match by subsystem vendor only
     if pci_info and 'subsystem_vendor' in pci_info:
         for gpu in matching_gpus:
-            gpu_subsys_vendor = gpu.get("subvendorid")
+            gpu_subsys_vendor = gpu.subvendorid
             if gpu_subsys_vendor:
                 gpu_vendor_norm = gpu_subsys_vendor.lower().replace("0x", "")
                 pci_vendor_norm = subsys_vendor_hex.lower().replace("0x", "")
                 
                 if gpu_vendor_norm == pci_vendor_norm:
-                    logging.debug(f"select_best_gpu_match(): Subsystem vendor match: {gpu['name']}")
+                    logging.debug(f"select_best_gpu_match(): Subsystem vendor match: {gpu.name}")
                     selected_gpu = gpu
                     # Show warning if multiple matches and not suppressing warnings
                     if len(matching_gpus) > 1 and not suppress_warnings:
-                        show_multiple_match_warning(pci_info.get('device'), selected_gpu["name"], all_matching_names)
+                        _report_multiple_match(notices, pci_info.get('device'), selected_gpu.name, all_matching_names)
                     return selected_gpu
     
     # 3. If simulating, try to match by expected name
@@ -1011,27 +1702,28 @@ def select_best_gpu_match(matching_gpus, pci_info=None, suppress_warnings=False)
     if simulate_gpu and simulate_gpu in simulated_gpus:
         expected_name = simulated_gpus[simulate_gpu]["expected_name"]
         for gpu in matching_gpus:
-            if expected_name.lower() in gpu["name"].lower():
-                logging.debug(f"select_best_gpu_match(): Simulated name match: '{expected_name}' -> '{gpu['name']}'")
+            if expected_name.lower() in gpu.name.lower():
+                logging.debug(f"select_best_gpu_match(): Simulated name match: '{expected_name}' -> '{gpu.name}'")
                 selected_gpu = gpu
                 # Show warning if multiple matches and not suppressing warnings
                 if len(matching_gpus) > 1 and not suppress_warnings:
-                    show_multiple_match_warning(pci_info.get('device'), selected_gpu["name"], all_matching_names)
+                    _report_multiple_match(notices, pci_info.get('device'), selected_gpu.name, all_matching_names)
                 return selected_gpu
     
     # 4. Determine system type (laptop vs desktop)
-    is_laptop_system_val = is_laptop_system()
+    if is_laptop is None:
+        is_laptop_system_val = is_laptop_system()
+    elif callable(is_laptop):
+        is_laptop_system_val = is_laptop()
+    else:
+        is_laptop_system_val = is_laptop
     logging.debug(f"select_best_gpu_match(): System is laptop: {is_laptop_system_val}")
     
     # Separate mobile and desktop GPUs using improved detection
     mobile_gpus = []
     desktop_gpus = []
     for gpu in matching_gpus:
-        # Create a temporary device object to use the improved detection
-        temp_device = Device(gpu["devid"], gpu["name"], gpu.get("features", []), 
-                            gpu.get("legacybranch"), gpu.get("subvendorid"), gpu.get("subdevid"))
-        
-        if temp_device.is_laptop_gpu:
+        if classify_device_name(gpu.name)[1]:
             mobile_gpus.append(gpu)
         else:
             desktop_gpus.append(gpu)
@@ -1050,28 +1742,28 @@ def select_best_gpu_match(matching_gpus, pci_info=None, suppress_warnings=False)
         selected_gpu = matching_gpus[0]
         # Show warning if originally had multiple matches and not suppressing warnings
         if len(all_matching_names) > 1 and not suppress_warnings:
-            show_multiple_match_warning(pci_info.get('device') if pci_info else None, selected_gpu["name"], all_matching_names)
+            _report_multiple_match(notices, pci_info.get('device') if pci_info else None, selected_gpu.name, all_matching_names)
         return selected_gpu
     
     # 5. Prefer entries with legacybranch (more specific)
-    with_legacy = [g for g in matching_gpus if g.get("legacybranch")]
+    with_legacy = [g for g in matching_gpus if g.legacy_branch]
     if with_legacy:
         matching_gpus = with_legacy
         if len(matching_gpus) == 1:
             selected_gpu = matching_gpus[0]
             # Show warning if originally had multiple matches and not suppressing warnings
             if len(all_matching_names) > 1 and not suppress_warnings:
-                show_multiple_match_warning(pci_info.get('device') if pci_info else None, selected_gpu["name"], all_matching_names)
+                _report_multiple_match(notices, pci_info.get('device') if pci_info else None, selected_gpu.name, all_matching_names)
             return selected_gpu
     
     # 6. Prefer entries with more features
-    max_features = max(len(g.get("features", [])) for g in matching_gpus)
-    with_max_features = [g for g in matching_gpus if len(g.get("features", [])) == max_features]
+    max_features = max(g.feature_count for g in matching_gpus)
+    with_max_features = [g for g in matching_gpus if g.feature_count == max_features]
     if len(with_max_features) == 1:
         selected_gpu = with_max_features[0]
         # Show warning if originally had multiple matches and not suppressing warnings
         if len(all_matching_names) > 1 and not suppress_warnings:
-            show_multiple_match_warning(pci_info.get('device') if pci_info else None, selected_gpu["name"], all_matching_names)
+            _report_multiple_match(notices, pci_info.get('device') if pci_info else None, selected_gpu.name, all_matching_names)
         return selected_gpu
     
     # 7. Prefer more specific names (avoid "unknown", "Generic", etc.)
@@ -1095,14 +1787,14 @@ def select_best_gpu_match(matching_gpus, pci_info=None, suppress_warnings=False)
             score += 10
         return score
     
-    best_score = max(name_specificity_score(g["name"]) for g in with_max_features)
-    best_matches = [g for g in with_max_features if name_specificity_score(g["name"]) == best_score]
+    best_score = max(name_specificity_score(g.name) for g in with_max_features)
+    best_matches = [g for g in with_max_features if name_specificity_score(g.name) == best_score]
     
     if len(best_matches) == 1:
         selected_gpu = best_matches[0]
         # Show warning if originally had multiple matches and not suppressing warnings
         if len(all_matching_names) > 1 and not suppress_warnings:
-            show_multiple_match_warning(pci_info.get('device') if pci_info else None, selected_gpu["name"], all_matching_names)
+            _report_multiple_match(notices, pci_info.get('device') if pci_info else None, selected_gpu.name, all_matching_names)
         return selected_gpu
     
     # 8. Original order - take the first one
@@ -1110,10 +1802,22 @@ def select_best_gpu_match(matching_gpus, pci_info=None, suppress_warnings=False)
     selected_gpu = matching_gpus[0]
     # Show warning if multiple matches and not suppressing warnings
     if len(all_matching_names) > 1 and not suppress_warnings:
-        show_multiple_match_warning(pci_info.get('device') if pci_info else None, selected_gpu["name"], all_matching_names)
+        _report_multiple_match(notices, pci_info.get('device') if pci_info else None, selected_gpu.name, all_matching_names)
     return selected_gpu
 
 
+def _report_multiple_match(notices, device_id, selected_name, all_names):
+    """Collect a multiple match notice, or print it if no collector was given"""
+    if notices is None:
+        show_multiple_match_warning(device_id, selected_name, all_names)
+    else:
+        notices.append({
+            "device_id": device_id,
+            "selected": selected_name,
+            "candidates": list(all_names),
+        })
+
+
 def show_multiple_match_warning(device_id, selected_name, all_names):
     """Show a warning when multiple GPU models match the same device ID
     
@@ -1139,556 +1843,3945 @@ def show_multiple_match_warning(device_id, selected_name, all_names):
     print("="*70 + "\n", file=sys.stderr)
 
 
-def is_laptop_system():
-    """Determine if the system is a laptop"""
+laptop_chassis_types = ["8", "9", "10", "11", "14"]
+laptop_chassis_words = ["laptop", "notebook", "portable", "hand"]
+
+
+def dmi_chassis_is_laptop():
+    """Check the DMI chassis type in /sys for a laptop form factor"""
+    chassis_type_path = "/sys/class/dmi/id/chassis_type"
+    if os.path.exists(chassis_type_path):
+        with open(chassis_type_path, "r") as f:
+            chassis_type = f.read().strip()
+            # Laptop chassis types: 8=Portable, 9=Laptop, 10=Notebook, 11=Hand Held, 14=Sub-Notebook
+            if chassis_type in laptop_chassis_types:
+                return True
+    return False
+
+
+def battery_present():
+    """Check whether the system has a battery"""
+    return os.path.exists("/sys/class/power_supply/BAT0")
+
+
+def parse_dmidecode_chassis(output):
+    """Check the output of "dmidecode -s chassis-type" for a laptop form factor"""
+    chassis_type = output.strip().lower()
+    return any(word in chassis_type for word in laptop_chassis_words)
+
+
+def dmidecode_is_laptop(timeout=2):
+    """Check the chassis type reported by dmidecode for a laptop form factor
+
+    Args:
+        timeout: Seconds to wait for dmidecode (not run at all if not positive)
+    """
+    if timeout <= 0:
+        logging.debug("dmidecode_is_laptop(): no time left to run dmidecode")
+        return False
     try:
-        # Check DMI chassis type
-        chassis_type_path = "/sys/class/dmi/id/chassis_type"
-        if os.path.exists(chassis_type_path):
-            with open(chassis_type_path, "r") as f:
-                chassis_type = f.read().strip()
-                # Laptop chassis types: 8=Portable, 9=Laptop, 10=Notebook, 11=Hand Held, 14=Sub-Notebook
-                if chassis_type in ["8", "9", "10", "11", "14"]:
-                    return True
-        
-        # Check for battery
-        if os.path.exists("/sys/class/power_supply/BAT0"):
-            return True
-        
-        # Check using dmidecode
-        try:
-            result = subprocess.run(
-                ["dmidecode", "-s", "chassis-type"],
-                capture_output=True,
-                text=True,
-                timeout=2
-            )
-            if result.returncode == 0:
-                chassis_type = result.stdout.strip().lower()
-                if any(word in chassis_type for word in ["laptop", "notebook", "portable", "hand"]):
-                    return True
-        except (subprocess.TimeoutExpired, FileNotFoundError):
-            pass
-        
+        result = subprocess.run(
+            ["dmidecode", "-s", "chassis-type"],
+            capture_output=True,
+            text=True,
+            timeout=timeout
+        )
+        if result.returncode == 0:
+            return parse_dmidecode_chassis(result.stdout)
+    except (subprocess.TimeoutExpired, FileNotFoundError):
+        pass
+    return False
+
+
+def is_laptop_system(timeout=2):
+    """Determine if the system is a laptop
+
+    Args:
+        timeout: Seconds to wait for the dmidecode fallback (see dmidecode_is_laptop())
+    """
+    try:
+        return dmi_chassis_is_laptop() or battery_present() or dmidecode_is_laptop(timeout)
     except Exception as e:
         logging.debug(f"is_laptop_system(): Could not determine system type: {e}")
     
     return False
 
 
-def get_nvidia_devices(sys_path, supported_gpus, simulate_gpu=None, suppress_warnings=False):
-    """Get a dictionary with all the NVIDIA graphics devices
-    
+def intern_features(features):
+    """Convert a list of feature strings into a bitmask and a VDPAU level
+
     Args:
-        sys_path: Optional alternative /sys path (for testing)
-        supported_gpus: Path to supported-gpus.json file
-        simulate_gpu: Simulated GPU ID for testing
-        suppress_warnings: Whether to suppress multiple match warnings (for MHWD/JSON output)
-        
+        features: Feature strings as found in supported-gpus.json
+
     Returns:
-        dict: Dictionary of Device objects keyed by device ID
+        tuple: (feature_mask: int, vdpau_level: int), where the VDPAU level is
+        1 for feature set A, 2 for B, ... and 0 if none is listed
     """
-    pci_class_display = "03"
-    
-    if simulate_gpu:
-        if simulate_gpu in simulated_gpus:
-            gpu_data = simulated_gpus[simulate_gpu]
-            modalias = gpu_data["modalias"]
-            modaliases = {modalias: '/sys/devices/pci0000:00/0000:00:01.0/0000:01:00.0'}
-        else:
-            logging.error(f"Unknown simulated GPU: {simulate_gpu}")
-            return None
-    else:
-        modaliases = get_system_modaliases(sys_path)
-    
-    json_path = supported_gpus
+    mask = 0
+    vdpau_level = 0
+    for feat in features:
+        feat = feat.lower()
+        if feat.find(vdpau_feature_prefix) != -1:
+            letter = feat.replace(vdpau_feature_prefix, "")[:1]
+            if letter:
+                vdpau_level = ord(letter) - ord("a") + 1
+            continue
+        bit = _feature_bits.get(feat)
+        if bit is None:
+            with _feature_lock:
+                bit = _feature_bits.get(feat)
+                if bit is None:
+                    bit = 1 << len(_feature_names)
+                    _feature_bits[feat] = bit
+                    _feature_names.append(feat)
+        mask |= bit
+    return mask, vdpau_level
 
-    devices = {}
-    
-    try:
-        with open(json_path, "r") as stream:
-            try:
-                gpus = list(json.load(stream)["chips"])
-            except Exception as e:
-                logging.error("failed to load %s: %s" % (json_path, e))
-                return None
-            
-            # Create a lookup dictionary for faster access
-            gpu_map = {}
-            for gpu in gpus:
-                devid = gpu["devid"]
-                if devid not in gpu_map:
-                    gpu_map[devid] = []
-                
-                # Store the GPU with its subsystem information if available
-                gpu_entry = gpu.copy()
-                # Normalize subsystem IDs to hex strings
-                if "subvendorid" in gpu_entry:
-                    if not gpu_entry["subvendorid"].startswith("0x"):
-                        gpu_entry["subvendorid"] = f"0x{gpu_entry['subvendorid']}"
-                if "subdevid" in gpu_entry:
-                    if not gpu_entry["subdevid"].startswith("0x"):
-                        gpu_entry["subdevid"] = f"0x{gpu_entry['subdevid']}"
-                
-                gpu_map[devid].append(gpu_entry)
-            
-            # Process each modalias
-            for alias, syspath in modaliases.items():
-                modalias_pattern = re.compile("(.+):v(.+)d(.+)sv(.+)sd(.+)bc(.+)sc(.+)i.*")
-
-                details = modalias_pattern.match(alias)
-                if details:
-                    if details.group(1) == "pci":
-                        vendor = details.group(2)[4:]
-                        devid = "0x%s" % details.group(3)[4:]
-                        subsys_vendor = "0x%s" % details.group(4)[4:]
-                        subsys_device = "0x%s" % details.group(5)[4:]
-                        classid = details.group(6)
-
-                        if vendor.lower() == "10de" and classid == pci_class_display:
-                            logging.debug(
-                                "get_nvidia_devices(): Processing Vendor: %s, Device ID: %s, Subsystem: %s:%s, class %s"
-                                % (vendor, devid, subsys_vendor, subsys_device, 
-                                   "0x%s%s" % (details.group(6), details.group(7)))
-                            )
-                            
-                            # Get PCI device information from sysfs
-                            pci_info = get_pci_device_info(syspath) if not simulate_gpu else None
-                            
-                            # Create PCI info dictionary for matching
-                            pci_match_info = {
-                                "subsystem_vendor": subsys_vendor,
-                                "subsystem_device": subsys_device,
-                                "device": devid
-                            }
-                            if pci_info:
-                                pci_match_info.update(pci_info)
-                            if simulate_gpu:
-                                pci_match_info["simulate_gpu"] = simulate_gpu
-                            
-                            if devid in gpu_map:
-                                matching_gpus = gpu_map[devid]
-                                
-                                if len(matching_gpus) == 1:
-                                    # Single match - straightforward
-                                    gpu = matching_gpus[0]
-                                    device = Device(
-                                        devid, gpu["name"], gpu["features"], 
-                                        gpu.get("legacybranch"),
-                                        gpu.get("subvendorid"),
-                                        gpu.get("subdevid")
-                                    )
-                                    devices[devid] = device
-                                    logging.debug("get_nvidia_devices(): Single match for %s -> %s" % (devid, gpu["name"]))
-                                else:
-                                    # Multiple matches - need to choose the best one
-                                    logging.debug("get_nvidia_devices(): Multiple matches for %s" % devid)
-                                    
-                                    best_gpu = select_best_gpu_match(matching_gpus, pci_match_info, suppress_warnings)
-                                    device = Device(
-                                        devid, best_gpu["name"], best_gpu["features"], 
-                                        best_gpu.get("legacybranch"),
-                                        best_gpu.get("subvendorid"),
-                                        best_gpu.get("subdevid")
-                                    )
-                                    devices[devid] = device
-                                    
-                                    # Log all options for debugging
-                                    logging.debug(f"get_nvidia_devices(): Options for {devid}:")
-                                    for i, gpu in enumerate(matching_gpus):
-                                        # Create temp device for accurate mobile detection
-                                        temp_dev = Device(gpu["devid"], gpu["name"], gpu.get("features", []), 
-                                                         gpu.get("legacybranch"), gpu.get("subvendorid"), gpu.get("subdevid"))
-                                        is_mobile = "M" if temp_dev.is_laptop_gpu else "D"
-                                        subvendor = gpu.get("subvendorid", "N/A")
-                                        subdevice = gpu.get("subdevid", "N/A")
-                                        logging.debug(f"  Option {i+1}: {gpu['name']} ({is_mobile}) - Subsystem: {subvendor}:{subdevice}")
-                                    
-                                    logging.info("get_nvidia_devices(): Selected best match for %s -> %s" % (devid, best_gpu["name"]))
-                            else:
-                                # Unknown GPU
-                                dev = Device(devid, "unknown", [], "", None, None)
-                                dev.driver_hint = default
-                                devices[devid] = dev
-                                logging.info("get_nvidia_devices(): Unknown GPU ID %s" % devid)
-                    
-    except (IOError, FileNotFoundError, PermissionError) as e:
-        logging.error("failed to read read %s: %s" % (json_path, e))
-        return None
-    
-    # Debug: log how many devices we found
-    logging.debug("get_nvidia_devices(): Created %d Device objects" % len(devices))
-    
-    return devices
 
+def feature_names(feature_mask, vdpau_level=0):
+    """Decode a feature bitmask (and VDPAU level) back into feature strings"""
+    names = [name for bit, name in enumerate(_feature_names) if feature_mask & (1 << bit)]
+    if vdpau_level:
+        names.append(vdpau_feature_prefix + chr(ord("a") + vdpau_level - 1))
+    return names
+
+
+@functools.lru_cache(maxsize=4096)
+def classify_device_name(name):
+    """Classify a GPU name once; the database repeats names a lot
 
-def ubuntu_get_latest_driver_branch(path="/"):
-    """Get the latest driver branch available in Ubuntu's repositories
-    
-    Args:
-        path: Root path for dpkg status file
-        
     Returns:
-        str: Latest available driver branch number or None
+        tuple: (architecture: str, is_laptop_gpu: bool)
     """
-    try:
-        import apt_pkg
-    except ModuleNotFoundError:
-        print(
-            "Error: please install the following package and try again:\n  python3-apt",
-            file=sys.stderr,
+    return Device._get_architecture_from_device_name(name), Device._is_laptop_gpu(name)
+
+
+class Chip(object):
+    """Compact record of one supported-gpus.json entry
+
+    Features are interned into a bitmask and the VDPAU feature set into a
+    small integer when the database is loaded, so nothing has to be parsed
+    again when a Device is built from the record.
+    """
+    __slots__ = ("devid", "name", "feature_mask", "vdpau_level", "legacy_branch", "subvendorid", "subdevid")
+
+    def __init__(self, devid, name, feature_mask, vdpau_level=0, legacy_branch=None, subvendorid=None, subdevid=None):
+        self.devid = devid
+        self.name = name
+        self.feature_mask = feature_mask
+        self.vdpau_level = vdpau_level
+        self.legacy_branch = legacy_branch
+        self.subvendorid = subvendorid
+        self.subdevid = subdevid
+
+    @classmethod
+    def from_json(cls, entry):
+        """Build a record from a supported-gpus.json entry
+
+        Subsystem IDs are normalized to "0x"-prefixed hex strings.
+        """
+        mask, vdpau_level = intern_features(entry.get("features", []))
+        return cls(
+            sys.intern(entry["devid"]), entry["name"], mask, vdpau_level, entry.get("legacybranch"),
+            cls.normalize_id(entry.get("subvendorid")), cls.normalize_id(entry.get("subdevid"))
         )
-        exit(1)
 
-    apt_pkg.init_config()
-    dpkg_status = os.path.abspath(os.path.join(path, "var", "lib", "dpkg", "status"))
-    apt_pkg.config.set("Dir::State::status", dpkg_status)
-    apt_pkg.init_system()
-    cache = apt_pkg.Cache(None)
-    candidates = []
-    for package in cache.packages:
-        branch = re.search(r"nvidia-driver-([0-9]+)-open", package.name)
-        if branch:
-            candidates.append(branch.group(1))
+    @staticmethod
+    def normalize_id(value):
+        """Prefix a subsystem ID with "0x" if needed (None stays None)"""
+        if value and not value.startswith("0x"):
+            return f"0x{value}"
+        return value
 
-    if candidates:
-        candidates.sort()
-        return candidates[-1]
-    else:
-        return None
+    @property
+    def key(self):
+        """Overlay merge key: (devid, subvendorid, subdevid), case insensitive"""
+        return (self.devid.lower(), (self.subvendorid or "").lower(), (self.subdevid or "").lower())
 
+    @property
+    def features(self):
+        """Feature strings (lower case) of this record"""
+        return feature_names(self.feature_mask, self.vdpau_level)
 
-def manjaro_get_kernel_package():
-    """Get kernel package name for Manjaro (e.g., linux618 from 6.18.xx)
-    
-    Returns:
-        str: Kernel package name
-    """
-    try:
-        kernel_release = platform.release().split(".")
-        if len(kernel_release) >= 2:
-            return f"linux{kernel_release[0]}{kernel_release[1]}"
-    except Exception as e:
-        logging.debug("Failed to get kernel package name: %s", e)
-    return "linux"
+    @property
+    def feature_count(self):
+        """Number of features listed for this record in supported-gpus.json"""
+        return bin(self.feature_mask).count("1") + (1 if self.vdpau_level else 0)
 
+    def to_json(self):
+        """Get the supported-gpus.json representation of this record"""
+        entry = {"devid": self.devid, "name": self.name, "features": self.features}
+        if self.legacy_branch:
+            entry["legacybranch"] = self.legacy_branch
+        if self.subvendorid:
+            entry["subvendorid"] = self.subvendorid
+        if self.subdevid:
+            entry["subdevid"] = self.subdevid
+        return entry
 
-def manjaro_get_legacy_branch(devices):
-    """Get legacy branch for Manjaro based on detected devices
-    
-    Args:
-        devices: Dictionary of Device objects
-        
-    Returns:
-        str: Highest legacy branch number or None
-    """
-    highest_branch = None
-    for dev in devices.values():
-        if dev.legacy_branch:
-            branch_major = dev.legacy_branch.split('.')[0]
-            if highest_branch is None:
-                highest_branch = branch_major
-            else:
-                try:
-                    if int(branch_major) > int(highest_branch):
-                        highest_branch = branch_major
-                except ValueError:
-                    pass
-    
-    return highest_branch
 
+class GpuDatabase(object):
+    """Chip records of supported-gpus.json indexed by device ID
 
-def print_pretty_gpu_summary(devices):
-    """Print a formatted summary of detected GPUs
-    
     Args:
-        devices: Dictionary of Device objects
+        chips: Iterable of Chip records, in database order
+        path: Path the records were loaded from (informational)
     """
-    if not devices:
-        print("No NVIDIA GPUs detected")
-        return
-    
-    print("Detected GPUs:")
-    print("-" * 70)
-    for dev_id, dev in devices.items():
-        arch_info = f" [{dev.architecture}]" if dev.architecture != "unknown" else ""
-        type_info = " (Mobile)" if dev.is_laptop_gpu else " (Desktop)"
-        legacy_info = f" (legacy: {dev.legacy_branch})" if dev.legacy_branch else ""
-        
-        # Add subsystem information if available
-        subsystem_info = ""
-        if dev.subvendorid and dev.subdevid:
-            subsystem_info = f" [Subsystem: {dev.subvendorid}:{dev.subdevid}]"
-        
-        print(f"  {dev.name}{arch_info}{type_info}{subsystem_info}")
-        print(f"    PCI ID: {dev_id}{legacy_info}")
-        if dev.driver_hint:
-            driver_type = "open" if dev.driver_hint in [default, open_supported] else "proprietary"
-            print(f"    → Recommended driver type: {driver_type}")
-        print()
-    print("-" * 70)
-    print()
+    __slots__ = ("path", "index", "count", "overlays")
 
+    def __init__(self, chips, path=None):
+        index = {}
+        count = 0
+        for chip in chips:
+            index.setdefault(chip.devid, []).append(chip)
+            count += 1
+        self.path = path
+        self.index = {devid: tuple(entries) for devid, entries in index.items()}
+        self.count = count
+        self.overlays = ()
 
-def get_driver_from_vdpau_feat(devices):
-    """Use the supported VDPAU feature sets to recommend a driver (older method)
-    
-    Args:
-        devices: Dictionary of Device objects
-        
-    Returns:
-        str: "open" or "closed" driver recommendation
-    """
-    hints = []
-    for dev in devices.values():
-        if dev.vdpau_feat:
-            if dev.vdpau_feat in vdpau_group_a:
-                hint = proprietary_required
-                continue
-            elif dev.vdpau_feat in vdpau_group_b:
-                hint = proprietary_required
-            elif dev.vdpau_feat in vdpau_group_c:
-                hint = proprietary_supported
-            else:
-                hint = default
-        else:
-            if dev.legacy_branch and int(dev.legacy_branch.split(".")[0]) <= 470:
-                hint = proprietary_required
+    def apply_overlay(self, entries, source=None):
+        """Merge the entries of an overlay file into the index, in place
+
+        Every entry is matched by (devid, subvendorid, subdevid) through the
+        device ID index, so merging costs one dictionary lookup per entry.
+        Its optional "merge" key selects the semantics:
+
+        - "override" (default): replace the entries with the same key, or add it
+        - "append": add it next to the entries with the same key
+        - "update": change only the given fields of the entries with the same key
+        - "remove": drop the entries with the same key
+
+        Args:
+            entries: supported-gpus.json style entries
+            source: Overlay file name, for error messages
+
+        Raises:
+            AssistantError: If an entry is invalid
+        """
+        source = source or "overlay"
+        for position, entry in enumerate(entries):
+            try:
+                entry = dict(entry)
+                mode = entry.pop("merge", "override")
+                devid = entry["devid"]
+                key = (
+                    devid.lower(),
+                    (Chip.normalize_id(entry.get("subvendorid")) or "").lower(),
+                    (Chip.normalize_id(entry.get("subdevid")) or "").lower(),
+                )
+                if mode not in overlay_merge_modes:
+                    raise ValueError("unknown merge mode %r" % mode)
+                # Use the spelling of the device ID the base file is indexed by ("0x1E04")
+                existing = ()
+                for candidate in (devid, devid.lower(), devid.upper().replace("0X", "0x")):
+                    if candidate in self.index:
+                        devid, existing = candidate, self.index[candidate]
+                        break
+                entry["devid"] = devid
+                matched = [chip for chip in existing if chip.key == key]
+
+                # Changed entries keep their place: the first entry of a device
+                # ID is the fallback of select_best_gpu_match()
+                if mode == "override":
+                    replacement = Chip.from_json(entry)
+                    merged = []
+                    for chip in existing:
+                        if chip.key != key:
+                            merged.append(chip)
+                        elif replacement is not None:
+                            merged.append(replacement)
+                            replacement = None
+                    if replacement is not None:
+                        merged.append(replacement)
+                elif mode == "append":
+                    merged = list(existing) + [Chip.from_json(entry)]
+                elif mode == "update":
+                    if not matched:
+                        raise ValueError("no entry to update")
+                    merged = [Chip.from_json(dict(chip.to_json(), **entry)) if chip.key == key else chip
+                              for chip in existing]
+                else:
+                    merged = [chip for chip in existing if chip.key != key]
+            except (KeyError, TypeError, AttributeError, ValueError) as e:
+                raise AssistantError("invalid entry #%d in %s: %s" % (position, source, e))
+
+            self.count += len(merged) - len(existing)
+            if merged:
+                self.index[devid] = tuple(merged)
             else:
-                hint = default
-        hints.append(hint)
+                self.index.pop(devid, None)
 
-    if default in hints:
-        return "open"
-    else:
-        if proprietary_required in hints:
-            return "closed"
-        else:
-            return "open"
+    def lookup(self, devid):
+        """Get the records matching a device ID (an empty tuple if unknown)"""
+        return self.index.get(devid, ())
 
-    return None
+    def __contains__(self, devid):
+        return devid in self.index
 
+    def __len__(self):
+        return self.count
 
-def get_driver_from_json_hints(devices):
-    """Use the flags in supported-gpus.json to recommend a driver (primary method)
-    
-    Args:
-        devices: Dictionary of Device objects
-        
-    Returns:
-        str: "open" or "closed" driver recommendation
-    """
-    hints = [dev.driver_hint for dev in devices.values()]
-    
-    for dev in devices.values():
-        logging.debug(
-            "Device analysis: %s (ID: %s) - Arch: %s - Type: %s - Subsystem: %s:%s - JSON hint: %s - Final hint: %s",
-            dev.name, dev.id, dev.architecture, 
-            "Mobile" if dev.is_laptop_gpu else "Desktop",
-            dev.subvendorid or "N/A", dev.subdevid or "N/A",
-            "open" if open_supported in dev.features else "proprietary",
-            dev.driver_hint
-        )
-    
-    proprietary_forced_devices = [
-        dev.name for dev in devices.values() 
-        if dev.architecture in OPEN_UNSUPPORTED_ARCHS and 
-        dev.driver_hint == proprietary_required
-    ]
-    
-    if proprietary_forced_devices:
-        logging.debug(
-            "JSON corrections applied for architectures that don't support open kernel: %s", 
-            ", ".join(proprietary_forced_devices)
-        )
-    
-    all_support_open = all(hint in (default, proprietary_supported) for hint in hints)
-    all_require_closed = all(hint == proprietary_required for hint in hints)
-    any_default = any(hint == default for hint in hints)
-    any_require_closed = any(hint == proprietary_required for hint in hints)
+    def __iter__(self):
+        for entries in self.index.values():
+            for chip in entries:
+                yield chip
 
-    if all_support_open:
-        logging.debug("recommend_driver(): all devices support open")
-        return "open"
-    elif all_require_closed:
-        logging.debug("recommend_driver(): all devices require closed")
-        return "closed"
-    elif any_default:
-        logging.debug("recommend_driver(): at least one devices requires open")
-        return "open"
-    elif any_require_closed:
-        logging.debug("recommend_driver(): at least one devices requires closed")
-        return "closed"
-    else:
-        logging.error("unimplemented - hints:\n%s" % (" ".join(hints)))
-        return None
 
+class SharedGpuDatabase(object):
+    """Read-only GpuDatabase in a multiprocessing.shared_memory segment
+
+    One process publishes a loaded database with create(), worker processes
+    attach() to the segment by name instead of parsing supported-gpus.json
+    and holding their own index. The segment holds fixed-width records of
+    string table references:
+
+    - header: magic, format, record and device ID counts, string table
+      offset, path and overlay references
+    - records in the iteration order of the GpuDatabase (devid, name,
+      comma separated features, legacy branch, subsystem IDs)
+    - device ID index sorted by device ID: (devid, first record, count)
+    - string table: UTF-8 strings with a 32-bit length prefix, each stored once
+
+    lookup() binary searches the device ID index and builds the Chip
+    records of the matches, so its results equal GpuDatabase.lookup().
 
-def recommend_driver(sys_path=None, supported_gpus=None, use_driver_hints=False, simulate_gpu=None, mhwd=False, suppress_warnings=False):
-    """Recommend a driver using the available logic
-    
     Args:
-        sys_path: Optional alternative /sys path (for testing)
-        supported_gpus: Path to supported-gpus.json file
-        use_driver_hints: Whether to use JSON hints (True) or VDPAU logic (False)
-        simulate_gpu: Simulated GPU ID for testing
-        mhwd: Whether running in MHWD mode (Manjaro Hardware Detection)
-        suppress_warnings: Whether to suppress multiple match warnings
-        
-    Returns:
-        tuple: (driver_type: str, devices: dict) or (None, None) on failure
+        shm: Attached SharedMemory segment
+        owner: Whether close() should also unlink the segment
     """
-    devices = get_nvidia_devices(sys_path, supported_gpus, simulate_gpu, suppress_warnings)
-    if not mhwd and not suppress_warnings:
-        print_pretty_gpu_summary(devices)
+    __slots__ = ("path", "overlays", "count", "_shm", "_buffer", "_devids", "_strings", "_features", "_owner")
 
-    if not devices:
-        return None, None
+    MAGIC = b"NDAS"
+    FORMAT = 2
+    HEADER = struct.Struct("<4sIIIIII")
+    RECORD = struct.Struct("<IIIIII")
+    DEVID = struct.Struct("<III")
+    LENGTH = struct.Struct("<I")
+    NONE = 0xFFFFFFFF
 
-    logging.debug("recommend_driver(): Do device IDs support the open driver?")
+    def __init__(self, shm, owner=False):
+        self._shm = shm
+        self._owner = owner
+        self._buffer = shm.buf
+        magic, version, self.count, devids, self._strings, path, overlays = self.HEADER.unpack_from(self._buffer)
+        if magic != self.MAGIC or version != self.FORMAT:
+            self._buffer = None
+            shm.close()
+            raise AssistantError("%s is not a shared GPU database segment" % shm.name)
+        self._devids = (self.HEADER.size + self.count * self.RECORD.size, devids)
+        self.path = self._string(path)
+        overlays = self._string(overlays)
+        self.overlays = tuple(overlays.split("\n")) if overlays else ()
+        # Interned features of each distinct feature list (feature bits are per process)
+        self._features = {}
 
-    if use_driver_hints:
+    @classmethod
+    def create(cls, database, name=None):
+        """Copy a loaded database into a new shared memory segment
+
+        The caller owns the segment: close() (or the context manager) also
+        unlinks it, after which no new worker can attach.
+
+        Args:
+            database: GpuDatabase to share
+            name: Segment name (generated if None)
+
+        Returns:
+            SharedGpuDatabase: View of the new segment, see name
+        """
+        from multiprocessing import shared_memory
+
+        strings = bytearray()
+        refs = {}
+
+        def ref(value):
+            if value is None:
+                return cls.NONE
+            if value not in refs:
+                data = value.encode("utf-8")
+                refs[value] = len(strings)
+                strings.extend(cls.LENGTH.pack(len(data)))
+                strings.extend(data)
+            return refs[value]
+
+        # Grouped by the index keys, which lookup() is called with, rather
+        # than by the devid spelling of the records
+        records = bytearray()
+        groups = {}
+        for devid, entries in database.index.items():
+            groups[devid] = (len(records) // cls.RECORD.size, len(entries))
+            for chip in entries:
+                records.extend(cls.RECORD.pack(
+                    ref(chip.devid), ref(chip.name), ref(",".join(chip.features)), ref(chip.legacy_branch),
+                    ref(chip.subvendorid), ref(chip.subdevid)
+                ))
+        index = bytearray()
+        for devid in sorted(groups, key=lambda devid: devid.encode("utf-8")):
+            index.extend(cls.DEVID.pack(ref(devid), *groups[devid]))
+        path_ref = ref(database.path)
+        overlays_ref = ref("\n".join(database.overlays))
+
+        strings_offset = cls.HEADER.size + len(records) + len(index)
+        header = cls.HEADER.pack(
+            cls.MAGIC, cls.FORMAT, len(records) // cls.RECORD.size, len(groups), strings_offset, path_ref,
+            overlays_ref
+        )
+        size = strings_offset + len(strings)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        shm.buf[:size] = header + records + index + strings
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Attach to a segment published with create()
+
+        Raises:
+            AssistantError: If the segment does not exist or is not a database
+        """
+        from multiprocessing import shared_memory
+
+        try:
+            try:
+                shm = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                # Before Python 3.13 an attaching process registers the segment
+                # with its resource tracker, which would unlink it when the
+                # process exits
+                from multiprocessing import resource_tracker
+                shm = shared_memory.SharedMemory(name=name)
+                resource_tracker.unregister(shm._name, "shared_memory")
+        except (OSError, ValueError) as e:
+            raise AssistantError("cannot attach the shared GPU database %s: %s" % (name, e))
+        return cls(shm)
+
+    @property
+    def name(self):
+        """Name of the segment, passed to attach() in the workers"""
+        return self._shm.name
+
+    def close(self):
+        """Detach from the segment (and unlink it when created here)"""
+        if self._buffer is None:
+            return
+        self._buffer.release()
+        self._buffer = None
+        self._shm.close()
+        if self._owner:
+            if sys.version_info < (3, 13):
+                # Pool workers share the creator's resource tracker, so the
+                # unregister of an attaching worker may have dropped the
+                # creator's registration; unlink() unregisters it again
+                from multiprocessing import resource_tracker
+                resource_tracker.register(self._shm._name, "shared_memory")
+            self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _string(self, ref):
+        if ref == self.NONE:
+            return None
+        offset = self._strings + ref
+        length, = self.LENGTH.unpack_from(self._buffer, offset)
+        offset += self.LENGTH.size
+        return str(self._buffer[offset:offset + length], "utf-8")
+
+    def _chip(self, position):
+        devid, name, features, legacy, subvendorid, subdevid = self.RECORD.unpack_from(
+            self._buffer, self.HEADER.size + position * self.RECORD.size
+        )
+        interned = self._features.get(features)
+        if interned is None:
+            names = self._string(features)
+            interned = self._features[features] = intern_features(names.split(",") if names else [])
+        return Chip(
+            sys.intern(self._string(devid)), self._string(name), interned[0], interned[1],
+            self._string(legacy), self._string(subvendorid), self._string(subdevid)
+        )
+
+    def _find(self, devid):
+        """Binary search the device ID index, (first, count) or None"""
+        key = devid.encode("utf-8")
+        offset, count = self._devids
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            ref, first, matches = self.DEVID.unpack_from(self._buffer, offset + middle * self.DEVID.size)
+            position = self._strings + ref
+            length, = self.LENGTH.unpack_from(self._buffer, position)
+            position += self.LENGTH.size
+            candidate = bytes(self._buffer[position:position + length])
+            if candidate < key:
+                low = middle + 1
+            elif candidate > key:
+                high = middle
+            else:
+                return first, matches
+        return None
+
+    def lookup(self, devid):
+        """Get the records matching a device ID (an empty tuple if unknown)"""
+        found = self._find(devid)
+        if found is None:
+            return ()
+        first, count = found
+        return tuple(self._chip(position) for position in range(first, first + count))
+
+    def __contains__(self, devid):
+        return self._find(devid) is not None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for position in range(self.count):
+            yield self._chip(position)
+
+
+def open_database_stream(json_path):
+    """Open a supported-gpus.json file, decompressing it on the fly
+
+    gzip and xz files are recognized by their magic bytes, whatever their
+    name; the data is decompressed while the JSON parser reads it.
+
+    Args:
+        json_path: Path to a plain, gzip or xz compressed supported-gpus.json
+
+    Returns:
+        file: Text stream of the JSON document
+
+    Raises:
+        AssistantError: If the compression is not supported by this Python
+    """
+    with open(json_path, "rb") as f:
+        magic = f.read(6)
+
+    if magic.startswith(b"\x1f\x8b"):
+        import gzip
+        return gzip.open(json_path, "rt")
+    if magic.startswith(b"\xfd7zXZ\x00"):
+        try:
+            import lzma
+        except ImportError:
+            raise AssistantError("cannot read %s: Python was built without xz support" % json_path)
+        return lzma.open(json_path, "rt")
+    return open(json_path, "r")
+
+
+def split_database_paths(supported_gpus):
+    """Split a database argument into the base file and its overlay files
+
+    Args:
+        supported_gpus: Path, or list of paths whose first item is the base file
+
+    Returns:
+        tuple: (base path or None, tuple of overlay paths)
+    """
+    if not supported_gpus:
+        return None, ()
+    if isinstance(supported_gpus, (list, tuple)):
+        return supported_gpus[0], tuple(supported_gpus[1:])
+    return supported_gpus, ()
+
+
+def read_gpu_entries(json_path):
+    """Read the "chips" list of a supported-gpus.json (or overlay) file
+
+    Raises:
+        AssistantError: If the file cannot be read or parsed
+    """
+    try:
+        with open_database_stream(json_path) as stream:
+            try:
+                return list(json.load(stream)["chips"])
+            except Exception as e:
+                raise AssistantError("failed to load %s: %s" % (json_path, e))
+    except (IOError, FileNotFoundError, PermissionError) as e:
+        raise AssistantError("failed to read read %s: %s" % (json_path, e))
+
+
+def load_gpu_database(json_path, cache_path=None):
+    """Load supported-gpus.json into a lookup dictionary keyed by device ID
+
+    If overlay files are given, they are merged in order into the index (see
+    GpuDatabase.apply_overlay()). With a cache path the merged database is
+    stored there and reused as long as none of the files changed.
+
+    Args:
+        json_path: Path to supported-gpus.json file (optionally .gz or .xz
+            compressed), or a list of it followed by overlay files
+        cache_path: Optional file holding the merged database
+
+    Returns:
+        GpuDatabase: Chip records indexed by device ID
+
+    Raises:
+        AssistantError: If a file cannot be read or parsed
+    """
+    json_path, overlays = split_database_paths(json_path)
+    if not json_path:
+        raise AssistantError("no supported-gpus.json file was found")
+
+    stamp = None
+    if overlays and cache_path:
+        stamp = [get_file_stamp(path) for path in (json_path,) + overlays]
+        database = load_merged_database(cache_path, stamp, json_path)
+        if database is not None:
+            database.overlays = overlays
+            return database
+
+    gpus = read_gpu_entries(json_path)
+    try:
+        database = GpuDatabase((Chip.from_json(gpu) for gpu in gpus), json_path)
+    except (KeyError, TypeError, AttributeError) as e:
+        raise AssistantError("failed to load %s: invalid entry: %s" % (json_path, e))
+
+    for overlay in overlays:
+        database.apply_overlay(read_gpu_entries(overlay), overlay)
+    database.overlays = overlays
+
+    if stamp is not None:
+        save_merged_database(cache_path, stamp, database)
+    return database
+
+
+def load_merged_database(path, stamp, json_path=None):
+    """Load a merged database stored by save_merged_database()
+
+    Returns:
+        GpuDatabase: The stored database, or None if missing or stale
+    """
+    try:
+        with open(path, "r") as f:
+            cached = json.load(f)
+        if cached.get("format") != MERGED_DATABASE_FORMAT or cached.get("stamp") != stamp:
+            logging.debug("load_merged_database(): %s is stale" % path)
+            return None
+        return GpuDatabase((Chip.from_json(gpu) for gpu in cached["chips"]), json_path)
+    except (IOError, OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        logging.debug("load_merged_database(): cannot use %s: %s" % (path, e))
+        return None
+
+
+def save_merged_database(path, stamp, database):
+    """Store a merged database (failures are only logged)"""
+    data = {
+        "format": MERGED_DATABASE_FORMAT,
+        "stamp": stamp,
+        "chips": [chip.to_json() for chip in database],
+    }
+    try:
+        write_file_atomic(path, json.dumps(data, separators=(",", ":")))
+    except OSError as e:
+        logging.debug("save_merged_database(): cannot write %s: %s" % (path, e))
+
+
+def tokenize_name(name):
+    """Split a GPU name into lower case alphanumeric tokens"""
+    return re.findall(r"[a-z0-9]+", name.lower())
+
+
+def name_trigrams(tokens):
+    """Get the character trigrams of name tokens, each padded with spaces"""
+    grams = set()
+    for token in tokens:
+        padded = " %s " % token
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+def get_database_stamp(database):
+    """Get the file stamps of a loaded database and its overlays"""
+    return [get_file_stamp(path) for path in (database.path,) + tuple(database.overlays)]
+
+
+class NameIndex(object):
+    """Inverted token and trigram index over the chip names of a database
+
+    Postings hold positions in the database's iteration order, so a stored
+    index can be reattached to the same database (see load_name_index()).
+
+    Args:
+        chips: Chip records, in database order
+        tokens: Prebuilt token postings (built from the chips if None)
+        trigrams: Prebuilt trigram postings (built from the chips if None)
+    """
+    __slots__ = ("chips", "tokens", "trigrams")
+
+    def __init__(self, chips, tokens=None, trigrams=None):
+        self.chips = list(chips)
+        if tokens is None or trigrams is None:
+            tokens = {}
+            trigrams = {}
+            for position, chip in enumerate(self.chips):
+                chip_tokens = set(tokenize_name(chip.name))
+                for token in chip_tokens:
+                    tokens.setdefault(token, []).append(position)
+                for gram in name_trigrams(chip_tokens):
+                    trigrams.setdefault(gram, []).append(position)
+        self.tokens = tokens
+        self.trigrams = trigrams
+
+    def search(self, query, limit=10, min_coverage=0.5):
+        """Find the chips whose name best matches a query
+
+        A chip scores the fraction of query tokens its name contains plus
+        the fraction of query trigrams it contains; chips with less than
+        ``min_coverage`` of the trigrams are dropped, so typos and missing
+        spaces ("1660super") still match. Ties go to the shorter name.
+
+        Returns:
+            list: (Chip, score) tuples, best first
+        """
+        query_tokens = set(tokenize_name(query))
+        if not query_tokens:
+            return []
+        query_grams = name_trigrams(query_tokens)
+
+        gram_hits = collections.Counter()
+        for gram in query_grams:
+            gram_hits.update(self.trigrams.get(gram, ()))
+        token_hits = collections.Counter()
+        for token in query_tokens:
+            token_hits.update(self.tokens.get(token, ()))
+
+        ranked = []
+        for position, hits in gram_hits.items():
+            coverage = hits / len(query_grams)
+            if coverage < min_coverage:
+                continue
+            score = token_hits[position] / len(query_tokens) + coverage
+            chip = self.chips[position]
+            ranked.append((-score, len(chip.name), chip.devid, position, score))
+        ranked.sort()
+        return [(self.chips[entry[3]], round(entry[4], 3)) for entry in ranked[:limit]]
+
+    def to_json(self, stamp):
+        """Get the stored form of this index (see load_name_index())"""
+        return {
+            "format": NAME_INDEX_FORMAT,
+            "stamp": stamp,
+            "count": len(self.chips),
+            "tokens": self.tokens,
+            "trigrams": self.trigrams,
+        }
+
+
+def load_name_index(database, cache_path=None):
+    """Get the name index of a database, from the cache file if still valid
+
+    Args:
+        database: Loaded GpuDatabase
+        cache_path: Optional file holding the index; rebuilt and stored there if stale
+
+    Returns:
+        NameIndex: Index over the database's chip names
+    """
+    stamp = get_database_stamp(database) if cache_path else None
+    if cache_path:
+        try:
+            with open(cache_path, "r") as f:
+                cached = json.load(f)
+            if (cached.get("format") == NAME_INDEX_FORMAT and cached.get("stamp") == stamp
+                    and cached.get("count") == len(database)):
+                return NameIndex(database, cached["tokens"], cached["trigrams"])
+            logging.debug("load_name_index(): %s is stale" % cache_path)
+        except (IOError, OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logging.debug("load_name_index(): cannot use %s: %s" % (cache_path, e))
+
+    index = NameIndex(database)
+    if cache_path:
+        try:
+            write_file_atomic(cache_path, json.dumps(index.to_json(stamp), separators=(",", ":")))
+        except OSError as e:
+            logging.debug("load_name_index(): cannot write %s: %s" % (cache_path, e))
+    return index
+
+
+class BranchIndex(object):
+    """Reverse index from maximum driver branch and architecture to chips
+
+    Chips are grouped by the (maximum driver major, architecture) pair the
+    supported range depends on (see Device._get_supported_range()), so range
+    questions are answered once per group instead of once per chip.
+
+    Args:
+        chips: Chip records, in database order
+    """
+    __slots__ = ("groups",)
+
+    def __init__(self, chips):
+        groups = {}
+        for chip in chips:
+            key = (Device.get_max_driver(chip.legacy_branch), classify_device_name(chip.name)[0])
+            groups.setdefault(key, []).append(chip)
+        self.groups = groups
+
+    def select(self, legacy_major=None, dropped_at=None, architecture=None, policy=None):
+        """Select chips by legacy branch, dropped support or architecture
+
+        Args:
+            legacy_major: Only legacy chips whose legacybranch major is this ("470")
+            dropped_at: Only chips not supported by this branch or newer, i.e. whose
+                maximum driver is older (minimum drivers come from the policy)
+            architecture: Only chips of this architecture
+            policy: Policy providing the architecture minimum drivers
+
+        Returns:
+            list: Chip summaries (see chip_range_summary()), grouped by branch and architecture
+        """
+        if policy is None:
+            policy = Policy.default()
+
+        results = []
+        for (max_driver, arch), chips in sorted(self.groups.items(), key=lambda item: (int(item[0][0]), item[0][1])):
+            if architecture and arch != architecture.lower():
+                continue
+            if dropped_at is not None and int(max_driver) >= int(dropped_at):
+                continue
+            for chip in chips:
+                if legacy_major is not None and not (chip.legacy_branch and max_driver == str(legacy_major)):
+                    continue
+                results.append(chip_range_summary(chip, arch, policy.min_driver(arch), max_driver))
+        return results
+
+
+def chip_range_summary(chip, architecture, min_driver, max_driver):
+    """Get the JSON summary of a chip's supported driver range"""
+    return {
+        "pci_id": chip.devid,
+        "name": chip.name,
+        "architecture": architecture,
+        "legacy": chip.legacy_branch,
+        "subsystem_vendor": chip.subvendorid,
+        "subsystem_device": chip.subdevid,
+        "supported_min_driver": min_driver,
+        "supported_max_driver": max_driver,
+    }
+
+
+CompatibilityMatrix = collections.namedtuple(
+    "CompatibilityMatrix", ["branches", "chips", "min_driver", "max_driver", "compatible"]
+)
+
+
+def get_known_branches(index, policy):
+    """Get every driver branch the database and the policy refer to
+
+    Returns:
+        list: Sorted branch majors (int): the architecture minimum drivers,
+        the legacy branches and the distribution override branches
+    """
+    branches = set(int(branch) for arch, branch in policy.architecture_min_driver)
+    branches.update(int(max_driver) for max_driver, arch in index.groups if max_driver != "999")
+    for branch in (policy.distro_non_legacy_default_branch, policy.distro_580_legacy_override_branch,
+                   policy.distro_legacy_override_branch):
+        if branch and str(branch).isdigit():
+            branches.add(int(branch))
+    return sorted(branches)
+
+
+def build_compatibility_matrix(index, policy=None, branches=None):
+    """Evaluate every driver branch against every chip in one pass
+
+    The check matches Device._check_driver_compatibility() without a legacy
+    override: a branch is compatible when it lies within the chip's supported
+    range, and always for chips of unknown architecture. The ranges are
+    resolved once per BranchIndex group into integer columns, then the whole
+    matrix is computed with NumPy if it is installed, or column by column
+    over the arrays otherwise.
+
+    Args:
+        index: BranchIndex of the database
+        policy: Policy providing the architecture minimum drivers
+        branches: Branch majors to evaluate (defaults to get_known_branches())
+
+    Returns:
+        CompatibilityMatrix: ``compatible`` holds one row of 0/1 per branch,
+        with a column per chip in the order of ``chips``
+    """
+    if policy is None:
+        policy = Policy.default()
+    if branches is None:
+        branches = get_known_branches(index, policy)
+    branches = [int(branch) for branch in branches]
+
+    chips = []
+    min_driver = array.array("H")
+    max_driver = array.array("H")
+    unknown = array.array("B")
+    for (max_branch, arch), group in sorted(index.groups.items(), key=lambda item: (int(item[0][0]), item[0][1])):
+        min_branch = policy.min_driver(arch)
+        for chip in group:
+            chips.append(chip_range_summary(chip, arch, min_branch, max_branch))
+        min_driver.extend([int(min_branch)] * len(group))
+        max_driver.extend([int(max_branch)] * len(group))
+        unknown.extend([arch == "unknown"] * len(group))
+
+    try:
+        import numpy
+    except ModuleNotFoundError:
+        numpy = None
+
+    if numpy is not None and chips:
+        low = numpy.frombuffer(min_driver, dtype=numpy.uint16)
+        high = numpy.frombuffer(max_driver, dtype=numpy.uint16)
+        requested = numpy.array(branches, dtype=numpy.uint16)[:, None]
+        matrix = (numpy.frombuffer(unknown, dtype=numpy.uint8) != 0) | ((requested >= low) & (requested <= high))
+        compatible = matrix.astype(numpy.uint8).tolist()
+    else:
+        compatible = []
+        for branch in branches:
+            compatible.append(array.array("B", (
+                1 if is_unknown or low <= branch <= high else 0
+                for low, high, is_unknown in zip(min_driver, max_driver, unknown)
+            )))
+
+    return CompatibilityMatrix(branches, chips, min_driver, max_driver, compatible)
+
+
+def write_compatibility_matrix(matrix, stream, output_format="csv"):
+    """Write a compatibility matrix as CSV (a row per chip) or JSON
+
+    Args:
+        matrix: CompatibilityMatrix
+        stream: Text stream to write to
+        output_format: "csv" or "json"
+    """
+    columns = ("pci_id", "name", "architecture", "legacy", "subsystem_vendor", "subsystem_device")
+    rows = zip(matrix.chips, matrix.min_driver, matrix.max_driver, zip(*matrix.compatible))
+
+    if output_format == "json":
+        chips = []
+        for chip, low, high, cells in rows:
+            entry = {column: chip[column] for column in columns}
+            entry["min_driver"] = low
+            entry["max_driver"] = high
+            entry["compatible"] = list(cells)
+            chips.append(entry)
+        json.dump({"branches": matrix.branches, "chips": chips}, stream, indent=2)
+        stream.write("\n")
+        return
+
+    writer = csv.writer(stream)
+    writer.writerow(list(columns) + ["min_driver", "max_driver"] + [str(branch) for branch in matrix.branches])
+    for chip, low, high, cells in rows:
+        writer.writerow([chip[column] or "" for column in columns] + [low, high] + list(cells))
+
+
+def describe_chip(chip, policy=None):
+    """Evaluate a database record as if it was installed in this system
+
+    Returns:
+        dict: Device JSON representation (see Device.to_dict()) plus the
+        driver hint and the module flavor the tool would pick for it alone
+    """
+    device = Device.from_chip(chip, policy=policy)
+    result = device.to_dict()
+    result["driver_hint"] = device.driver_hint
+    result["module_flavor"] = decide_driver({device.id: device}, True, policy)
+    return result
+
+
+LintIssue = collections.namedtuple("LintIssue", ["severity", "check", "devid", "name", "message"])
+
+
+def lint_gpu_database(database, policy=None):
+    """Check a GPU database for contradictory or unusable entries
+
+    Every record is visited once and filed into two hash indexes, by merge
+    key and by device ID; the checks that compare entries then only look at
+    the index groups:
+
+    - duplicate (error): the same (devid, subvendorid, subdevid) twice
+    - invalid-devid (error): a device ID that is not a hex number
+    - invalid-branch (error): a legacybranch whose major is not a number
+      (the tool silently assumes 470 for it)
+    - legacy-below-minimum (error): a legacybranch older than the minimum
+      driver of the GPU's architecture, i.e. an empty supported range
+    - ambiguous (warning): entries of one device ID that lead to different
+      decisions (driver hint or maximum driver), so the heuristics of
+      select_best_gpu_match() decide for hardware without an exact
+      subsystem match
+    - architecture (warning): a name classified differently than the other
+      entries of its device ID, or than both neighbouring device IDs of
+      the same 0x100 block
+
+    Args:
+        database: GpuDatabase, or any iterable of Chip records
+        policy: Policy providing the architecture minimum drivers
+
+    Returns:
+        list: LintIssue tuples, errors first, then by device ID
+    """
+    if policy is None:
+        policy = Policy.default()
+
+    issues = []
+    by_key = {}
+    by_devid = {}
+    numbers = {}
+    for chip in database:
+        architecture = classify_device_name(chip.name)[0]
+        key = chip.key
+        first = by_key.setdefault(key, chip)
+        if first is not chip:
+            issues.append(LintIssue(
+                "error", "duplicate", chip.devid, chip.name,
+                "same device and subsystem IDs as %r" % first.name
+            ))
+
+        entries = by_devid.get(key[0])
+        if entries is None:
+            entries = by_devid[key[0]] = []
+            try:
+                numbers[key[0]] = int(key[0], 16)
+            except ValueError:
+                issues.append(LintIssue("error", "invalid-devid", chip.devid, chip.name, "not a hex device ID"))
+        entries.append((chip, architecture))
+
+        if chip.legacy_branch:
+            try:
+                major = int(chip.legacy_branch.split(".")[0])
+            except ValueError:
+                issues.append(LintIssue(
+                    "error", "invalid-branch", chip.devid, chip.name,
+                    "legacybranch %r is not a driver branch" % chip.legacy_branch
+                ))
+            else:
+                min_driver = policy.min_driver(architecture)
+                if major < int(min_driver):
+                    issues.append(LintIssue(
+                        "error", "legacy-below-minimum", chip.devid, chip.name,
+                        "legacybranch %s is older than the %s.xx minimum of %s GPUs"
+                        % (chip.legacy_branch, min_driver, architecture)
+                    ))
+
+    # Only entries sharing a device ID are evaluated, once per distinct record
+    decisions = {}
+
+    def decide(chip):
+        record = (chip.name, chip.feature_mask, chip.vdpau_level, chip.legacy_branch)
+        if record not in decisions:
+            device = Device.from_chip(chip, policy=policy)
+            decisions[record] = (device.driver_hint, Device.get_max_driver(chip.legacy_branch))
+        return decisions[record]
+
+    families = {}
+    for devid, entries in by_devid.items():
+        architectures = collections.Counter(arch for chip, arch in entries if arch != "unknown")
+        if len(entries) > 1:
+            outcomes = [decide(chip) for chip, arch in entries]
+            if len(set(outcomes)) > 1:
+                chip = entries[0][0]
+                issues.append(LintIssue(
+                    "warning", "ambiguous", chip.devid, chip.name,
+                    "%d entries lead to different decisions: %s" % (len(entries), "; ".join(
+                        "%s -> %s, max %s.xx" % (entry.name, hint, max_driver)
+                        for (entry, arch), (hint, max_driver) in zip(entries, outcomes)
+                    ))
+                ))
+            if len(architectures) > 1:
+                majority = architectures.most_common(1)[0][0]
+                for chip, arch in entries:
+                    if arch not in (majority, "unknown"):
+                        issues.append(LintIssue(
+                            "warning", "architecture", chip.devid, chip.name,
+                            "classified as %s, the other entries of the device ID as %s" % (arch, majority)
+                        ))
+        if architectures and devid in numbers:
+            families[devid] = architectures.most_common(1)[0][0]
+
+    ordered = sorted((numbers[devid], devid) for devid in families)
+    for (previous, before), (number, devid), (following, after) in zip(ordered, ordered[1:], ordered[2:]):
+        if previous >> 8 != number >> 8 or following >> 8 != number >> 8:
+            continue
+        neighbours = families[before]
+        if families[after] != neighbours or families[devid] == neighbours:
+            continue
+        for chip, arch in by_devid[devid]:
+            if arch == families[devid]:
+                issues.append(LintIssue(
+                    "warning", "architecture", chip.devid, chip.name,
+                    "classified as %s, neighbouring device IDs %s and %s as %s"
+                    % (arch, by_devid[before][0][0].devid, by_devid[after][0][0].devid, neighbours)
+                ))
+
+    issues.sort(key=lambda issue: (issue.severity != "error", numbers.get(issue.devid.lower(), -1), issue.check))
+    return issues
+
+
+# get_pci_device_info() result of a function whose probe was late or skipped
+pci_info_skipped = {}
+
+
+def get_nvidia_devices(sys_path, supported_gpus, simulate_gpu=None, suppress_warnings=False, policy=None,
+                       database=None, is_laptop=None, notices=None, modaliases=None, pci_infos=None,
+                       duplicates=None, integrated=None):
+    """Get a dictionary with all the NVIDIA graphics devices
+    
+    Args:
+        sys_path: Optional alternative /sys path (for testing)
+        supported_gpus: Path to supported-gpus.json file, or a list of it followed by overlay files
+        simulate_gpu: Simulated GPU ID for testing
+        suppress_warnings: Whether to suppress multiple match warnings (for MHWD/JSON output)
+        policy: Policy to evaluate the devices with (defaults to the module constants)
+        database: Already loaded database from load_gpu_database() (supported_gpus is then ignored)
+        is_laptop: Whether the system is a laptop, or a callable answering it (probed on demand if None)
+        notices: Optional list collecting multiple match notices instead of printing them
+        modaliases: Already probed get_system_modaliases() result (the sysfs walk is then skipped)
+        pci_infos: Already probed get_pci_device_info() results keyed by sysfs path; a
+            path missing from them was not probed in time and is matched by its modalias
+            only, sysfs is not read again
+        duplicates: Further paths of identical devices collected with the probed modaliases
+        integrated: Optional list collecting the Intel/AMD display functions (see get_integrated_gpus())
+        
+    Returns:
+        dict: Dictionary of Device objects keyed by device ID
+    """
+    pci_class_display = "03"
+
+    if policy is None:
+        policy = Policy.default()
+    
+    if simulate_gpu:
+        if simulate_gpu in simulated_gpus:
+            gpu_data = simulated_gpus[simulate_gpu]
+            modalias = gpu_data["modalias"]
+            modaliases = {modalias: '/sys/devices/pci0000:00/0000:00:01.0/0000:01:00.0'}
+        else:
+            logging.error(f"Unknown simulated GPU: {simulate_gpu}")
+            return None
+    elif modaliases is None:
+        duplicates = {}
+        modaliases = get_system_modaliases(sys_path, duplicates)
+    
+    if database is None:
+        try:
+            database = load_gpu_database(supported_gpus)
+        except AssistantError as e:
+            logging.error("%s" % e)
+            return None
+
+    devices = {}
+
+    if integrated is not None and not simulate_gpu:
+        integrated.extend(get_integrated_gpus(modaliases))
+    
+    # Process each NVIDIA modalias; everything else is rejected by a prefix check
+    for alias, details in parse_pci_modaliases(modaliases):
+        if details.base_class != pci_class_display:
+            continue
+        syspath = modaliases[alias]
+        device = evaluate_pci_device(
+            details, syspath, database, policy, simulate_gpu,
+            suppress_warnings, is_laptop, notices,
+            pci_info=pci_infos.get(syspath, pci_info_skipped) if pci_infos is not None else None
+        )
+        if device.id in devices:
+            # Identical GPUs share one entry, keep where each of them sits
+            merge_pci_details(device, devices[device.id])
+        for path in (duplicates or {}).get(alias, []):
+            if pci_infos is not None:
+                info = pci_infos.get(path, pci_info_skipped)
+            else:
+                info = get_pci_device_info(path)
+            merge_pci_details(device, attach_pci_details(copy.copy(device), info))
+        devices[device.id] = device
+    
+    for device in devices.values():
+        device.topology.sort(key=lambda function: function["slot"])
+
+    # Debug: log how many devices we found
+    logging.debug("get_nvidia_devices(): Created %d Device objects" % len(devices))
+    
+    return devices
+
+
+def get_integrated_gpus(modaliases):
+    """Get the Intel and AMD display functions a hybrid system renders on by default
+
+    Args:
+        modaliases: get_system_modaliases() result
+
+    Returns:
+        list: dicts with vendor, vendor_name, devid and slot, sorted by slot
+    """
+    found = []
+    for alias, details in parse_pci_modaliases(modaliases, vendor=None):
+        vendor = details.vendor.upper()
+        if details.base_class != "03" or vendor not in INTEGRATED_GPU_VENDORS:
+            continue
+        found.append({
+            "vendor": "0x" + vendor,
+            "vendor_name": INTEGRATED_GPU_VENDORS[vendor],
+            "devid": details.devid,
+            "slot": os.path.basename(modaliases[alias]),
+        })
+    return sorted(found, key=lambda gpu: gpu["slot"])
+
+
+def evaluate_pci_device(details, syspath, database, policy, simulate_gpu=None, suppress_warnings=False,
+                        is_laptop=None, notices=None, pci_info=None):
+    """Match one NVIDIA PCI function against the database and evaluate it
+
+    Args:
+        details: PciModalias of the function (see parse_pci_modalias())
+        syspath: Path of the function in /sys
+        database: GpuDatabase to match against
+        policy: Policy to evaluate the device with
+        simulate_gpu: Simulated GPU ID for testing
+        suppress_warnings: Whether to suppress multiple match warnings (for MHWD/JSON output)
+        is_laptop: Whether the system is a laptop, or a callable answering it (probed on demand if None)
+        notices: Optional list collecting multiple match notices instead of printing them
+        pci_info: Already probed get_pci_device_info() result (read from sysfs if None,
+            pci_info_skipped if the probe was late)
+
+    Returns:
+        Device: Evaluated device ("unknown" if the device ID is not in the database)
+    """
+    devid = details.devid
+    subsys_vendor = details.subsys_vendor
+    subsys_device = details.subsys_device
+    logging.debug(
+        "get_nvidia_devices(): Processing Vendor: %s, Device ID: %s, Subsystem: %s:%s, class %s"
+        % (details.vendor, devid, subsys_vendor, subsys_device,
+           "0x%s%s" % (details.base_class, details.sub_class))
+    )
+
+    # Get PCI device information from sysfs
+    if pci_info is None and not simulate_gpu:
+        pci_info = get_pci_device_info(syspath)
+
+    # Create PCI info dictionary for matching
+    pci_match_info = {
+        "subsystem_vendor": subsys_vendor,
+        "subsystem_device": subsys_device,
+        "device": devid
+    }
+    if pci_info:
+        pci_match_info.update(pci_info)
+    if simulate_gpu:
+        pci_match_info["simulate_gpu"] = simulate_gpu
+
+    matching_gpus = database.lookup(devid)
+    if not matching_gpus:
+        # Unknown GPU
+        dev = Device(devid, "unknown", [], "", None, None, policy=policy)
+        dev.driver_hint = default
+        logging.info("get_nvidia_devices(): Unknown GPU ID %s" % devid)
+        return attach_pci_details(dev, pci_info)
+
+    if len(matching_gpus) == 1:
+        # Single match - straightforward
+        gpu = matching_gpus[0]
+        logging.debug("get_nvidia_devices(): Single match for %s -> %s" % (devid, gpu.name))
+        return attach_pci_details(Device.from_chip(gpu, devid, policy), pci_info)
+
+    # Multiple matches - need to choose the best one
+    logging.debug("get_nvidia_devices(): Multiple matches for %s" % devid)
+
+    best_gpu = select_best_gpu_match(matching_gpus, pci_match_info, suppress_warnings, policy,
+                                     is_laptop, notices)
+
+    # Log all options for debugging
+    logging.debug(f"get_nvidia_devices(): Options for {devid}:")
+    for i, gpu in enumerate(matching_gpus):
+        is_mobile = "M" if classify_device_name(gpu.name)[1] else "D"
+        subvendor = gpu.subvendorid or "N/A"
+        subdevice = gpu.subdevid or "N/A"
+        logging.debug(f"  Option {i+1}: {gpu.name} ({is_mobile}) - Subsystem: {subvendor}:{subdevice}")
+
+    logging.info("get_nvidia_devices(): Selected best match for %s -> %s" % (devid, best_gpu.name))
+    return attach_pci_details(Device.from_chip(best_gpu, devid, policy), pci_info)
+
+
+def merge_pci_details(device, other):
+    """Merge the sysfs details of an identical GPU into a device
+
+    The topology lists both functions and the SR-IOV counts are added up;
+    for the link and BAR1 the worse of the two is reported, with its "slot",
+    so that a misconfigured GPU is not hidden by a healthy one.
+    """
+    def link_severity(link):
+        return (link["degraded"], link["speed_reduced"])
+
+    device.topology = device.topology + other.topology
+    if other.pci_link and (not device.pci_link or link_severity(other.pci_link) > link_severity(device.pci_link)):
+        device.pci_link = other.pci_link
+    if other.bar1 and (not device.bar1 or device.bar1["large"] and not other.bar1["large"]):
+        device.bar1 = other.bar1
+    if other.sriov:
+        if not device.sriov:
+            device.sriov = other.sriov
+        else:
+            device.sriov = {
+                "physical_functions": device.sriov["physical_functions"] + other.sriov["physical_functions"],
+                "total_vfs": device.sriov["total_vfs"] + other.sriov["total_vfs"],
+                "enabled_vfs": device.sriov["enabled_vfs"] + other.sriov["enabled_vfs"],
+                "virtual_functions": sorted(device.sriov["virtual_functions"] + other.sriov["virtual_functions"]),
+            }
+
+
+def attach_pci_details(device, pci_info):
+    """Store the sysfs details of the PCI function on an evaluated device
+
+    Args:
+        device: Evaluated Device
+        pci_info: get_pci_device_info() result (None when simulated)
+
+    Returns:
+        Device: The same device
+    """
+    pci_info = pci_info or {}
+    slot = (pci_info.get("topology") or {}).get("slot")
+    device.pci_link = assess_pcie_link(pci_info["link"], slot) if pci_info.get("link") else None
+    device.topology = [pci_info["topology"]] if pci_info.get("topology") else []
+    device.bar1 = assess_bar1(pci_info["bars"], slot) if pci_info.get("bars") else None
+    device.sriov = pci_info.get("sriov")
+    return device
+
+
+def restore_devices(states, policy=None, sys_path=None):
+    """Restore stored devices and read their live sysfs details again
+
+    Only the evaluation is reused; the PCIe link, the BARs, the topology and
+    the SR-IOV counts are read from the stored slots like a detection does.
+
+    Args:
+        states: Device.to_state() results
+        policy: Policy to attach to the restored devices
+        sys_path: Optional alternative /sys path (for testing)
+
+    Returns:
+        dict: Dictionary of Device objects keyed by device ID
+
+    Raises:
+        KeyError: If a state is incomplete
+    """
+    pci_devices = "/sys/bus/pci/devices" if not sys_path else "%s/bus/pci/devices" % (sys_path)
+    devices = {}
+    for state in states:
+        device = Device.from_state(state, policy)
+        for position, slot in enumerate(state["slots"]):
+            info = get_pci_device_info(os.path.join(pci_devices, slot))
+            if position == 0:
+                attach_pci_details(device, info)
+            else:
+                merge_pci_details(device, attach_pci_details(copy.copy(device), info))
+        device.topology.sort(key=lambda function: function["slot"])
+        devices[device.id] = device
+    return devices
+
+
+def get_file_stamp(path):
+    """Get a cheap identity of a file (path, size and modification time)
+
+    Returns:
+        list: [path, size, mtime_ns], or [path, None, None] if it cannot be stat'ed
+    """
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return [path, None, None]
+    return [path, st.st_size, st.st_mtime_ns]
+
+
+def get_pci_topology_fingerprint(sys_path=None):
+    """Fingerprint the PCI topology without walking the whole device tree
+
+    The fingerprint covers the listing of /sys/bus/pci/devices and, for the
+    NVIDIA functions only, their vendor, device, subsystem and class IDs.
+
+    Args:
+        sys_path: Optional alternative path to /sys (for testing)
+
+    Returns:
+        str: Hex digest, or None if the PCI bus is not readable
+    """
+    pci_devices = "/sys/bus/pci/devices" if not sys_path else "%s/bus/pci/devices" % (sys_path)
+    try:
+        slots = sorted(os.listdir(pci_devices))
+    except OSError as e:
+        logging.debug("get_pci_topology_fingerprint(): cannot list %s: %s", pci_devices, e)
+        return None
+
+    digest = hashlib.sha1()
+    for slot in slots:
+        digest.update(slot.encode("utf-8") + b"\n")
+        try:
+            with open(os.path.join(pci_devices, slot, "vendor"), "rb") as f:
+                vendor = f.read().strip()
+        except OSError:
+            continue
+        digest.update(vendor + b"\n")
+        if vendor.lower() != b"0x10de":
+            continue
+        for attribute in ("device", "subsystem_vendor", "subsystem_device", "class"):
+            try:
+                with open(os.path.join(pci_devices, slot, attribute), "rb") as f:
+                    digest.update(f.read().strip() + b"\n")
+            except OSError:
+                digest.update(b"-\n")
+    return digest.hexdigest()
+
+
+def get_detection_stamp(sys_path, supported_gpus, policy, use_driver_hints=True):
+    """Get everything a stored detection result depends on
+
+    Returns:
+        dict: Stamp to compare against the stored one, or None if the
+        topology cannot be fingerprinted
+    """
+    topology = get_pci_topology_fingerprint(sys_path)
+    if topology is None:
+        return None
+    base, overlays = split_database_paths(supported_gpus)
+    return {
+        "format": STATE_CACHE_FORMAT,
+        "topology": topology,
+        "database": [get_file_stamp(path) for path in filter(None, (base,) + overlays)],
+        "program": get_file_stamp(os.path.realpath(__file__)),
+        "policy": policy.fingerprint(),
+        "driver_hints": use_driver_hints,
+    }
+
+
+def write_file_atomic(path, data):
+    """Write a file so that readers see either the old or the new content
+
+    Args:
+        path: Destination path (its directory is created if needed)
+        data: String to write
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".%s." % os.path.basename(path), dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def get_boot_id():
+    """Get the random ID of the running boot, None if unavailable"""
+    boot_id = read_text("/proc/sys/kernel/random/boot_id")
+    return boot_id.strip() if boot_id else None
+
+
+def publish_result(result, devices, directory=default_publish_directory, stamp=None):
+    """Publish a decision for the other tools of this boot
+
+    ``result.json`` holds the --json document plus the evaluated devices and
+    the stamp they were produced under (for load_published_result()),
+    ``module-flavor`` the flavor alone (empty without an NVIDIA GPU). Both
+    files are replaced atomically.
+
+    Args:
+        result: --json document (see Session.to_json())
+        devices: Dictionary of the evaluated Device objects
+        directory: Output directory
+        stamp: get_detection_stamp() of the detection (None: never reused)
+
+    Raises:
+        OSError: If a file cannot be written
+    """
+    published = dict(result)
+    published["boot_id"] = get_boot_id()
+    published["published_at"] = time.time()
+    published["state"] = {
+        "format": STATE_CACHE_FORMAT,
+        "stamp": stamp,
+        "devices": [dev.to_state() for dev in (devices or {}).values()],
+    }
+    write_file_atomic(os.path.join(directory, published_result_name), json.dumps(published, indent=2) + "\n")
+    flavor = result.get("module_flavor")
+    write_file_atomic(os.path.join(directory, published_flavor_name), flavor + "\n" if flavor else "")
+
+
+def load_published_result(directory=default_publish_directory, policy=None, sys_path=None, stamp=None):
+    """Load the decision published by publish_result() during this boot
+
+    The result is only used if it was published under the same stamp, i.e.
+    the same PCI topology, database files, program and policy.
+
+    Args:
+        directory: Directory the result was published to
+        policy: Policy to attach to the restored devices
+        sys_path: Optional alternative /sys path to read the live details from
+        stamp: Current get_detection_stamp() (None: nothing is reused)
+
+    Returns:
+        tuple: (result: dict without the device state, devices: dict), or
+        None if nothing usable was published during this boot
+    """
+    if stamp is None:
+        return None
+    path = os.path.join(directory, published_result_name)
+    try:
+        with open(path, "r") as f:
+            published = json.load(f)
+        boot_id = get_boot_id()
+        if boot_id and published.get("boot_id") != boot_id:
+            logging.debug("load_published_result(): %s is from another boot" % path)
+            return None
+        state = published.pop("state")
+        if state["format"] != STATE_CACHE_FORMAT:
+            logging.debug("load_published_result(): %s has another format" % path)
+            return None
+        if state["stamp"] != stamp:
+            logging.debug("load_published_result(): %s was published for another policy, database or topology" % path)
+            return None
+        return published, restore_devices(state["devices"], policy, sys_path)
+    except (IOError, OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        logging.debug("load_published_result(): cannot use %s: %s" % (path, e))
+        return None
+
+
+def load_detection_state(path, stamp, policy=None, integrated=None, sys_path=None):
+    """Load a stored detection result if it was produced under the same stamp
+
+    Args:
+        path: State cache file
+        stamp: Current stamp from get_detection_stamp()
+        policy: Policy to attach to the restored devices
+        integrated: Optional list receiving the stored integrated GPUs
+        sys_path: Optional alternative /sys path to read the live details from
+
+    Returns:
+        tuple: (driver: str, devices: dict), or None if there is no usable result
+    """
+    if not path or stamp is None:
+        return None
+    try:
+        with open(path, "r") as f:
+            state = json.load(f)
+        if state.get("stamp") != stamp:
+            logging.debug("load_detection_state(): %s is stale" % path)
+            return None
+        devices = restore_devices(state["devices"], policy, sys_path)
+        if integrated is not None:
+            integrated.extend(state["integrated"])
+        return state["driver"], devices
+    except (IOError, OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        logging.debug("load_detection_state(): cannot use %s: %s" % (path, e))
+        return None
+
+
+def save_detection_state(path, stamp, driver, devices, integrated=None):
+    """Store a detection result for load_detection_state()
+
+    Failures (e.g. running unprivileged) are logged and otherwise ignored.
+    """
+    if not path or stamp is None:
+        return
+    state = {
+        "stamp": stamp,
+        "driver": driver,
+        "devices": [dev.to_state() for dev in devices.values()],
+        "integrated": integrated or [],
+    }
+    try:
+        write_file_atomic(path, json.dumps(state))
+    except (IOError, OSError) as e:
+        logging.debug("save_detection_state(): cannot write %s: %s" % (path, e))
+
+
+# Kernel uevents are broadcast on this netlink protocol, multicast group 1
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+
+
+def _open_uevent_socket():
+    """Open a netlink socket receiving kernel uevents, None if not possible"""
+    if not hasattr(socket, "AF_NETLINK"):
+        return None
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        sock.bind((0, UEVENT_KERNEL_GROUP))
+    except OSError as e:
+        logging.debug("watch_pci_events(): cannot open uevent socket: %s" % e)
+        return None
+    return sock
+
+
+def parse_uevent(message):
+    """Parse a kernel uevent netlink message
+
+    Args:
+        message: Raw message ("ACTION@DEVPATH\0KEY=VALUE\0...")
+
+    Returns:
+        tuple: (action, slot) for PCI add/remove events, None otherwise
+    """
+    fields = {}
+    for part in message.split(b"\0")[1:]:
+        key, sep, value = part.partition(b"=")
+        if sep:
+            fields[key] = value
+    if fields.get(b"SUBSYSTEM") != b"pci":
+        return None
+    action = fields.get(b"ACTION", b"").decode("utf-8", "replace")
+    if action not in ("add", "remove"):
+        return None
+    slot = fields.get(b"PCI_SLOT_NAME")
+    if not slot:
+        slot = os.path.basename(fields.get(b"DEVPATH", b""))
+    if not slot:
+        return None
+    return action, slot.decode("utf-8", "replace")
+
+
+def watch_pci_events(sys_path=None, interval=1.0):
+    """Generate PCI add/remove events
+
+    The kernel uevent netlink socket is used when watching the real /sys.
+    With an alternative sys_path, or when the socket cannot be opened, the
+    listing of <sys>/bus/pci/devices is polled every interval seconds
+    instead (sysfs does not report changes through inotify).
+
+    Args:
+        sys_path: Optional alternative path to /sys (for testing)
+        interval: Polling interval in seconds for the fallback
+
+    Yields:
+        tuple: (action: "add" or "remove", slot: PCI slot name)
+    """
+    sock = _open_uevent_socket() if not sys_path else None
+    if sock is not None:
+        logging.debug("watch_pci_events(): listening for kernel uevents")
+        try:
+            while True:
+                event = parse_uevent(sock.recv(65536))
+                if event:
+                    yield event
+        finally:
+            sock.close()
+
+    pci_devices = "/sys/bus/pci/devices" if not sys_path else "%s/bus/pci/devices" % (sys_path)
+    logging.debug("watch_pci_events(): polling %s every %ss" % (pci_devices, interval))
+    try:
+        known = set(os.listdir(pci_devices))
+    except OSError:
+        known = set()
+    while True:
+        time.sleep(interval)
+        try:
+            current = set(os.listdir(pci_devices))
+        except OSError:
+            current = set()
+        for slot in sorted(known - current):
+            yield "remove", slot
+        for slot in sorted(current - known):
+            yield "add", slot
+        known = current
+
+
+# Outcome of a PciInventory update: "add", "remove", or "change" when a physical
+# function was evaluated again for one of its SR-IOV virtual functions
+InventoryChange = collections.namedtuple("InventoryChange", ["kind", "slot", "device"])
+
+
+class PciInventory(object):
+    """NVIDIA display devices keyed by PCI slot, updated one slot at a time
+
+    Args:
+        database: GpuDatabase to match against
+        policy: Policy to evaluate the devices with
+        sys_path: Optional alternative path to /sys (for testing)
+        is_laptop: Whether the system is a laptop, or a callable answering it (probed on demand if None)
+        use_driver_hints: Whether to use JSON hints (True) or VDPAU logic (False)
+    """
+
+    def __init__(self, database, policy, sys_path=None, is_laptop=None, use_driver_hints=True):
+        super(PciInventory, self).__init__()
+        self.database = database
+        self.policy = policy
+        self.sys_path = sys_path
+        self.is_laptop = is_laptop
+        self.use_driver_hints = use_driver_hints
+        self.pci_devices = "/sys/bus/pci/devices" if not sys_path else "%s/bus/pci/devices" % (sys_path)
+        self.devices = {}
+
+    def scan(self):
+        """Evaluate every PCI function currently present"""
+        self.devices = {}
+        try:
+            slots = sorted(os.listdir(self.pci_devices))
+        except OSError as e:
+            logging.debug("PciInventory.scan(): cannot list %s: %s" % (self.pci_devices, e))
+            slots = []
+        for slot in slots:
+            self.add(slot)
+
+    def add(self, slot):
+        """Evaluate a single PCI function
+
+        An SR-IOV virtual function is not tracked on its own, its physical
+        function is evaluated again to update the counts instead.
+
+        Returns:
+            InventoryChange: "add" with the evaluated device, "change" with
+            the physical function of a virtual function, or None if nothing
+            tracked changed (not an NVIDIA display device)
+        """
+        path = os.path.realpath(os.path.join(self.pci_devices, slot))
+        physfn = os.path.join(path, "physfn")
+        if os.path.islink(physfn):
+            parent = os.path.basename(os.path.realpath(physfn))
+            if parent in self.devices:
+                return self._refresh(parent)
+            return None
+        modalias = get_device_modalias(path)
+        details = parse_pci_modalias(modalias) if modalias else None
+        if details is None or details.base_class != "03":
+            return None
+        notices = []
+        device = evaluate_pci_device(details, path, self.database, self.policy,
+                                     is_laptop=self.is_laptop, notices=notices)
+        self.devices[slot] = device
+        return InventoryChange("add", slot, device)
+
+    def _refresh(self, slot):
+        """Evaluate a tracked physical function again, see add()"""
+        change = self.add(slot)
+        if change is None:
+            # No longer an NVIDIA display function
+            device = self.devices.pop(slot, None)
+            return InventoryChange("remove", slot, device) if device is not None else None
+        return change._replace(kind="change")
+
+    def remove(self, slot):
+        """Forget a PCI function
+
+        Like add(), removing an SR-IOV virtual function evaluates its
+        physical function again. The sysfs node of the VF, and its physfn
+        link with it, is already gone, so the physical function is found
+        through the virtual functions it listed.
+
+        Returns:
+            InventoryChange: "remove" with the forgotten device, "change"
+            with the physical function of a virtual function, or None if
+            the function was not tracked
+        """
+        device = self.devices.pop(slot, None)
+        if device is not None:
+            return InventoryChange("remove", slot, device)
+        for parent, candidate in list(self.devices.items()):
+            if candidate.sriov and slot in candidate.sriov["virtual_functions"]:
+                return self._refresh(parent)
+        return None
+
+    def recommend(self):
+        """Recommend a kernel module flavor for the current inventory
+
+        Returns:
+            str: "open" or "closed", or None if no device is present
+        """
+        devices = {}
+        for device in self.devices.values():
+            devices[device.id] = device
+        if not devices:
+            return None
+        return decide_driver(devices, self.use_driver_hints, self.policy)
+
+
+def ubuntu_get_latest_driver_branch(path="/"):
+    """Get the latest driver branch available in Ubuntu's repositories
+    
+    Args:
+        path: Root path for dpkg status file
+        
+    Returns:
+        str: Latest available driver branch number or None
+
+    Raises:
+        AssistantError: If python3-apt is not installed
+    """
+    try:
+        import apt_pkg
+    except ModuleNotFoundError:
+        raise AssistantError("please install the following package and try again:\n  python3-apt")
+
+    apt_pkg.init_config()
+    if os.path.abspath(path) != "/":
+        # Package lists and sources of the root as well
+        apt_pkg.config.set("Dir", os.path.abspath(path) + "/")
+    dpkg_status = os.path.abspath(os.path.join(path, "var", "lib", "dpkg", "status"))
+    apt_pkg.config.set("Dir::State::status", dpkg_status)
+    apt_pkg.init_system()
+    cache = apt_pkg.Cache(None)
+    candidates = []
+    for package in cache.packages:
+        branch = re.search(r"nvidia-driver-([0-9]+)-open", package.name)
+        if branch:
+            candidates.append(branch.group(1))
+
+    if candidates:
+        candidates.sort()
+        return candidates[-1]
+    else:
+        return None
+
+
+def get_kernel_release(root="/"):
+    """Get the kernel release of a system
+
+    For the running system this is the running kernel; for another root
+    file system the newest kernel installed in its /lib/modules or
+    /usr/lib/modules.
+
+    Args:
+        root: Root directory of the system
+
+    Returns:
+        str: Kernel release, or None if no kernel is installed in the root
+    """
+    if os.path.abspath(root) == "/":
+        return platform.release()
+    releases = set()
+    for directory in ("lib/modules", "usr/lib/modules"):
+        try:
+            releases.update(
+                name for name in os.listdir(os.path.join(root, directory))
+                if os.path.isdir(os.path.join(root, directory, name, "kernel"))
+            )
+        except OSError:
+            continue
+    if not releases:
+        return None
+
+    def version_key(release):
+        return [(0, int(part), "") if part.isdigit() else (1, 0, part) for part in re.split(r"[.\-+_]", release)]
+
+    return max(releases, key=version_key)
+
+
+def manjaro_get_kernel_package(root="/"):
+    """Get kernel package name for Manjaro (e.g., linux618 from 6.18.xx)
+
+    Args:
+        root: Root directory of the system whose kernel is used
+    
+    Returns:
+        str: Kernel package name
+    """
+    try:
+        kernel_release = (get_kernel_release(root) or "").split(".")
+        if len(kernel_release) >= 2:
+            return f"linux{kernel_release[0]}{kernel_release[1]}"
+    except Exception as e:
+        logging.debug("Failed to get kernel package name: %s", e)
+    return "linux"
+
+
+def manjaro_get_legacy_branch(devices):
+    """Get legacy branch for Manjaro based on detected devices
+    
+    Args:
+        devices: Dictionary of Device objects
+        
+    Returns:
+        str: Highest legacy branch number or None
+    """
+    highest_branch = None
+    for dev in devices.values():
+        if dev.legacy_branch:
+            branch_major = dev.legacy_branch.split('.')[0]
+            if highest_branch is None:
+                highest_branch = branch_major
+            else:
+                try:
+                    if int(branch_major) > int(highest_branch):
+                        highest_branch = branch_major
+                except ValueError:
+                    pass
+    
+    return highest_branch
+
+
+def format_pcie_link(link):
+    """Describe an assess_pcie_link() report in one line"""
+    def describe(speed, width):
+        return "%s GT/s x%s" % ("%g" % speed if speed else "?", width if width else "?")
+
+    text = "%s (expected %s)" % (
+        describe(link["current_speed"], link["current_width"]),
+        describe(link["expected_speed"], link["expected_width"]),
+    )
+    if link["degraded"]:
+        text += " - DEGRADED: %s" % ", ".join(link["reasons"])
+        if link["speed_reduced"]:
+            text += ", reduced speed"
+    elif link["speed_reduced"]:
+        text += " - reduced speed (idle GPUs lower the link speed, check again under load)"
+    return text
+
+
+def format_bar1(bar1):
+    """Describe an assess_bar1() report in one line"""
+    text = format_size(bar1["size"])
+    if bar1["large"]:
+        text += " (Resizable BAR active)"
+    else:
+        text += " (legacy window"
+        if bar1["enlargeable"]:
+            text += ", the GPU supports %s" % format_size(bar1["max_size"])
+        text += "; enable Above 4G Decoding and Resizable BAR in the firmware)"
+    return text
+
+
+def print_pretty_gpu_summary(devices):
+    """Print a formatted summary of detected GPUs
+    
+    Args:
+        devices: Dictionary of Device objects
+    """
+    if not devices:
+        print("No NVIDIA GPUs detected")
+        return
+    
+    print("Detected GPUs:")
+    print("-" * 70)
+    for dev_id, dev in devices.items():
+        arch_info = f" [{dev.architecture}]" if dev.architecture != "unknown" else ""
+        type_info = " (Mobile)" if dev.is_laptop_gpu else " (Desktop)"
+        legacy_info = f" (legacy: {dev.legacy_branch})" if dev.legacy_branch else ""
+        
+        # Add subsystem information if available
+        subsystem_info = ""
+        if dev.subvendorid and dev.subdevid:
+            subsystem_info = f" [Subsystem: {dev.subvendorid}:{dev.subdevid}]"
+        
+        print(f"  {dev.name}{arch_info}{type_info}{subsystem_info}")
+        print(f"    PCI ID: {dev_id}{legacy_info}")
+        # Identical GPUs report the worst of them, say which one it is
+        shared = len(dev.topology) > 1
+        if dev.pci_link:
+            where = f" ({dev.pci_link['slot']})" if shared and dev.pci_link["slot"] else ""
+            print(f"    PCIe link{where}: {format_pcie_link(dev.pci_link)}")
+        if dev.bar1:
+            where = f" ({dev.bar1['slot']})" if shared and dev.bar1["slot"] else ""
+            print(f"    BAR1{where}: {format_bar1(dev.bar1)}")
+        if dev.sriov:
+            pfs = dev.sriov["physical_functions"]
+            per_pf = f" on {pfs} physical functions" if pfs > 1 else ""
+            print(f"    SR-IOV: {dev.sriov['enabled_vfs']} of {dev.sriov['total_vfs']} virtual functions enabled{per_pf}")
+        if dev.driver_hint:
+            driver_type = "open" if dev.driver_hint in [default, open_supported] else "proprietary"
+            print(f"    → Recommended driver type: {driver_type}")
+        print()
+    print("-" * 70)
+    print()
+
+
+def print_search_results(query, results):
+    """Print the chips found by a name search
+
+    Args:
+        query: Search query
+        results: Session.search() results
+    """
+    if not results:
+        print('No GPU matches "%s"' % query)
+        return
+
+    print('GPUs matching "%s":' % query)
+    print("-" * 70)
+    for result in results:
+        arch_info = f" [{result['architecture']}]" if result["architecture"] != "unknown" else ""
+        legacy_info = f" (legacy: {result['legacy']})" if result["legacy"] else ""
+        subsystem_info = ""
+        if result["subsystem_vendor"] and result["subsystem_device"]:
+            subsystem_info = f" [Subsystem: {result['subsystem_vendor']}:{result['subsystem_device']}]"
+        print(f"  {result['name']}{arch_info}{subsystem_info}")
+        print(f"    PCI ID: {result['pci_id']}{legacy_info}")
+        print(f"    Supported drivers: {result['supported_min_driver']}.xx - {result['supported_max_driver']}.xx")
+        print(f"    → Module flavor: {result['module_flavor']} ({result['driver_hint']})")
+        print()
+    print("-" * 70)
+
+
+def print_chip_selection(title, chips):
+    """Print chips selected with Session.select_chips(), grouped by driver range
+
+    Args:
+        title: Heading describing the selection
+        chips: Chip summaries
+    """
+    if not chips:
+        print("No GPU %s" % title)
+        return
+
+    print("%d GPUs %s:" % (len(chips), title))
+    print("-" * 70)
+    group = None
+    for chip in chips:
+        key = (chip["supported_min_driver"], chip["supported_max_driver"], chip["architecture"])
+        if key != group:
+            if group is not None:
+                print()
+            group = key
+            print(f"  [{chip['architecture']}] supported drivers: {key[0]}.xx - {key[1]}.xx")
+        legacy_info = f" (legacy: {chip['legacy']})" if chip["legacy"] else ""
+        print(f"    {chip['pci_id']}  {chip['name']}{legacy_info}")
+    print("-" * 70)
+
+
+def print_lint_report(issues, count):
+    """Print the result of lint_gpu_database()
+
+    Args:
+        issues: LintIssue tuples
+        count: Number of checked database entries
+    """
+    if not issues:
+        print("No problems found in %d database entries" % count)
+        return
+
+    print("-" * 70)
+    for issue in issues:
+        print(f"  {issue.severity}: [{issue.check}] {issue.devid}  {issue.name}")
+        print(f"    {issue.message}")
+    print("-" * 70)
+    errors = sum(1 for issue in issues if issue.severity == "error")
+    print("%d errors, %d warnings in %d database entries" % (errors, len(issues) - errors, count))
+
+
+def build_gpu_topology(devices):
+    """Group the detected GPU functions by NUMA node and shared upstream switch
+
+    Args:
+        devices: Dictionary of Device objects (see get_nvidia_devices())
+
+    Returns:
+        list: One entry per NUMA node ("numa_node" None without NUMA) with
+        "groups" of GPUs sharing a switch, or a root port if they are not
+        behind a switch ("switch" is then None)
+    """
+    nodes = {}
+    for dev in devices.values():
+        for function in dev.topology:
+            upstream = function["switch"] or (function["ancestry"][0] if function["ancestry"] else None)
+            key = (function["switch"] is None, upstream)
+            nodes.setdefault(function["numa_node"], {}).setdefault(key, []).append({
+                "slot": function["slot"],
+                "pci_id": dev.id,
+                "name": dev.name,
+                "local_cpulist": function["local_cpulist"],
+                "iommu_group": function["iommu_group"],
+            })
+
+    topology = []
+    for numa_node in sorted(nodes, key=lambda node: (node is None, node)):
+        groups = []
+        for (root_port, upstream), gpus in sorted(nodes[numa_node].items(), key=lambda item: (item[0][0], item[0][1] or "")):
+            groups.append({
+                "switch": None if root_port else upstream,
+                "root_port": upstream if root_port else None,
+                "gpus": sorted(gpus, key=lambda gpu: gpu["slot"]),
+            })
+        topology.append({"numa_node": numa_node, "groups": groups})
+    return topology
+
+
+def print_gpu_topology(topology):
+    """Print build_gpu_topology() for humans"""
+    if not topology:
+        print("No NVIDIA GPU found")
+        return
+
+    print("GPU topology:")
+    print("-" * 70)
+    for node in topology:
+        print("  NUMA node %s" % (node["numa_node"] if node["numa_node"] is not None else "n/a"))
+        for group in node["groups"]:
+            if group["switch"]:
+                print("    PCIe switch %s" % group["switch"])
+            elif group["root_port"]:
+                print("    Root port %s" % group["root_port"])
+            else:
+                print("    Root complex")
+            for gpu in group["gpus"]:
+                iommu = " iommu_group %d" % gpu["iommu_group"] if gpu["iommu_group"] is not None else ""
+                cpus = " cpus %s" % gpu["local_cpulist"] if gpu["local_cpulist"] else ""
+                print(f"      {gpu['slot']}  {gpu['name']} ({gpu['pci_id']}){cpus}{iommu}")
+    print("-" * 70)
+
+
+# Runtime D3 (RTD3) power management of notebook GPUs: Turing needs the
+# fine-grained mode set explicitly, the default (0x03) enables it from Ampere on
+rtd3_architectures = {"turing": "0x02", "ampere": "0x03", "ada": "0x03", "blackwell": "0x03"}
+
+# Lets the GPU suspend while idle and keeps it awake without the driver
+# (from the "PCI-Express Runtime D3 Power Management" chapter of the driver README)
+prime_udev_rules_path = "/etc/udev/rules.d/80-nvidia-pm.rules"
+PRIME_UDEV_RULES = """\
+# Enable runtime PM for NVIDIA VGA/3D controller devices on driver bind
+ACTION=="bind", SUBSYSTEM=="pci", ATTR{vendor}=="0x10de", ATTR{class}=="0x030000", TEST=="power/control", ATTR{power/control}="auto"
+ACTION=="bind", SUBSYSTEM=="pci", ATTR{vendor}=="0x10de", ATTR{class}=="0x030200", TEST=="power/control", ATTR{power/control}="auto"
+
+# Disable runtime PM for NVIDIA VGA/3D controller devices on driver unbind
+ACTION=="unbind", SUBSYSTEM=="pci", ATTR{vendor}=="0x10de", ATTR{class}=="0x030000", TEST=="power/control", ATTR{power/control}="on"
+ACTION=="unbind", SUBSYSTEM=="pci", ATTR{vendor}=="0x10de", ATTR{class}=="0x030200", TEST=="power/control", ATTR{power/control}="on"
+"""
+
+# Environment of an application to run on the NVIDIA GPU (what prime-run sets)
+prime_offload_environment = collections.OrderedDict([
+    ("__NV_PRIME_RENDER_OFFLOAD", "1"),
+    ("__VK_LAYER_NV_optimus", "NVIDIA_only"),
+    ("__GLX_VENDOR_LIBRARY_NAME", "nvidia"),
+])
+
+
+def recommend_prime_offload(devices, integrated, is_laptop):
+    """Recommend a render offload and runtime power management setup
+
+    On a laptop with an integrated GPU, the desktop should run on the
+    integrated GPU, applications are offloaded to the NVIDIA GPU on demand,
+    and the NVIDIA GPU is powered down while idle. Runtime D3 needs Turing
+    or newer; the oldest NVIDIA GPU decides.
+
+    Args:
+        devices: Dictionary of Device objects
+        integrated: get_integrated_gpus() result
+        is_laptop: Whether the system is a laptop, or a callable answering it
+            (only called if no NVIDIA GPU is a laptop model)
+
+    Returns:
+        dict: JSON serializable recommendation, None if this is not a hybrid laptop
+    """
+    if not devices or not integrated:
+        return None
+    if not any(dev.is_laptop_gpu for dev in devices.values()):
+        if not (is_laptop() if callable(is_laptop) else is_laptop):
+            return None
+
+    levels = [rtd3_architectures.get(dev.architecture) for dev in devices.values()]
+    level = None if None in levels else ("0x02" if "0x02" in levels else "0x03")
+    if level is None:
+        power_management = "the NVIDIA GPU is too old for runtime D3, it stays powered"
+    elif level == "0x02":
+        power_management = "Turing needs the fine-grained mode set explicitly"
+    else:
+        power_management = "enabled by the driver default on Ampere and newer"
+
+    return {
+        "integrated": integrated,
+        "render_offload": True,
+        "offload_environment": dict(prime_offload_environment),
+        "dynamic_power_management": level,
+        "power_management": power_management,
+        "udev_rules_path": prime_udev_rules_path if level else None,
+        "udev_rules": PRIME_UDEV_RULES if level else None,
+    }
+
+
+def print_prime_offload(hybrid):
+    """Print recommend_prime_offload() for humans"""
+    names = ", ".join("%s %s (%s)" % (gpu["vendor_name"], gpu["devid"], gpu["slot"]) for gpu in hybrid["integrated"])
+    print("Hybrid graphics (integrated GPU: %s):" % names)
+    print("  Keep the desktop on the integrated GPU and offload applications to the NVIDIA GPU:")
+    print("    %s <application>" % " ".join("%s=%s" % item for item in hybrid["offload_environment"].items()))
+    if hybrid["dynamic_power_management"]:
+        print("  Power the NVIDIA GPU down while idle:")
+        print("    options nvidia NVreg_DynamicPowerManagement=%s  (%s)"
+              % (hybrid["dynamic_power_management"], hybrid["power_management"]))
+        print("    udev rules in %s (see --json for the contents)" % hybrid["udev_rules_path"])
+    else:
+        print("  Runtime power management: %s" % hybrid["power_management"])
+    print()
+
+
+def get_driver_from_vdpau_feat(devices):
+    """Use the supported VDPAU feature sets to recommend a driver (older method)
+    
+    Args:
+        devices: Dictionary of Device objects
+        
+    Returns:
+        str: "open" or "closed" driver recommendation
+    """
+    hints = []
+    for dev in devices.values():
+        if dev.vdpau_level:
+            if dev.vdpau_level in vdpau_level_group_a:
+                hint = proprietary_required
+                continue
+            elif dev.vdpau_level in vdpau_level_group_b:
+                hint = proprietary_required
+            elif dev.vdpau_level in vdpau_level_group_c:
+                hint = proprietary_supported
+            else:
+                hint = default
+        else:
+            if dev.legacy_branch and int(dev.legacy_branch.split(".")[0]) <= 470:
+                hint = proprietary_required
+            else:
+                hint = default
+        hints.append(hint)
+
+    if default in hints:
+        return "open"
+    else:
+        if proprietary_required in hints:
+            return "closed"
+        else:
+            return "open"
+
+    return None
+
+
+def get_driver_from_json_hints(devices, policy=None):
+    """Use the flags in supported-gpus.json to recommend a driver (primary method)
+    
+    Args:
+        devices: Dictionary of Device objects
+        policy: Policy the devices were evaluated with (defaults to the module constants)
+        
+    Returns:
+        str: "open" or "closed" driver recommendation
+    """
+    if policy is None:
+        policy = Policy.default()
+
+    hints = [dev.driver_hint for dev in devices.values()]
+    
+    for dev in devices.values():
+        logging.debug(
+            "Device analysis: %s (ID: %s) - Arch: %s - Type: %s - Subsystem: %s:%s - JSON hint: %s - Final hint: %s",
+            dev.name, dev.id, dev.architecture, 
+            "Mobile" if dev.is_laptop_gpu else "Desktop",
+            dev.subvendorid or "N/A", dev.subdevid or "N/A",
+            "open" if dev.feature_mask & FEATURE_KERNELOPEN else "proprietary",
+            dev.driver_hint
+        )
+    
+    proprietary_forced_devices = [
+        dev.name for dev in devices.values() 
+        if dev.architecture in policy.open_unsupported_archs and 
+        dev.driver_hint == proprietary_required
+    ]
+    
+    if proprietary_forced_devices:
+        logging.debug(
+            "JSON corrections applied for architectures that don't support open kernel: %s", 
+            ", ".join(proprietary_forced_devices)
+        )
+    
+    all_support_open = all(hint in (default, proprietary_supported) for hint in hints)
+    all_require_closed = all(hint == proprietary_required for hint in hints)
+    any_default = any(hint == default for hint in hints)
+    any_require_closed = any(hint == proprietary_required for hint in hints)
+
+    if all_support_open:
+        logging.debug("recommend_driver(): all devices support open")
+        return "open"
+    elif all_require_closed:
+        logging.debug("recommend_driver(): all devices require closed")
+        return "closed"
+    elif any_default:
+        logging.debug("recommend_driver(): at least one devices requires open")
+        return "open"
+    elif any_require_closed:
+        logging.debug("recommend_driver(): at least one devices requires closed")
+        return "closed"
+    else:
+        logging.error("unimplemented - hints:\n%s" % (" ".join(hints)))
+        return None
+
+
+def recommend_driver(sys_path=None, supported_gpus=None, use_driver_hints=False, simulate_gpu=None, mhwd=False, suppress_warnings=False, policy=None,
+                     state_cache=None):
+    """Recommend a driver using the available logic
+    
+    Args:
+        sys_path: Optional alternative /sys path (for testing)
+        supported_gpus: Path to supported-gpus.json file
+        use_driver_hints: Whether to use JSON hints (True) or VDPAU logic (False)
+        simulate_gpu: Simulated GPU ID for testing
+        mhwd: Whether running in MHWD mode (Manjaro Hardware Detection)
+        suppress_warnings: Whether to suppress multiple match warnings
+        policy: Policy to evaluate the devices with (defaults to the module constants)
+        state_cache: Optional file holding the last result; it is returned without
+            detection while the PCI topology, database and policy are unchanged
+        
+    Returns:
+        tuple: (driver_type: str, devices: dict) or (None, None) on failure
+    """
+    if policy is None:
+        policy = Policy.default()
+
+    stamp = None
+    if state_cache and not simulate_gpu:
+        stamp = get_detection_stamp(sys_path, supported_gpus, policy, use_driver_hints)
+        cached = load_detection_state(state_cache, stamp, policy, sys_path=sys_path)
+        if cached:
+            logging.debug("recommend_driver(): hardware unchanged, using %s" % state_cache)
+            driver, devices = cached
+            if not mhwd and not suppress_warnings:
+                print_pretty_gpu_summary(devices)
+            return driver, devices
+
+    devices = get_nvidia_devices(sys_path, supported_gpus, simulate_gpu, suppress_warnings, policy)
+    if not mhwd and not suppress_warnings:
+        print_pretty_gpu_summary(devices)
+
+    if not devices:
+        return None, None
+
+    driver = decide_driver(devices, use_driver_hints, policy)
+    if driver:
+        save_detection_state(state_cache, stamp, driver, devices)
+    return driver, devices
+
+
+def decide_driver(devices, use_driver_hints=True, policy=None):
+    """Pick the kernel module flavor for a set of already evaluated devices
+
+    Args:
+        devices: Dictionary of Device objects
+        use_driver_hints: Whether to use JSON hints (True) or VDPAU logic (False)
+        policy: Policy the devices were evaluated with (defaults to the module constants)
+
+    Returns:
+        str: "open" or "closed" driver recommendation, or None
+    """
+    logging.debug("recommend_driver(): Do device IDs support the open driver?")
+
+    if use_driver_hints:
         logging.debug("recommend_driver(): using json logic")
-        return get_driver_from_json_hints(devices), devices
+        return get_driver_from_json_hints(devices, policy)
+    else:
+        logging.debug("recommend_driver(): using VDPAU logic")
+        return get_driver_from_vdpau_feat(devices)
+
+
+def get_conditional_instructions(distro_id, version_id, instructions_dict):
+    """Instructions may depend on the specific distro release
+    
+    Args:
+        distro_id: Distribution ID (e.g., "rhel")
+        version_id: Distribution version (e.g., "7", "10")
+        instructions_dict: Dictionary of version-specific instructions
+        
+    Returns:
+        list: Installation instructions for the specific version
+    """
+    if not isinstance(instructions_dict, dict):
+        return instructions_dict
+    
+    versions = []
+    for cond in instructions_dict.keys():
+        from_ver = float(cond)
+        if float(version_id) >= from_ver:
+            versions.append(from_ver)
+    if versions:
+        return instructions_dict.get(max(versions))
+    return list(instructions_dict.values())[0] if instructions_dict else None
+
+
+class InstructionResolver(object):
+    """Precompiled form of the instruction tables
+
+    Version conditions are parsed once into sorted thresholds searched with
+    bisect, and the KERNEL/BRANCH placeholders are compiled into format
+    strings, so resolving a target is a dictionary lookup plus one format
+    call per line. Results match get_conditional_instructions() and the
+    placeholder substitutions of get_install_instructions().
+
+    Args:
+        plain: Instruction table used without a branch (default: instructions)
+        branched: Instruction table used with a branch (default: branch_instructions)
+    """
+    __slots__ = ("tables",)
+
+    def __init__(self, plain=None, branched=None):
+        self.tables = {}
+        for with_branch, table in ((False, plain if plain is not None else instructions),
+                                   (True, branched if branched is not None else branch_instructions)):
+            for key, entry in table.items():
+                if isinstance(entry, dict):
+                    if not entry:
+                        continue
+                    conditions = sorted((float(cond), self._compile(lines)) for cond, lines in entry.items())
+                    thresholds = [cond for cond, lines in conditions]
+                    choices = [lines for cond, lines in conditions]
+                    # Below every threshold the first entry of the table applies
+                    fallback = self._compile(next(iter(entry.values())))
+                else:
+                    thresholds, choices, fallback = [], [], self._compile(entry)
+                self.tables[(key, with_branch)] = (thresholds, choices, fallback)
+
+    @staticmethod
+    def _compile(lines):
+        return tuple(
+            line.replace("{", "{{").replace("}", "}}").replace("KERNEL", "{kernel}").replace("BRANCH", "{branch}")
+            for line in lines
+        )
+
+    def versions(self, distro_id):
+        """Get the version thresholds any table has for a distribution (sorted floats)"""
+        versions = set()
+        for (key, with_branch), (thresholds, choices, fallback) in self.tables.items():
+            if key.rsplit("-", 1)[0] == distro_id:
+                versions.update(thresholds)
+        return sorted(versions)
+
+    def resolve(self, driver, distro_id, version_id, branch_id=None, kernel_package=None, latest_branch=None):
+        """Render the installation commands of one target
+
+        Args:
+            driver: "open" or "closed" driver type
+            distro_id: Distribution ID
+            version_id: Distribution version (only used by versioned tables)
+            branch_id: Specific driver branch (optional)
+            kernel_package: Manjaro kernel package replacing KERNEL (kept as is if None)
+            latest_branch: Branch replacing BRANCH in the unbranched table (optional)
+
+        Returns:
+            list: Installation commands, or None if the table has no entry
+
+        Raises:
+            AssistantError: If the version cannot be compared
+        """
+        compiled = self.tables.get(("%s-%s" % (distro_id, driver), bool(branch_id)))
+        if compiled is None:
+            return None
+        thresholds, choices, lines = compiled
+        if thresholds:
+            try:
+                position = bisect.bisect_right(thresholds, float(version_id))
+            except (TypeError, ValueError):
+                raise AssistantError("invalid %s version: %s" % (distro_id, version_id))
+            if position:
+                lines = choices[position - 1]
+        values = {
+            "kernel": kernel_package if kernel_package and distro_id == "manjaro" else "KERNEL",
+            "branch": str(branch_id or latest_branch) if branch_id or latest_branch else "BRANCH",
+        }
+        return [line.format(**values) for line in lines]
+
+
+@functools.lru_cache(maxsize=1)
+def get_instruction_resolver():
+    """Get the InstructionResolver of the module's instruction tables (built once)"""
+    return InstructionResolver()
+
+
+def render_instruction_matrix(distros=None, branches=(), kernel_package=None, resolver=None):
+    """Render the installation commands of many targets at once
+
+    Every distribution is rendered for both flavors, once per version
+    threshold of its tables (or once if it has none), without a branch and
+    with each given branch. Identical command lists are stored once.
+
+    Target names are "DISTRO[:VERSION]-FLAVOR[-BRANCH]", e.g. "rhel:10-open-570".
+    On Ubuntu the unbranched target does not check the apt cache for the
+    latest branch, unlike get_install_instructions().
+
+    Args:
+        distros: Distribution IDs (default: supported_distros)
+        branches: Driver branches to render besides the unbranched targets
+        kernel_package: Manjaro kernel package (default: the running kernel's)
+        resolver: InstructionResolver (default: get_instruction_resolver())
+
+    Returns:
+        dict: {"targets": {target: output ID}, "outputs": {output ID: commands}}
+    """
+    if resolver is None:
+        resolver = get_instruction_resolver()
+    if kernel_package is None:
+        kernel_package = manjaro_get_kernel_package()
+
+    targets = {}
+    outputs = {}
+    for distro_id in (distros if distros is not None else supported_distros):
+        versions = resolver.versions(distro_id) or [None]
+        for version in versions:
+            version_id = ("%g" % version) if version is not None else None
+            prefix = distro_id + (":" + version_id if version_id else "")
+            for driver in ("open", "closed"):
+                for branch_id in [None] + [str(branch) for branch in branches]:
+                    commands = resolver.resolve(driver, distro_id, version_id, branch_id, kernel_package)
+                    if commands is None:
+                        continue
+                    output_id = hashlib.sha1("\n".join(commands).encode()).hexdigest()[:12]
+                    outputs[output_id] = commands
+                    target = "%s-%s" % (prefix, driver) + ("-%s" % branch_id if branch_id else "")
+                    targets[target] = output_id
+    return {"targets": targets, "outputs": outputs}
+
+
+def get_install_instructions(driver, distro_id, version_id, branch_id=None, latest_branch=None, root="/"):
+    """Resolve the installation commands for a driver flavor on a distribution
+
+    Args:
+        driver: "open" or "closed" driver type
+        distro_id: Distribution ID
+        version_id: Distribution version
+        branch_id: Specific driver branch (optional)
+        latest_branch: Already probed ubuntu_get_latest_driver_branch() result (optional)
+        root: Root directory of the target system (package lists, kernel)
+
+    Returns:
+        list: Installation commands
+
+    Raises:
+        AssistantError: If no instructions exist or the branch cannot be determined
+    """
+    if distro_id == "ubuntu" and not branch_id:
+        if not latest_branch:
+            latest_branch = ubuntu_get_latest_driver_branch(root)
+        if not latest_branch:
+            raise AssistantError("failed to get the latest driver branch")
+    else:
+        latest_branch = None
+
+    kernel_package = manjaro_get_kernel_package(root) if distro_id == "manjaro" else None
+    candidates = get_instruction_resolver().resolve(
+        driver, distro_id, version_id, branch_id, kernel_package, latest_branch
+    )
+    if not candidates:
+        raise AssistantError("could not find the instructions for %s-%s" % (distro_id, driver))
+    return candidates
+
+
+# Package managers whose plain install commands are run without a shell
+install_package_managers = ("apt-get", "apt", "dnf", "yum", "tdnf", "zypper", "pacman")
+package_manager_subcommands = ("install", "module", "-S")
+
+InstallStep = collections.namedtuple("InstallStep", ["argv", "command"])
+
+
+def split_install_command(line):
+    """Split an instruction line into its package manager invocation and packages
+
+    Args:
+        line: Instruction line, e.g. "sudo dnf -y install cuda-drivers"
+
+    Returns:
+        tuple: (invocation: tuple of arguments, packages: list), or None if
+        the line is not a plain install command of a known package manager
+    """
+    try:
+        argv = shlex.split(line)
+    except ValueError:
+        return None
+    position = 1 if argv[:1] == ["sudo"] else 0
+    if len(argv) <= position or os.path.basename(argv[position]) not in install_package_managers:
+        return None
+    if not any(arg in package_manager_subcommands for arg in argv[position + 1:]):
+        return None
+
+    # Packages are the trailing arguments after the last option or subcommand
+    end = len(argv)
+    while end > position + 1 and not argv[end - 1].startswith("-") and argv[end - 1] not in package_manager_subcommands:
+        end -= 1
+    packages = argv[end:]
+    if not packages or any(char in line for char in "|&;<>$`"):
+        return None
+    return tuple(argv[:end]), packages
+
+
+def plan_install(commands):
+    """Turn instruction lines into install steps
+
+    Plain install commands of a known package manager are run directly,
+    without a shell; any other line is run through the shell, like before.
+
+    Args:
+        commands: Instruction lines (see get_install_instructions())
+
+    Returns:
+        list: InstallStep tuples, one per line; argv is None for shell steps
+    """
+    plan = []
+    for line in commands:
+        split = split_install_command(line)
+        if split is None:
+            plan.append(InstallStep(None, line))
+        else:
+            invocation, packages = split
+            plan.append(InstallStep(list(invocation) + packages, line))
+    return plan
+
+
+def format_install_step(step):
+    """Get the shell command line of an install step"""
+    if step.argv is None:
+        return step.command
+    return " ".join(shlex.quote(arg) for arg in step.argv)
+
+
+def run_install_plan(plan, stream=None):
+    """Run install steps, streaming their output with timestamps
+
+    Every output line is prefixed with the time elapsed since the step
+    started. The output is forwarded as soon as it arrives, not line by
+    line, so a prompt without a trailing newline ("Proceed with
+    installation? [Y/n]") is shown before the package manager waits for
+    the answer. Execution stops at the first failing step.
+
+    Args:
+        plan: InstallStep list (see plan_install())
+        stream: Text stream for the progress output (default: sys.stdout)
+
+    Returns:
+        list: One dict per executed step with "command", "returncode" and
+        "elapsed" seconds
+    """
+    stream = stream if stream is not None else sys.stdout
+    report = []
+    for step in plan:
+        command = format_install_step(step)
+        print("  %s\n" % command, file=stream, flush=True)
+        start = time.monotonic()
+        try:
+            process = subprocess.Popen(
+                step.argv if step.argv is not None else command,
+                shell=step.argv is None,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                bufsize=0,
+            )
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            line_start = True
+            while True:
+                chunk = os.read(process.stdout.fileno(), 4096)
+                if not chunk:
+                    break
+                for piece in re.findall(r"[^\n]*\n|[^\n]+", decoder.decode(chunk)):
+                    if line_start:
+                        stream.write("  [%7.2fs] " % (time.monotonic() - start))
+                    stream.write(piece)
+                    line_start = piece.endswith("\n")
+                stream.flush()
+            if not line_start:
+                stream.write("\n")
+            process.stdout.close()
+            returncode = process.wait()
+        except OSError as e:
+            print("  %s" % e, file=stream, flush=True)
+            returncode = 127
+        elapsed = time.monotonic() - start
+        logging.debug("run_install_plan(): %s exited with %d after %.2fs" % (command, returncode, elapsed))
+        report.append({
+            "command": command,
+            "returncode": returncode,
+            "elapsed": round(elapsed, 3),
+        })
+        if returncode != 0:
+            break
+    return report
+
+
+InstalledDriver = collections.namedtuple("InstalledDriver", ["version", "flavor", "packages"])
+
+# Installed packages worth comparing with the install commands
+installed_package_pattern = re.compile(r"nvidia|cuda-drivers")
+
+
+def read_text(path):
+    """Read a small text file, None if it does not exist or cannot be read"""
+    try:
+        with open(path, "r", errors="replace") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def get_loaded_driver(sys_path=None, root="/"):
+    """Get the version and flavor of the loaded nvidia kernel module
+
+    The flavor comes from /proc/driver/nvidia/version, which names the open
+    kernel module, or else from the module taint flags (the proprietary
+    module taints the kernel with "P").
+
+    Args:
+        sys_path: Optional alternative /sys path (for testing)
+        root: Root directory holding /proc (for testing)
+
+    Returns:
+        tuple: (version: str, flavor: "open" or "closed"), (None, None) if not loaded
+    """
+    module = os.path.join(sys_path if sys_path else "/sys", "module", "nvidia")
+    version = read_text(os.path.join(module, "version"))
+    if version is None:
+        return None, None
+
+    flavor = None
+    proc_version = read_text(os.path.join(root, "proc", "driver", "nvidia", "version"))
+    if proc_version:
+        flavor = "open" if "Open Kernel Module" in proc_version else "closed"
+    else:
+        taint = read_text(os.path.join(module, "taint"))
+        if taint is not None:
+            flavor = "closed" if "P" in taint else "open"
+    return version.strip(), flavor
+
+
+def parse_dpkg_status(data):
+    """Get the installed packages from a dpkg status file
+
+    Returns:
+        dict: Version keyed by package name
+    """
+    packages = {}
+    for stanza in data.split("\n\n"):
+        fields = {}
+        for line in stanza.splitlines():
+            if line and not line[0].isspace() and ":" in line:
+                key, value = line.split(":", 1)
+                fields[key] = value.strip()
+        if fields.get("Package") and fields.get("Status", "").endswith(" installed"):
+            packages[fields["Package"]] = fields.get("Version", "")
+    return packages
+
+
+def read_pacman_local(path):
+    """Get the installed packages from a pacman local database directory
+
+    Returns:
+        dict: Version keyed by package name
+    """
+    packages = {}
+    for entry in os.listdir(path):
+        desc = read_text(os.path.join(path, entry, "desc"))
+        if not desc:
+            continue
+        lines = desc.splitlines()
+        fields = {}
+        for i, line in enumerate(lines[:-1]):
+            if line.startswith("%") and line.endswith("%"):
+                fields[line.strip("%")] = lines[i + 1].strip()
+        if fields.get("NAME"):
+            packages[fields["NAME"]] = fields.get("VERSION", "")
+    return packages
+
+
+def parse_rpm_query(output):
+    """Parse the output of rpm -qa --qf '%{NAME} %{VERSION}-%{RELEASE}\\n'
+
+    Returns:
+        dict: Version keyed by package name
+    """
+    packages = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 2:
+            packages[fields[0]] = fields[1]
+    return packages
+
+
+def get_installed_packages(root="/"):
+    """Get the installed NVIDIA driver packages from the local package database
+
+    dpkg and pacman databases are read directly; the rpm database is queried
+    through rpm, which is only run if no other database is found.
+
+    Args:
+        root: Root directory of the system (for testing or images)
+
+    Returns:
+        dict: Version keyed by package name, None if no package database was found
+    """
+    packages = None
+    dpkg_status = os.path.join(root, "var", "lib", "dpkg", "status")
+    pacman_local = os.path.join(root, "var", "lib", "pacman", "local")
+    if os.path.isfile(dpkg_status):
+        packages = parse_dpkg_status(read_text(dpkg_status) or "")
+    elif os.path.isdir(pacman_local):
+        packages = read_pacman_local(pacman_local)
+    else:
+        try:
+            result = subprocess.run(
+                ["rpm", "--root", os.path.abspath(root), "-qa", "--qf", "%{NAME} %{VERSION}-%{RELEASE}\n"],
+                capture_output=True, text=True, timeout=30
+            )
+            if result.returncode == 0:
+                packages = parse_rpm_query(result.stdout)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logging.debug("get_installed_packages(): cannot query rpm: %s" % e)
+
+    if packages is None:
+        return None
+    return {name: version for name, version in packages.items() if installed_package_pattern.search(name)}
+
+
+def uses_running_kernel(root="/", sys_path=None):
+    """Whether the loaded modules in /sys belong to the system in root
+
+    The running kernel's modules say nothing about an image or chroot (see
+    --root), unless an alternative /sys of that system is given.
+    """
+    return bool(sys_path) or os.path.abspath(root) == "/"
+
+
+def get_installed_driver(sys_path=None, root="/"):
+    """Get the local driver state (see get_loaded_driver() and get_installed_packages())
+
+    The loaded module is skipped for another root without its own sys_path
+    (see uses_running_kernel()).
+
+    Returns:
+        InstalledDriver: packages is None if no package database was found
+    """
+    version = flavor = None
+    if uses_running_kernel(root, sys_path):
+        version, flavor = get_loaded_driver(sys_path, root)
+    return InstalledDriver(version, flavor, get_installed_packages(root))
+
+
+def check_installed(driver, commands, installed, branch_id=None):
+    """Check whether the recommended driver is already installed
+
+    The packages named by the install commands must be installed, and a
+    loaded nvidia module must be of the recommended flavor (and branch). If
+    the commands do not name plain packages (e.g. dnf module streams), the
+    loaded module alone decides.
+
+    Args:
+        driver: Recommended "open" or "closed" flavor
+        commands: Install commands (see get_install_instructions())
+        installed: InstalledDriver
+        branch_id: Requested driver branch (optional)
+
+    Returns:
+        tuple: (satisfied: bool, reason: str)
+    """
+    if installed.version:
+        if installed.flavor and installed.flavor != driver:
+            return False, "the loaded nvidia module is the %s flavor" % installed.flavor
+        if branch_id and installed.version.split(".")[0] != str(branch_id):
+            return False, "the loaded nvidia module is version %s" % installed.version
+
+    wanted = []
+    for step in plan_install(commands):
+        if step.argv is None:
+            wanted = None
+            break
+        invocation, packages = split_install_command(format_install_step(step))
+        if any(":" in package for package in packages):
+            wanted = None
+            break
+        wanted.extend(packages)
+
+    if wanted is None or installed.packages is None:
+        if installed.version and installed.flavor == driver:
+            return True, "the %s nvidia module %s is loaded" % (driver, installed.version)
+        return False, "the installed packages cannot be verified"
+
+    missing = [package for package in wanted if package not in installed.packages]
+    if missing:
+        return False, "not installed: %s" % ", ".join(missing)
+    installed_versions = ", ".join("%s %s" % (package, installed.packages[package]) for package in wanted)
+    if installed.version:
+        return True, "installed: %s; loaded: %s" % (installed_versions, installed.version)
+    return True, "installed: %s (not loaded yet, a reboot may be needed)" % installed_versions
+
+
+# Kernel modules of the driver whose options the advisor looks at
+nvidia_kernel_modules = ("nvidia", "nvidia_drm", "nvidia_modeset", "nvidia_uvm")
+
+# modprobe.d directories relative to the root, a file masks files of the same name in later ones
+modprobe_directories = ("etc/modprobe.d", "run/modprobe.d", "usr/local/lib/modprobe.d", "usr/lib/modprobe.d",
+                        "lib/modprobe.d")
+
+# File the advisor proposes for options that are not configured anywhere
+module_options_file = "etc/modprobe.d/nvidia-driver-assistant.conf"
+
+ModuleOption = collections.namedtuple("ModuleOption", ["module", "name", "value", "reason"])
+
+# Options the advisor recommends, with the first driver branch that has them;
+# nvidia_drm (and with it modeset) ships from the 364.xx branch on
+module_option_catalog = (
+    ("modeset", 364, ModuleOption("nvidia_drm", "modeset", "1", "kernel mode setting, required by Wayland and PRIME")),
+    ("pat", 304, ModuleOption("nvidia", "NVreg_UsePageAttributeTable", "1",
+                              "write-combined mappings through PAT instead of MTRRs")),
+    ("fbdev", 545, ModuleOption("nvidia_drm", "fbdev", "1", "framebuffer console on the NVIDIA DRM driver")),
+    ("preserve_memory", 470, ModuleOption("nvidia", "NVreg_PreserveVideoMemoryAllocations", "1",
+                                          "keep the video memory contents across suspend")),
+    ("temporary_path", 470, ModuleOption("nvidia", "NVreg_TemporaryFilePath", "/var/tmp",
+                                         "video memory saved on suspend goes to disk, not to a tmpfs")),
+    ("gsp_firmware", 555, ModuleOption("nvidia", "NVreg_EnableGpuFirmware", "1",
+                                       "offload GPU initialization and management to the GSP firmware")),
+)
+
+# Options worth setting for the GPUs of each architecture: the GSP firmware
+# exists from Turing on, the oldest GPUs run branches without nvidia_drm
+_kms_module_options = ("modeset", "pat", "fbdev", "preserve_memory", "temporary_path")
+architecture_module_options = {
+    "blackwell": _kms_module_options + ("gsp_firmware",),
+    "ada": _kms_module_options + ("gsp_firmware",),
+    "ampere": _kms_module_options + ("gsp_firmware",),
+    "turing": _kms_module_options + ("gsp_firmware",),
+    "volta": _kms_module_options,
+    "pascal": _kms_module_options,
+    "maxwell": _kms_module_options,
+    "kepler": _kms_module_options,
+    "fermi": _kms_module_options,
+    "tesla2": ("pat",),
+    "tesla1": ("pat",),
+    "curie": (),
+    "pre-curie": (),
+    "unknown": _kms_module_options,
+}
+
+# Where a configured option comes from: path (None for the kernel command line) and line index
+ConfiguredOption = collections.namedtuple("ConfiguredOption", ["value", "path", "line"])
+
+
+def normalize_module_name(name):
+    """Module names are equivalent with dashes and underscores"""
+    return name.replace("-", "_")
+
+
+def get_modprobe_files(root="/"):
+    """Get the modprobe.d configuration files in the order modprobe reads them
+
+    Returns:
+        list: Paths sorted by file name, masked files left out
+    """
+    files = {}
+    for directory in modprobe_directories:
+        try:
+            names = os.listdir(os.path.join(root, directory))
+        except OSError:
+            continue
+        for name in names:
+            if name.endswith(".conf") and name not in files:
+                files[name] = os.path.join(root, directory, name)
+    return [files[name] for name in sorted(files)]
+
+
+def parse_modprobe_options(text):
+    """Parse the "options" lines of a modprobe.d file
+
+    Returns:
+        list: (line index, module, {name: value}) tuples, line index of the
+        first physical line of a continued line
+    """
+    entries = []
+    lines = text.splitlines()
+    index = 0
+    while index < len(lines):
+        start = index
+        line = lines[index]
+        while line.endswith("\\") and index + 1 < len(lines):
+            index += 1
+            line = line[:-1] + " " + lines[index]
+        index += 1
+        fields = line.split("#", 1)[0].split()
+        if len(fields) < 3 or fields[0] != "options":
+            continue
+        options = {}
+        for token in fields[2:]:
+            name, _, value = token.partition("=")
+            options[name] = value.strip('"')
+        entries.append((start, normalize_module_name(fields[1]), options))
+    return entries
+
+
+def parse_kernel_cmdline(text):
+    """Get the module options set on the kernel command line (module.name=value)
+
+    Returns:
+        dict: {(module, name): value}
+    """
+    try:
+        tokens = shlex.split(text or "")
+    except ValueError:
+        tokens = (text or "").split()
+    options = {}
+    for token in tokens:
+        key, _, value = token.partition("=")
+        module, dot, name = key.partition(".")
+        if dot and name:
+            options[(normalize_module_name(module), name)] = value
+    return options
+
+
+def get_configured_module_options(root="/", modules=nvidia_kernel_modules):
+    """Get the options the driver modules are loaded with at the next boot
+
+    The kernel command line is applied after modprobe.d and wins, as does
+    a later modprobe.d file over an earlier one.
+
+    Args:
+        root: Root directory of /etc, /usr/lib, /lib, /run and /proc (for testing)
+        modules: Module names to collect the options of
+
+    Returns:
+        dict: {(module, name): ConfiguredOption}
+    """
+    configured = {}
+    for path in get_modprobe_files(root):
+        text = read_text(path)
+        if text is None:
+            continue
+        for line, module, options in parse_modprobe_options(text):
+            if module in modules:
+                for name, value in options.items():
+                    configured[(module, name)] = ConfiguredOption(value, path, line)
+    cmdline = parse_kernel_cmdline(read_text(os.path.join(root, "proc/cmdline")))
+    for (module, name), value in cmdline.items():
+        if module in modules:
+            configured[(module, name)] = ConfiguredOption(value, None, None)
+    return configured
+
+
+def get_loaded_module_options(sys_path=None, modules=nvidia_kernel_modules):
+    """Get the parameters of the loaded driver modules from /sys/module
+
+    Returns:
+        dict: {(module, name): value}
+    """
+    loaded = {}
+    base = "/sys/module" if not sys_path else "%s/module" % (sys_path)
+    for module in modules:
+        directory = os.path.join(base, module, "parameters")
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        for name in names:
+            value = read_text(os.path.join(directory, name))
+            if value is not None:
+                loaded[(module, name)] = value.strip()
+    return loaded
+
+
+def recommend_module_options(driver, devices, hybrid=None):
+    """Get the recommended module options for the decided flavor and GPUs
+
+    Each GPU gets the options of its architecture (see
+    architecture_module_options) that its driver branch has: a legacy GPU
+    runs its legacy branch, which lacks the newer options (see
+    module_option_catalog). As the GPUs share the kernel modules, only the
+    options every GPU gets are recommended.
+
+    Args:
+        driver: "open" or "closed" driver type
+        devices: Dictionary of Device objects
+        hybrid: recommend_prime_offload() result (optional)
+
+    Returns:
+        list: ModuleOption entries
+    """
+    def device_options(dev):
+        branch = dev.legacy_branch.split(".")[0] if dev.legacy_branch else None
+        branch = int(branch) if branch and branch.isdigit() else None
+        wanted = architecture_module_options.get(dev.architecture, architecture_module_options["unknown"])
+        names = set()
+        for name, since, option in module_option_catalog:
+            if name not in wanted or (branch is not None and branch < since):
+                continue
+            if name == "gsp_firmware" and (driver != "closed" or not dev.feature_mask & FEATURE_GSP_PROPRIETARY):
+                continue
+            names.add(name)
+        return names
+
+    common = None
+    for dev in devices.values():
+        names = device_options(dev)
+        common = names if common is None else common & names
+    options = [option for name, since, option in module_option_catalog if name in (common or ())]
+    if hybrid and hybrid["dynamic_power_management"]:
+        options.append(ModuleOption("nvidia", "NVreg_DynamicPowerManagement", hybrid["dynamic_power_management"],
+                                    "power the GPU down while idle (%s)" % hybrid["power_management"]))
+    return options
+
+
+def advise_module_options(driver, devices, root="/", sys_path=None, hybrid=None):
+    """Compare the recommended module options with the local configuration
+
+    Options that need a change are changed where they are configured (files
+    of the distribution packages outside /etc through a copy in
+    /etc/modprobe.d masking them), the missing ones are added to a file of
+    their own; a value set on the kernel command line has to be changed in
+    the boot loader.
+
+    Args:
+        driver: "open" or "closed" driver type
+        devices: Dictionary of Device objects
+        root: Root directory of the configuration files and /proc (for testing)
+        sys_path: Optional alternative path to /sys (for testing); the loaded
+            module parameters are skipped for another root without it
+        hybrid: recommend_prime_offload() result (optional)
+
+    Returns:
+        dict: "options" (one entry per recommended option, with "action"
+        "keep", "add", "change" or "change-cmdline") and "diffs" (unified
+        diffs of the modprobe.d files)
+    """
+    configured = get_configured_module_options(root)
+    loaded = get_loaded_module_options(sys_path) if uses_running_kernel(root, sys_path) else {}
+
+    def display(path):
+        return "/" + os.path.relpath(path, root) if root != "/" else path
+
+    entries = []
+    edits = {}
+    for option in recommend_module_options(driver, devices, hybrid):
+        current = configured.get((option.module, option.name))
+        if current is None:
+            action = "add"
+            edits.setdefault(os.path.join(root, module_options_file), []).append((None, option))
+        elif current.value == option.value:
+            action = "keep"
+        elif current.path is None:
+            action = "change-cmdline"
+        else:
+            action = "change"
+            edits.setdefault(current.path, []).append((current.line, option))
+        entries.append({
+            "module": option.module,
+            "option": option.name,
+            "recommended": option.value,
+            "configured": current.value if current else None,
+            "source": (display(current.path) if current.path else "/proc/cmdline") if current else None,
+            "loaded": loaded.get((option.module, option.name)),
+            "action": action,
+            "reason": option.reason,
+        })
+
+    diffs = []
+    for path in sorted(edits):
+        old = read_text(path) or ""
+        lines = old.splitlines()
+        added = collections.OrderedDict()
+        for line, option in edits[path]:
+            if line is None:
+                added.setdefault(option.module, []).append("%s=%s" % (option.name, option.value))
+                continue
+            # The option may be on a continuation line
+            pattern = re.compile(r"(\s%s=)(\"[^\"]*\"|\S*)" % re.escape(option.name))
+            while line < len(lines):
+                lines[line], replaced = pattern.subn(lambda match: match.group(1) + option.value, lines[line], 1)
+                if replaced or not lines[line].endswith("\\"):
+                    break
+                line += 1
+        for module, tokens in added.items():
+            lines.append("options %s %s" % (module, " ".join(tokens)))
+        new = "\n".join(lines) + "\n"
+        source = target = display(path)
+        if not target.startswith("/etc/"):
+            source, target, old = "/dev/null", "/etc/modprobe.d/" + os.path.basename(path), ""
+        elif not old:
+            source = "/dev/null"
+        diffs.append({
+            "path": target,
+            "diff": "".join(difflib.unified_diff(old.splitlines(True), new.splitlines(True), source, target)),
+        })
+    return {"options": entries, "diffs": diffs}
+
+
+def print_module_advice(advice):
+    """Print advise_module_options() for humans"""
+    print()
+    print("Kernel module options:")
+    for entry in advice["options"]:
+        option = "%s %s=%s" % (entry["module"], entry["option"], entry["recommended"])
+        if entry["action"] == "keep":
+            state = "ok"
+        elif entry["action"] == "add":
+            state = "not set"
+        else:
+            state = "set to %s in %s" % (entry["configured"], entry["source"])
+        print("  %-52s %s" % (option, state))
+        print("      %s" % entry["reason"])
+    for entry in advice["options"]:
+        if entry["action"] == "change-cmdline":
+            print("Change %s.%s=%s on the kernel command line" % (entry["module"], entry["option"], entry["recommended"]))
+    if advice["diffs"]:
+        print()
+        for diff in advice["diffs"]:
+            print(diff["diff"], end="")
+        print("The options take effect when the modules are loaded again (e.g. after a reboot);")
+        print("regenerate the initramfs if the modules are included in it.")
+
+
+def process_results(driver, distro_id, version_id, branch_id=None, install=False, latest_branch=None,
+                    dry_run=False, report=None, stream=None, installed=None, check=None, root="/"):
+    """Process and display/execute installation instructions
+    
+    Args:
+        driver: "open" or "closed" driver type
+        distro_id: Distribution ID
+        version_id: Distribution version
+        branch_id: Specific driver branch (optional)
+        install: Whether to install (True) or just show instructions (False)
+        latest_branch: Already probed latest Ubuntu branch (optional)
+        dry_run: With install, only show the commands that would run
+        report: Optional list receiving the run_install_plan() step reports
+        stream: Text stream for the installation output (default: sys.stdout)
+        installed: InstalledDriver to skip the installation if already satisfied (optional)
+        check: Optional dict receiving the check_installed() result ("satisfied", "reason")
+        root: Root directory of the target system (see get_install_instructions())
+        
+    Returns:
+        bool: Success status
+    """
+    try:
+        candidates = get_install_instructions(driver, distro_id, version_id, branch_id, latest_branch, root)
+    except AssistantError as e:
+        print("Error: %s" % e, file=sys.stderr)
+        return False
+
+    if install:
+        stream = stream if stream is not None else sys.stdout
+        if installed is not None:
+            satisfied, reason = check_installed(driver, candidates, installed, branch_id)
+            logging.debug("process_results(): already installed: %s (%s)" % (satisfied, reason))
+            if check is not None:
+                check.update(satisfied=satisfied, reason=reason)
+            if satisfied:
+                print(
+                    "The %s kernel module flavour is already installed, nothing to do:\n  %s"
+                    % ("legacy" if driver == "closed" else "open", reason),
+                    file=stream
+                )
+                return True
+
+        plan = plan_install(candidates)
+        if dry_run:
+            print(
+                "The following command%s would install the %s kernel module flavour:"
+                % ("s" if len(plan) > 1 else "", "legacy" if driver == "closed" else "open"),
+                file=stream
+            )
+            for step in plan:
+                print("  %s" % format_install_step(step), file=stream)
+            if report is not None:
+                report.extend({"command": format_install_step(step)} for step in plan)
+            return True
+
+        print(
+            "Installing the following package%s for the %s kernel module flavour:"
+            % ("s" if len(candidates) > 1 else "", "legacy" if driver == "closed" else "open"),
+            file=stream
+        )
+        steps = run_install_plan(plan, stream)
+        if report is not None:
+            report.extend(steps)
+        if not steps or steps[-1]["returncode"] != 0:
+            print(
+                "\nError: failed to execute the following command:\n  %s"
+                % (steps[-1]["command"] if steps else ""),
+                file=sys.stderr,
+            )
+            return False
+        return True
     else:
-        logging.debug("recommend_driver(): using VDPAU logic")
-        return get_driver_from_vdpau_feat(devices), devices
+        print(
+            "Please copy and paste the following command%s to install the %s kernel module flavour:"
+            % ("s" if len(candidates) > 1 else "", "legacy" if driver == "closed" else "open")
+        )
+        for line in candidates:
+            print("  %s" % line)
+    return True
+
+
+def install_driver(driver, distro_id, version_id, branch_id=None, latest_branch=None, dry_run=False,
+                   report=None, stream=None, installed=None, check=None, root="/"):
+    """Install the driver and show EULA notice
+    
+    Args:
+        driver: "open" or "closed" driver type
+        distro_id: Distribution ID
+        version_id: Distribution version
+        branch_id: Specific driver branch (optional)
+        latest_branch: Already probed latest Ubuntu branch (optional)
+        dry_run: Only show the commands that would run
+        report: Optional list receiving the per-step reports (see run_install_plan())
+        stream: Text stream for the installation output (default: sys.stdout)
+        installed: InstalledDriver to skip the installation if already satisfied (optional)
+        check: Optional dict receiving the check_installed() result
+        root: Root directory of the target system (see get_install_instructions())
+        
+    Returns:
+        bool: Success status
+    """
+    print(
+        "Using the NVIDIA driver implies acceptance of the NVIDIA Software\n"
+        'License Agreement, contained in the "LICENSE" file in the\n'
+        '"/usr/share/nvidia-driver-assistant/driver_eula" directory\n',
+        file=stream if stream is not None else sys.stdout
+    )
+    return process_results(driver, distro_id, version_id, branch_id=branch_id, install=True,
+                           latest_branch=latest_branch, dry_run=dry_run, report=report, stream=stream,
+                           installed=installed, check=check, root=root)
+
+
+def print_profile(probe_report=None, steps=None, stream=None):
+    """Print the probe and installation step timings (for --profile)
+
+    Args:
+        probe_report: Session.probe_report
+        steps: run_install_plan() step reports
+        stream: Text stream (default: sys.stderr)
+    """
+    stream = stream if stream is not None else sys.stderr
+    print("Profile:", file=stream)
+    for name, entry in (probe_report or {}).items():
+        print("  %9.1f ms  probe %s (%s)" % (entry["elapsed_ms"], name, entry["status"]), file=stream)
+    for step in steps or ():
+        if "elapsed" in step:
+            print(
+                "  %9.1f ms  %s (exit status %d)" % (step["elapsed"] * 1000, step["command"], step["returncode"]),
+                file=stream
+            )
+
+
+def print_instructions(driver, distro_id, version_id, branch_id=None, latest_branch=None, root="/"):
+    """Print installation instructions without executing them
+    
+    Args:
+        driver: "open" or "closed" driver type
+        distro_id: Distribution ID
+        version_id: Distribution version
+        branch_id: Specific driver branch (optional)
+        latest_branch: Already probed latest Ubuntu branch (optional)
+        root: Root directory of the target system (see get_install_instructions())
+        
+    Returns:
+        bool: Success status
+    """
+    return process_results(driver, distro_id, version_id, branch_id=branch_id, install=False,
+                           latest_branch=latest_branch, root=root)
+
+
+def find_supported_gpus(root="/"):
+    """Locate the installed (or bundled) supported-gpus.json file
+
+    In each location the plain file is preferred over a compressed one.
+
+    Args:
+        root: Root directory of the target system, whose installed file is
+            preferred over the ones of the running system
+
+    Returns:
+        str: Path to supported-gpus.json, or None if neither location exists
+    """
+    locations = (install_json_path, default_json_path)
+    if os.path.abspath(root) != "/":
+        locations = (os.path.join(root, install_json_path.lstrip("/")),) + locations
+    for json_path in locations:
+        for suffix in ("",) + compressed_json_suffixes:
+            if os.path.isfile(json_path + suffix):
+                return json_path + suffix
+    return None
+
+
+def build_json_result(driver, devices, policy, branch=None):
+    """Build the decision document printed by --json
+
+    Args:
+        driver: "open" or "closed" driver type
+        devices: Dictionary of Device objects
+        policy: Policy the devices were evaluated with
+        branch: Requested driver branch (optional)
+
+    Returns:
+        dict: JSON serializable result
+    """
+    return {
+        "driver": "nvidia",
+        "module_flavor": driver,
+        "branch": branch,
+        "distro_legacy_override": policy.distro_legacy_override_branch,
+        "distro_non_legacy_default": policy.distro_non_legacy_default_branch,
+        "distro_580_legacy_override": policy.distro_580_legacy_override_branch,
+        "legacy_openkernel_restriction": policy.enable_legacy_openkernel_restriction,
+        "architecture_check_enabled": policy.enable_architecture_check,
+        "policy_fingerprint": policy.fingerprint(),
+        "devices": [dev.to_dict() for dev in devices.values()] if devices else []
+    }
+
+
+Recommendation = collections.namedtuple("Recommendation", ["driver", "devices", "notices", "fast_path", "hybrid"])
+Recommendation.__new__.__defaults__ = (False, None)
+
+
+ProbeResult = collections.namedtuple("ProbeResult", ["value", "status", "elapsed", "error"])
+
+
+class ProbeScheduler(object):
+    """Run the system probes as concurrent asyncio tasks under one deadline
+
+    Blocking probes run in daemon threads, so a read stuck in the kernel (a
+    slow sysfs attribute, a hanging apt cache lookup) can delay the result but never
+    the exit of the process. Coroutine probes run on the event loop and get
+    the scheduler as argument, to call blocking helpers with call() and to
+    wait for other probes with result().
+
+    When the deadline expires, the unfinished probes are cancelled: optional
+    ones fall back to their default value, required ones make run() raise.
+
+    Args:
+        deadline: Overall deadline in seconds (None waits for every probe)
+    """
+
+    def __init__(self, deadline=None):
+        super(ProbeScheduler, self).__init__()
+        self.deadline = deadline
+        self.probes = []
+        self._tasks = {}
+
+    def add(self, name, func, default=None, required=False):
+        """Schedule a probe
+
+        Args:
+            name: Probe name, used in the report
+            func: Blocking callable or coroutine function taking the scheduler
+            default: Value used if an optional probe fails or is late
+            required: Whether the result cannot be replaced by a default
+        """
+        self.probes.append((name, func, default, required))
+
+    async def call(self, func, *args):
+        """Run a blocking callable in a daemon thread and wait for its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def deliver(setter, value):
+            if not future.done():
+                setter(value)
+
+        def runner():
+            try:
+                value = func(*args)
+            except BaseException as e:
+                callback, value = future.set_exception, e
+            else:
+                callback = future.set_result
+            try:
+                loop.call_soon_threadsafe(deliver, callback, value)
+            except RuntimeError:
+                # The loop is gone: the probe missed the deadline
+                pass
+
+        threading.Thread(target=runner, name="probe-%s" % getattr(func, "__name__", "call"), daemon=True).start()
+        return await future
+
+    async def result(self, name):
+        """Wait for the value of another probe (raises if that probe failed)"""
+        return await asyncio.shield(self._tasks[name])
+
+    async def _run_probe(self, func, timings):
+        start = time.monotonic()
+        try:
+            if asyncio.iscoroutinefunction(func):
+                return await func(self)
+            return await self.call(func)
+        finally:
+            timings.append(time.monotonic() - start)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        timings = {}
+        for name, func, default, required in self.probes:
+            timings[name] = []
+            self._tasks[name] = loop.create_task(self._run_probe(func, timings[name]))
+
+        pending = ()
+        if self._tasks:
+            done, pending = await asyncio.wait(list(self._tasks.values()), timeout=self.deadline)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        elapsed = loop.time() - start
+
+        results = {}
+        for name, func, default, required in self.probes:
+            task = self._tasks[name]
+            probe_elapsed = timings[name][0] if timings[name] else elapsed
+            if task.cancelled():
+                results[name] = ProbeResult(default, "timeout", probe_elapsed, None)
+            elif task.exception() is not None:
+                results[name] = ProbeResult(default, "failed", probe_elapsed, str(task.exception()))
+            else:
+                results[name] = ProbeResult(task.result(), "ok", probe_elapsed, None)
+            logging.debug(
+                "ProbeScheduler.run(): %s: %s in %.1f ms"
+                % (name, results[name].status, results[name].elapsed * 1000)
+            )
+        return results
+
+    def run(self):
+        """Run every scheduled probe
+
+        Returns:
+            dict: ProbeResult keyed by probe name
+
+        Raises:
+            AssistantError: If a required probe failed or missed the deadline
+        """
+        results = asyncio.run(self._run())
+        for name, func, default, required in self.probes:
+            result = results[name]
+            if required and result.status != "ok":
+                if result.status == "timeout":
+                    raise AssistantError("the %s probe did not finish within %ss" % (name, self.deadline))
+                raise AssistantError("the %s probe failed: %s" % (name, result.error))
+        return results
+
+
+class Session(object):
+    """Reusable detection context for library users
+
+    A session loads the GPU database, probes the system profile (distribution
+    and laptop detection) and holds the policy once, so that repeated queries
+    do not pay for them again. None of its methods print or exit; failures are
+    raised as AssistantError.
+
+    The probes run lazily, one after the other, unless probe() is called
+    first to run them concurrently under a deadline.
+
+    Args:
+        supported_gpus: Path to supported-gpus.json (located with find_supported_gpus() if None),
+            or a list of it followed by overlay files merged in order
+        database_cache: Optional file holding the database merged with its overlays
+        index_cache: Optional file holding the name search index
+        sys_path: Optional alternative /sys path (for testing)
+        policy: Policy to evaluate the devices with (defaults to the module constants)
+        os_release_path: Optional alternative os-release file
+        distro: Optional "DISTRO:VERSION" or "DISTRO" override
+        simulate_gpu: Simulated GPU ID for testing
+        state_cache: Optional file holding the last result (see recommend_driver())
+        root: Root directory of the system to evaluate (see --root)
+        database: Already loaded database, e.g. a SharedGpuDatabase attached by a worker
+    """
+
+    def __init__(self, supported_gpus=None, sys_path=None, policy=None, os_release_path=None,
+                 distro=None, simulate_gpu=None, state_cache=None, database_cache=None, index_cache=None,
+                 root="/", database=None):
+        super(Session, self).__init__()
+        self.root = root
+        self.supported_gpus = supported_gpus if supported_gpus else find_supported_gpus(root)
+        self.sys_path = sys_path
+        self.policy = policy if policy is not None else Policy.default()
+        if not os_release_path and os.path.abspath(root) != "/":
+            os_release_path = get_os_release_path(root)
+        self.os_release_path = os_release_path
+        self.distro = distro
+        self.simulate_gpu = simulate_gpu
+        self.state_cache = state_cache
+        self.database_cache = database_cache
+        self.index_cache = index_cache
+        self._database = database
+        self._name_index = None
+        self._branch_index = None
+        self._system_info = None
+        self._is_laptop = None
+        self._modaliases = None
+        self._duplicates = None
+        self._pci_infos = None
+        self._probed_state = None
+        self._deadline_end = None
+        self.latest_branch = None
+        self.probe_report = None
+
+    @property
+    def database(self):
+        """Loaded GPU database (see load_gpu_database())"""
+        if self._database is None:
+            self._database = load_gpu_database(self.supported_gpus, self.database_cache)
+        return self._database
+
+    @property
+    def name_index(self):
+        """Name search index of the database (see load_name_index())"""
+        if self._name_index is None:
+            self._name_index = load_name_index(self.database, self.index_cache)
+        return self._name_index
+
+    @property
+    def branch_index(self):
+        """Branch and architecture index of the database (see BranchIndex)"""
+        if self._branch_index is None:
+            self._branch_index = BranchIndex(self.database)
+        return self._branch_index
+
+    def select_chips(self, legacy_major=None, dropped_at=None, architecture=None):
+        """Select database chips by legacy branch, dropped support or architecture
+
+        See BranchIndex.select(); the session's policy provides the minimum drivers.
+        """
+        return self.branch_index.select(legacy_major, dropped_at, architecture, self.policy)
+
+    def compatibility_matrix(self, branches=None):
+        """Evaluate driver branches against every database chip
+
+        See build_compatibility_matrix(); the session's policy provides the minimum drivers.
+        """
+        return build_compatibility_matrix(self.branch_index, self.policy, branches)
+
+    def lint(self):
+        """Check the database for contradictory or unusable entries
+
+        See lint_gpu_database(); the session's policy provides the minimum drivers.
+        """
+        return lint_gpu_database(self.database, self.policy)
+
+    def search(self, query, limit=10):
+        """Look up chips by name and evaluate them without the hardware
+
+        Returns:
+            list: describe_chip() results with a "score", best match first
+        """
+        results = []
+        for chip, score in self.name_index.search(query, limit):
+            result = describe_chip(chip, self.policy)
+            result["score"] = score
+            results.append(result)
+        return results
+
+    @property
+    def system_info(self):
+        """Detected or overridden distribution, None if unsupported"""
+        if self._system_info is None:
+            if self.distro:
+                system_info = override_distro(self.distro.lower())
+            else:
+                system_info = get_distro(self.os_release_path)
+            self._system_info = system_info or False
+        return self._system_info or None
+
+    @property
+    def is_laptop(self):
+        """Whether the system is a laptop (probed once per session, when first needed)
+
+        Only a device ID with several database entries and the render
+        offload recommendation of a hybrid system depend on it.
+        is_laptop_system() checks the DMI chassis and the battery before
+        it falls back to dmidecode, which gets no more than what is left of
+        the probe() deadline.
+        """
+        if self._is_laptop is None:
+            timeout = 2
+            if self._deadline_end is not None:
+                timeout = min(timeout, self._deadline_end - time.monotonic())
+            self._is_laptop = is_laptop_system(timeout)
+        return self._is_laptop
+
+    def probe(self, deadline=None, distro=True, packages=False, use_driver_hints=True):
+        """Run the system probes concurrently under an overall deadline
+
+        The sysfs walk and the per-device sysfs reads, the distribution
+        detection and, with ``packages``, the apt cache lookup run as
+        concurrent tasks (see ProbeScheduler). Late or failed optional probes
+        fall back to their defaults; detect(), recommend() and instructions()
+        then use the probed values. The outcome of every probe is kept in
+        ``probe_report``.
+
+        The laptop check is not one of them: only a multiple match or a
+        hybrid system needs it, so it runs on demand (see is_laptop), within
+        what is left of the deadline.
+
+        Args:
+            deadline: Overall deadline in seconds (None waits for every probe)
+            distro: Whether to detect the distribution
+            packages: Whether to look up the latest driver branch in the apt cache (Ubuntu only)
+            use_driver_hints: Decision mode to check the state cache for
+
+        Returns:
+            dict: ProbeResult keyed by probe name
+
+        Raises:
+            AssistantError: If the sysfs walk failed or missed the deadline
+        """
+        scheduler = ProbeScheduler(deadline)
+        self._deadline_end = time.monotonic() + deadline if deadline is not None else None
+
+        if not self.simulate_gpu:
+            async def probe_sysfs(scheduler):
+                if self.state_cache:
+                    stamp = await scheduler.call(
+                        get_detection_stamp, self.sys_path, self.supported_gpus, self.policy, use_driver_hints
+                    )
+                    integrated = []
+                    cached = await scheduler.call(
+                        load_detection_state, self.state_cache, stamp, self.policy, integrated, self.sys_path
+                    )
+                    self._probed_state = (use_driver_hints, stamp, cached, integrated)
+                    if cached:
+                        # recommend() takes the fast path, no need to walk /sys
+                        return None
+                self._duplicates = {}
+                return await scheduler.call(get_system_modaliases, self.sys_path, self._duplicates)
+
+            async def probe_pci_info(scheduler):
+                modaliases = await scheduler.result("sysfs")
+                if not modaliases:
+                    return {}
+                paths = []
+                for alias, details in parse_pci_modaliases(modaliases):
+                    if details.base_class == "03":
+                        paths.append(modaliases[alias])
+                        paths.extend(self._duplicates.get(alias, []))
+                infos = await asyncio.gather(*[scheduler.call(get_pci_device_info, path) for path in paths])
+                return dict(zip(paths, infos))
+
+            scheduler.add("sysfs", probe_sysfs, required=True)
+            # Without the sysfs attributes the devices are matched by their modalias
+            # only; get_nvidia_devices() does not read the missing ones again
+            scheduler.add("pci_info", probe_pci_info, default={})
+
+        distro_scheduled = distro and self._system_info is None
+        if distro_scheduled:
+            def probe_distro():
+                return self.system_info
+            scheduler.add("distro", probe_distro, default=None)
+
+        if packages:
+            async def probe_apt_cache(scheduler):
+                system_info = (await scheduler.result("distro")) if distro_scheduled else self.system_info
+                if not system_info or system_info.id != "ubuntu":
+                    return None
+                return await scheduler.call(ubuntu_get_latest_driver_branch, self.root)
+            scheduler.add("apt_cache", probe_apt_cache, default=None)
+
+        results = scheduler.run()
+
+        if "sysfs" in results:
+            self._modaliases = results["sysfs"].value
+            self._pci_infos = results["pci_info"].value
+        if distro_scheduled and results["distro"].status != "ok":
+            self._system_info = False
+        if "apt_cache" in results:
+            self.latest_branch = results["apt_cache"].value
+
+        self.probe_report = {}
+        for name, result in results.items():
+            entry = {"status": result.status, "elapsed_ms": round(result.elapsed * 1000, 1)}
+            if result.error:
+                entry["error"] = result.error
+            self.probe_report[name] = entry
+        return results
+
+    def detect(self, integrated=None):
+        """Detect and evaluate the NVIDIA devices
+
+        Args:
+            integrated: Optional list collecting the integrated GPUs (see get_integrated_gpus())
+
+        Returns:
+            tuple: (devices: dict, notices: list of multiple match notices)
+        """
+        if self.simulate_gpu and self.simulate_gpu not in simulated_gpus:
+            raise AssistantError("unknown simulated GPU: %s" % self.simulate_gpu)
+
+        # Probed values are used once, a later call detects again
+        modaliases, pci_infos, duplicates = self._modaliases, self._pci_infos, self._duplicates
+        self._modaliases = self._pci_infos = self._duplicates = None
+
+        notices = []
+        devices = get_nvidia_devices(
+            self.sys_path, self.supported_gpus, self.simulate_gpu,
+            policy=self.policy, database=self.database,
+            is_laptop=lambda: self.is_laptop, notices=notices,
+            modaliases=modaliases, pci_infos=pci_infos, duplicates=duplicates,
+            integrated=integrated
+        )
+        return devices, notices
+
+    def recommend(self, use_driver_hints=True, hybrid=True):
+        """Recommend a kernel module flavor for the detected devices
+
+        If the session has a state cache and the PCI topology, database and
+        policy are unchanged since it was written, the stored result is
+        returned without matching the database again (``fast_path`` is then
+        True); only the live sysfs details of the devices are read again.
+
+        On a laptop with an integrated GPU, ``hybrid`` holds the render
+        offload setup (see recommend_prime_offload()).
+
+        Args:
+            use_driver_hints: Whether to use JSON hints (True) or VDPAU logic (False)
+            hybrid: Whether to work out the render offload setup, which may
+                have to probe the system type (``hybrid`` is None otherwise)
+
+        Returns:
+            Recommendation: driver is None if no NVIDIA device was found
+        """
+        stamp = cached = None
+        integrated = []
+        probed, self._probed_state = self._probed_state, None
+        if probed is not None and probed[0] == use_driver_hints:
+            stamp, cached, integrated = probed[1:]
+        elif self.state_cache and not self.simulate_gpu:
+            stamp = get_detection_stamp(self.sys_path, self.supported_gpus, self.policy, use_driver_hints)
+            cached = load_detection_state(self.state_cache, stamp, self.policy, integrated, self.sys_path)
+        if cached:
+            logging.debug("Session.recommend(): hardware unchanged, using %s" % self.state_cache)
+            driver, devices = cached
+            return Recommendation(driver, devices, [], True, self._prime_offload(devices, integrated, hybrid))
+
+        integrated = []
+        devices, notices = self.detect(integrated)
+        if not devices:
+            return Recommendation(None, devices, notices)
+        driver = decide_driver(devices, use_driver_hints, self.policy)
+        if driver:
+            save_detection_state(self.state_cache, stamp, driver, devices, integrated)
+        return Recommendation(driver, devices, notices, False, self._prime_offload(devices, integrated, hybrid))
+
+    def _published_stamp(self):
+        """Stamp a published result must match, None if it must not be used
+
+        Simulated GPUs, other sysfs trees and other roots never match what
+        was published for the running system.
+        """
+        if self.simulate_gpu or self.sys_path or os.path.abspath(self.root) != "/":
+            return None
+        return get_detection_stamp(None, self.supported_gpus, self.policy)
+
+    def publish(self, result, devices, directory=default_publish_directory):
+        """Publish a recommendation for the other tools of this boot
+
+        Args:
+            result: to_json() document of the recommendation
+            devices: Its evaluated devices
+
+        Raises:
+            OSError: If a file cannot be written
+        """
+        publish_result(result, devices, directory, self._published_stamp())
+
+    def load_published(self, directory=default_publish_directory):
+        """Get the recommendation published with --publish during this boot
+
+        Only a result published with the same policy, database files and PCI
+        topology is used, and never for simulated GPUs, another sysfs tree or
+        another root.
+
+        Returns:
+            Recommendation: The published one (``fast_path`` True), None if
+            there is none; detection is then up to the caller
+        """
+        published = load_published_result(directory, self.policy, self.sys_path, self._published_stamp())
+        if published is None:
+            return None
+        result, devices = published
+        return Recommendation(result["module_flavor"], devices, [], True, result.get("hybrid"))
 
+    def _prime_offload(self, devices, integrated, wanted=True):
+        """recommend_prime_offload() probing the system type only for hybrid systems"""
+        if not wanted or not integrated:
+            return None
+        return recommend_prime_offload(devices, integrated, lambda: self.is_laptop)
 
-def get_conditional_instructions(distro_id, version_id, instructions_dict):
-    """Instructions may depend on the specific distro release
-    
-    Args:
-        distro_id: Distribution ID (e.g., "rhel")
-        version_id: Distribution version (e.g., "7", "10")
-        instructions_dict: Dictionary of version-specific instructions
-        
-    Returns:
-        list: Installation instructions for the specific version
-    """
-    if not isinstance(instructions_dict, dict):
-        return instructions_dict
-    
-    versions = []
-    for cond in instructions_dict.keys():
-        from_ver = float(cond)
-        if float(version_id) >= from_ver:
-            versions.append(from_ver)
-    if versions:
-        return instructions_dict.get(max(versions))
-    return list(instructions_dict.values())[0] if instructions_dict else None
+    def topology(self):
+        """Group the detected GPUs by NUMA node and shared upstream switch
 
+        Returns:
+            list: See build_gpu_topology()
+        """
+        devices, _ = self.detect()
+        return build_gpu_topology(devices or {})
 
-def process_results(driver, distro_id, version_id, branch_id=None, install=False):
-    """Process and display/execute installation instructions
-    
-    Args:
-        driver: "open" or "closed" driver type
-        distro_id: Distribution ID
-        version_id: Distribution version
-        branch_id: Specific driver branch (optional)
-        install: Whether to install (True) or just show instructions (False)
-        
-    Returns:
-        bool: Success status
-    """
-    if branch_id:
-        candidates = branch_instructions.get("%s-%s" % (distro_id, driver))
-    else:
-        candidates = instructions.get("%s-%s" % (distro_id, driver))
+    def module_options(self, driver, devices, root=None, hybrid=None):
+        """Compare the recommended module options with the local configuration
 
-    if not candidates:
-        print(
-            "Error: could not find the instructions for %s-%s" % (distro_id, driver),
-            file=sys.stderr,
-        )
-        return False
+        Args:
+            root: Root directory of the configuration (defaults to the session's)
 
-    try:
-        if isinstance(candidates, dict):
-            candidates = get_conditional_instructions(distro_id, version_id, candidates)
-    except AttributeError:
-        pass
+        Returns:
+            dict: See advise_module_options()
+        """
+        return advise_module_options(driver, devices, root if root else self.root, self.sys_path, hybrid)
 
-    if distro_id == "ubuntu" and not branch_id:
-        latest_branch = ubuntu_get_latest_driver_branch()
-        if latest_branch:
-            branch_id = latest_branch
-        else:
-            print("Error: failed to get the latest driver branch", file=sys.stderr)
-            return False
+    def watch(self, interval=1.0, use_driver_hints=True):
+        """Follow PCI hotplug events and re-evaluate only the affected function
 
-    if distro_id == "manjaro":
-        kernel_package = manjaro_get_kernel_package()
-        if kernel_package:
-            candidates = [line.replace("KERNEL", kernel_package) for line in candidates]
+        Yields a "snapshot" event with the initial inventory, then an "add" or
+        "remove" event for every NVIDIA display function that appears or
+        disappears, and a "change" event with the updated physical function
+        when one of its SR-IOV virtual functions does (the "virtual_function"
+        entry names the VF and its action). Every event carries the
+        resulting module flavor and whether it changed.
 
-    if branch_id:
-        branch_id_str = str(branch_id)
-        it = 0
-        for line in candidates:
-            candidates[it] = line.replace("BRANCH", branch_id_str)
-            it += 1
+        Args:
+            interval: Polling interval in seconds when uevents are unavailable
+            use_driver_hints: Whether to use JSON hints (True) or VDPAU logic (False)
 
-    if install:
-        print(
-            "Installing the following package%s for the %s kernel module flavour:"
-            % ("s" if len(candidates) > 1 else "", "legacy" if driver == "closed" else "open")
-        )
-        status = -1
-        for line in candidates:
-            print("  %s\n" % line)
-            status = os.system(line)
-            if status != 0:
-                print(
-                    "\nError: failed to execute the following command:\n  %s" % line,
-                    file=sys.stderr,
-                )
-                break
-        return status == 0
-    else:
-        print(
-            "Please copy and paste the following command%s to install the %s kernel module flavour:"
-            % ("s" if len(candidates) > 1 else "", "legacy" if driver == "closed" else "open")
-        )
-        for line in candidates:
-            print("  %s" % line)
-    return True
+        Yields:
+            dict: JSON serializable event
+        """
+        inventory = PciInventory(self.database, self.policy, self.sys_path, lambda: self.is_laptop, use_driver_hints)
+        inventory.scan()
+        driver = inventory.recommend()
+        yield {
+            "event": "snapshot",
+            "timestamp": time.time(),
+            "module_flavor": driver,
+            "devices": [dict(dev.to_dict(), slot=slot) for slot, dev in sorted(inventory.devices.items())],
+        }
 
+        for action, slot in watch_pci_events(self.sys_path, interval):
+            if action == "add":
+                change = inventory.add(slot)
+            else:
+                change = inventory.remove(slot)
+            if change is None:
+                continue
+            previous, driver = driver, inventory.recommend()
+            event = {
+                "event": change.kind,
+                "timestamp": time.time(),
+                "slot": change.slot,
+                "device": change.device.to_dict(),
+                "module_flavor": driver,
+                "changed": driver != previous,
+            }
+            if change.slot != slot:
+                event["virtual_function"] = {"action": action, "slot": slot}
+            yield event
 
-def install_driver(driver, distro_id, version_id, branch_id=None):
-    """Install the driver and show EULA notice
-    
-    Args:
-        driver: "open" or "closed" driver type
-        distro_id: Distribution ID
-        version_id: Distribution version
-        branch_id: Specific driver branch (optional)
-        
-    Returns:
-        bool: Success status
-    """
-    print(
-        "Using the NVIDIA driver implies acceptance of the NVIDIA Software\n"
-        'License Agreement, contained in the "LICENSE" file in the\n'
-        '"/usr/share/nvidia-driver-assistant/driver_eula" directory\n'
-    )
-    return process_results(driver, distro_id, version_id, branch_id=branch_id, install=True)
+    def instructions(self, driver, branch=None, devices=None):
+        """Resolve the installation commands for the session's distribution
 
+        Args:
+            driver: "open" or "closed" driver type
+            branch: Specific driver branch (optional)
+            devices: Detected devices, used to pick the legacy branch on Manjaro
 
-def print_instructions(driver, distro_id, version_id, branch_id=None):
-    """Print installation instructions without executing them
-    
-    Args:
-        driver: "open" or "closed" driver type
-        distro_id: Distribution ID
-        version_id: Distribution version
-        branch_id: Specific driver branch (optional)
-        
-    Returns:
-        bool: Success status
-    """
-    return process_results(driver, distro_id, version_id, branch_id=branch_id, install=False)
+        Returns:
+            list: Installation commands
+        """
+        system_info = self.system_info
+        if not system_info:
+            raise AssistantError("unsupported Linux distribution")
+        if not branch and system_info.id == "manjaro" and devices:
+            branch = manjaro_get_legacy_branch(devices)
+        return get_install_instructions(
+            driver, system_info.id, system_info.version_id, branch, self.latest_branch, self.root
+        )
+
+    def to_json(self, recommendation, branch=None):
+        """Get the --json decision document for a recommendation"""
+        result = build_json_result(recommendation.driver, recommendation.devices, self.policy, branch)
+        result["fast_path"] = recommendation.fast_path
+        result["hybrid"] = recommendation.hybrid
+        if self.probe_report is not None:
+            result["probes"] = self.probe_report
+        return result
 
 
 def main():
@@ -1700,6 +5793,38 @@ def main():
         help="Install the recommended driver",
         default=False,
     )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Show the commands --install would run, without running them",
+        default=False,
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Install even if the recommended driver is already installed",
+        default=False,
+    )
+    parser.add_argument(
+        "--installed-root",
+        nargs="?",
+        type=str,
+        help="Use a different root for the installed driver state (/proc, package databases, modprobe.d). "
+        "Useful for testing",
+    )
+    parser.add_argument(
+        "--module-options",
+        action="store_true",
+        help="Compare the recommended kernel module options with modprobe.d, the kernel command line and "
+        "the loaded modules",
+        default=False,
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print the time taken by every probe and installation step to stderr",
+        default=False,
+    )
     parser.add_argument(
         "--branch",
         nargs="?",
@@ -1714,9 +5839,29 @@ def main():
     )
     parser.add_argument(
         "--supported-gpus",
+        nargs="+",
+        type=str,
+        metavar=("BASE", "OVERLAY"),
+        help="Use a different supported-gpus.json file, optionally followed by overlay files merged in order",
+    )
+    parser.add_argument(
+        "--policy",
+        nargs="?",
+        type=str,
+        help="Load the driver selection policy from a JSON file instead of the built-in defaults",
+    )
+    parser.add_argument(
+        "--state-cache",
         nargs="?",
         type=str,
-        help="Use a different supported-gpus.json file",
+        default=default_state_cache_path,
+        help="File holding the last detection result, reused while the hardware is unchanged (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-state-cache",
+        action="store_true",
+        help="Always run the full detection (and database merge) and do not store its result",
+        default=False,
     )
     parser.add_argument(
         "--sys-path",
@@ -1724,6 +5869,13 @@ def main():
         type=str,
         help="Use a different /sys path. Useful for testing",
     )
+    parser.add_argument(
+        "--root",
+        metavar="DIR",
+        help="Evaluate the system installed in DIR (a chroot or unpacked image): its os-release, package "
+        "databases, kernel and configuration are used, the hardware is still read from --sys-path. "
+        "Disables the caches",
+    )
     parser.add_argument(
         "--os-release-path",
         nargs="?",
@@ -1755,6 +5907,106 @@ def main():
         help='Signal mhwd to use "open" or "closed" driver',
         default=False,
     )
+    parser.add_argument(
+        "--search",
+        type=str,
+        metavar="NAME",
+        help='Look up GPUs by name (e.g. "GTX 1660 SUPER") and show what would be recommended for them',
+    )
+    parser.add_argument(
+        "--search-limit",
+        type=int,
+        default=10,
+        help="Maximum number of --search results (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--legacy-branch",
+        type=int,
+        metavar="MAJOR",
+        help="List the GPUs whose legacy branch is MAJOR (e.g. 470)",
+    )
+    parser.add_argument(
+        "--dropped-at",
+        type=int,
+        metavar="BRANCH",
+        help="List the GPUs that are not supported by BRANCH or newer",
+    )
+    parser.add_argument(
+        "--architecture",
+        type=str,
+        help="Restrict --legacy-branch/--dropped-at to one architecture",
+    )
+    parser.add_argument(
+        "--export-matrix",
+        type=str,
+        metavar="FILE",
+        help='Write the driver branch x GPU compatibility matrix to FILE (.csv or .json, "-" for stdout)',
+    )
+    parser.add_argument(
+        "--matrix-branches",
+        type=str,
+        metavar="BRANCHES",
+        help="Comma separated branches for --export-matrix (default: every branch the database and policy refer to)",
+    )
+    parser.add_argument(
+        "--lint",
+        action="store_true",
+        help="Check the database for duplicate, ambiguous or contradictory entries "
+        "(exits with 1 if there are errors)",
+        default=False,
+    )
+    parser.add_argument(
+        "--render-instructions",
+        type=str,
+        metavar="FILE",
+        help='Write the installation commands of every supported distribution, version and flavor as JSON to FILE ("-" for stdout)',
+    )
+    parser.add_argument(
+        "--render-branches",
+        type=str,
+        metavar="BRANCHES",
+        help="Comma separated branches also rendered by --render-instructions",
+    )
+    parser.add_argument(
+        "--topology",
+        action="store_true",
+        help="Print the detected GPUs grouped by NUMA node and shared PCIe switch, with their local CPUs",
+        default=False,
+    )
+    parser.add_argument(
+        "--publish",
+        nargs="?",
+        const=default_publish_directory,
+        metavar="DIR",
+        help="Detect once and write the --json result and the module flavor to DIR "
+        "(default: %s), e.g. from a systemd unit at boot" % default_publish_directory,
+    )
+    parser.add_argument(
+        "--from-state",
+        nargs="?",
+        const=default_publish_directory,
+        metavar="DIR",
+        help="Use the result published with --publish during this boot instead of detecting again "
+        "(detects if there is none)",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Follow PCI hotplug events and print a JSON event per line",
+        default=False,
+    )
+    parser.add_argument(
+        "--watch-interval",
+        type=float,
+        default=1.0,
+        help="Polling interval in seconds for --watch when kernel uevents are unavailable (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        help="Run the system probes concurrently and give up on the optional ones after SECONDS",
+        metavar="SECONDS",
+    )
     parser.add_argument(
         "--verbose", action="store_true", help="[OPTIONAL] Verbose output", default=False
     )
@@ -1766,18 +6018,27 @@ def main():
     )
     args = parser.parse_args()
 
-    needs_install = args.install
+    needs_install = args.install or args.dry_run
     branch_locked = args.branch
     supported_gpus = args.supported_gpus
     sys_path = args.sys_path
     os_release_path = args.os_release_path
+    root = args.root if args.root else "/"
     distro_override = args.distro
     module_override = args.module_flavor
     print_supported_distros = args.list_supported_distros
     mhwd = args.mhwd
     simulate_gpu = args.simulate_gpu
     json_output = args.json
-    system_info = None
+
+    if args.policy:
+        try:
+            policy = Policy.from_file(args.policy)
+        except ValueError as e:
+            print("Error: %s" % e, file=sys.stderr)
+            exit(1)
+    else:
+        policy = Policy.default()
 
     if print_supported_distros:
         print("The following are the currently accepted distribution aliases:")
@@ -1785,11 +6046,28 @@ def main():
             print("  %s" % distro)
         exit(0)
 
-    if not supported_gpus:
-        if os.path.isfile(install_json_path):
-            supported_gpus = install_json_path
-        elif os.path.isfile(default_json_path):
-            supported_gpus = default_json_path
+    if args.render_instructions:
+        branches = []
+        if args.render_branches:
+            branches = [branch.strip() for branch in args.render_branches.split(",") if branch.strip()]
+            if not all(branch.isdigit() for branch in branches):
+                print("Error: %s is not a list of branches" % args.render_branches, file=sys.stderr)
+                exit(1)
+        try:
+            matrix = render_instruction_matrix(branches=branches, kernel_package=manjaro_get_kernel_package(root))
+            rendered = json.dumps(matrix, indent=2)
+            if args.render_instructions == "-":
+                print(rendered)
+            else:
+                write_file_atomic(args.render_instructions, rendered + "\n")
+        except (AssistantError, OSError) as e:
+            print("Error: %s" % e, file=sys.stderr)
+            exit(1)
+        exit(0)
+
+    if args.root and args.install and not args.dry_run:
+        print("Error: --install cannot install into --root, use --dry-run for the install plan", file=sys.stderr)
+        exit(1)
 
     if branch_locked:
         try:
@@ -1805,14 +6083,154 @@ def main():
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
 
+    installed_root = args.installed_root if args.installed_root else root
+    use_caches = not args.no_state_cache and not args.root
+
     # Determine if we should suppress warnings (for MHWD or JSON output)
-    suppress_warnings = mhwd or json_output
-    
-    driver, devices = recommend_driver(
-        sys_path=sys_path, supported_gpus=supported_gpus, 
-        use_driver_hints=True, simulate_gpu=simulate_gpu, 
-        mhwd=mhwd, suppress_warnings=suppress_warnings
+    suppress_warnings = mhwd or json_output or args.publish
+
+    session = Session(
+        supported_gpus=supported_gpus, sys_path=sys_path, policy=policy,
+        os_release_path=os_release_path, distro=distro_override, simulate_gpu=simulate_gpu,
+        state_cache=args.state_cache if use_caches else None,
+        database_cache=default_merged_database_path if use_caches else None,
+        index_cache=default_name_index_path if use_caches else None,
+        root=root
     )
+
+    if args.search:
+        try:
+            results = session.search(args.search, args.search_limit)
+        except AssistantError as e:
+            print("Error: %s" % e, file=sys.stderr)
+            exit(1)
+        if json_output:
+            print(json.dumps(results, indent=2))
+        else:
+            print_search_results(args.search, results)
+        exit(0 if results else 1)
+
+    if args.export_matrix:
+        branches = None
+        if args.matrix_branches:
+            try:
+                branches = [int(branch) for branch in args.matrix_branches.split(",") if branch.strip()]
+            except ValueError:
+                print("Error: %s is not a list of branches" % args.matrix_branches, file=sys.stderr)
+                exit(1)
+        if args.export_matrix == "-":
+            output_format = "json" if json_output else "csv"
+        else:
+            output_format = "json" if args.export_matrix.endswith(".json") else "csv"
+        try:
+            matrix = session.compatibility_matrix(branches)
+            if args.export_matrix == "-":
+                write_compatibility_matrix(matrix, sys.stdout, output_format)
+            else:
+                with open(args.export_matrix, "w", newline="") as stream:
+                    write_compatibility_matrix(matrix, stream, output_format)
+        except (AssistantError, OSError) as e:
+            print("Error: %s" % e, file=sys.stderr)
+            exit(1)
+        exit(0)
+
+    if args.lint:
+        try:
+            issues = session.lint()
+        except AssistantError as e:
+            print("Error: %s" % e, file=sys.stderr)
+            exit(1)
+        if json_output:
+            print(json.dumps([issue._asdict() for issue in issues], indent=2))
+        else:
+            print_lint_report(issues, len(session.database))
+        exit(1 if any(issue.severity == "error" for issue in issues) else 0)
+
+    if args.legacy_branch is not None or args.dropped_at is not None:
+        try:
+            chips = session.select_chips(args.legacy_branch, args.dropped_at, args.architecture)
+        except AssistantError as e:
+            print("Error: %s" % e, file=sys.stderr)
+            exit(1)
+        if json_output:
+            print(json.dumps(chips, indent=2))
+        else:
+            conditions = []
+            if args.legacy_branch is not None:
+                conditions.append("on the %d.xx legacy branch" % args.legacy_branch)
+            if args.dropped_at is not None:
+                conditions.append("dropped at %d.xx" % args.dropped_at)
+            if args.architecture:
+                conditions.append("of the %s architecture" % args.architecture.lower())
+            print_chip_selection(" and ".join(conditions), chips)
+        exit(0)
+
+    if args.topology:
+        try:
+            topology = session.topology()
+        except AssistantError as e:
+            print("Error: %s" % e, file=sys.stderr)
+            exit(1)
+        if json_output:
+            print(json.dumps(topology, indent=2))
+        else:
+            print_gpu_topology(topology)
+        exit(0 if topology else 1)
+
+    if args.watch:
+        try:
+            for event in session.watch(args.watch_interval):
+                print(json.dumps(event), flush=True)
+        except AssistantError as e:
+            print("Error: %s" % e, file=sys.stderr)
+            exit(1)
+        except KeyboardInterrupt:
+            pass
+        exit(0)
+
+    recommendation = None
+    if args.from_state and not args.publish:
+        recommendation = session.load_published(args.from_state)
+
+    if recommendation is None:
+        try:
+            session.probe(
+                args.deadline, distro=not suppress_warnings,
+                packages=not suppress_warnings and not branch_locked
+            )
+        except AssistantError as e:
+            print("Error: %s" % e, file=sys.stderr)
+            exit(1)
+
+        try:
+            # --mhwd only prints the flavor, the render offload setup is not needed
+            recommendation = session.recommend(use_driver_hints=True, hybrid=bool(args.publish) or not mhwd)
+        except AssistantError as e:
+            logging.error("%s" % e)
+            print("Error: Failed to find a suitable driver", file=sys.stderr)
+            exit(1)
+
+    if args.publish:
+        result = session.to_json(recommendation, branch_locked)
+        try:
+            session.publish(result, recommendation.devices, args.publish)
+        except OSError as e:
+            print("Error: cannot publish to %s: %s" % (args.publish, e), file=sys.stderr)
+            exit(1)
+        if json_output:
+            print(json.dumps(result, indent=2))
+        # Systems without an NVIDIA GPU are not a failure of the boot unit
+        exit(0)
+
+    if not suppress_warnings:
+        for notice in recommendation.notices:
+            show_multiple_match_warning(notice["device_id"], notice["selected"], notice["candidates"])
+        print_pretty_gpu_summary(recommendation.devices)
+        if recommendation.hybrid:
+            print_prime_offload(recommendation.hybrid)
+
+    driver = recommendation.driver
+    devices = recommendation.devices
     
     if not driver:
         print("Error: Failed to find a suitable driver", file=sys.stderr)
@@ -1823,37 +6241,13 @@ def main():
         print(driver)
         exit(0)
 
-    if json_output:
-        device_list = []
-        for dev in devices.values() if devices else []:
-            # Get supported range for this device
-            min_driver, max_driver = dev._get_supported_range(legacy_override=False)
-            device_info = {
-                "pci_id": dev.id,
-                "name": dev.name,
-                "architecture": dev.architecture,
-                "is_laptop": dev.is_laptop_gpu,
-                "is_legacy": bool(dev.legacy_branch),
-                "subsystem_vendor": dev.subvendorid,
-                "subsystem_device": dev.subdevid,
-                "supported_min_driver": min_driver,
-                "supported_max_driver": max_driver,
-                "legacy": dev.legacy_branch if dev.legacy_branch else None
-            }
-            device_list.append(device_info)
-        
-        result = {
-            "driver": "nvidia",
-            "module_flavor": driver,
-            "branch": branch_locked,
-            "distro_legacy_override": DISTRO_LEGACY_OVERRIDE_BRANCH,
-            "distro_non_legacy_default": DISTRO_NON_LEGACY_DEFAULT_BRANCH,
-            "distro_580_legacy_override": DISTRO_580_LEGACY_OVERRIDE_BRANCH,
-            "legacy_openkernel_restriction": ENABLE_LEGACY_OPENKERNEL_RESTRICTION,
-            "architecture_check_enabled": ENABLE_ARCHITECTURE_CHECK,
-            "devices": device_list
-        }
+    if json_output and not needs_install:
+        result = session.to_json(recommendation, branch_locked)
+        if args.module_options:
+            result["module_options"] = session.module_options(driver, devices, installed_root, recommendation.hybrid)
         print(json.dumps(result, indent=2))
+        if args.profile:
+            print_profile(session.probe_report)
         exit(0)
 
     if module_override:
@@ -1865,28 +6259,48 @@ def main():
             )
             exit(1)
 
-    if distro_override:
-        system_info = override_distro(distro_override.lower())
-        print("Detected system:\n  %s %s\n" % (system_info.id, system_info.version_id))
-    else:
-        system_info = get_distro(os_release_path)
-
+    system_info = session.system_info
     if not system_info:
         print("Error: unsupported Linux distribution", file=sys.stderr)
         exit(1)
+    if not json_output:
+        print_detected_system(system_info)
     logging.debug("OS detected: %s" % system_info.id)
     
     if not branch_locked and system_info.id == "manjaro" and devices:
         branch_locked = manjaro_get_legacy_branch(devices)
 
     if needs_install:
-        install_driver(driver, system_info.id, system_info.version_id, branch_locked)
+        installed = None
+        if not args.force:
+            installed = get_installed_driver(sys_path, installed_root)
+        # Keep stdout for the JSON document
+        steps = []
+        check = {}
+        success = install_driver(
+            driver, system_info.id, system_info.version_id, branch_locked, session.latest_branch,
+            dry_run=args.dry_run, report=steps, stream=sys.stderr if json_output else sys.stdout,
+            installed=installed, check=check, root=root
+        )
+        if json_output:
+            result = session.to_json(recommendation, branch_locked)
+            result["install"] = {"dry_run": args.dry_run, "success": success, "steps": steps}
+            if check:
+                result["install"]["already_installed"] = check
+            if args.module_options:
+                result["module_options"] = session.module_options(driver, devices, installed_root, recommendation.hybrid)
+            print(json.dumps(result, indent=2))
+        if args.profile:
+            print_profile(session.probe_report, steps)
     else:
-        exit(
-            0
-            if print_instructions(driver, system_info.id, system_info.version_id, branch_locked)
-            else 1
+        success = print_instructions(
+            driver, system_info.id, system_info.version_id, branch_locked, session.latest_branch, root
         )
+        if args.profile:
+            print_profile(session.probe_report)
+    if args.module_options and not json_output:
+        print_module_advice(session.module_options(driver, devices, installed_root, recommendation.hybrid))
+    exit(0 if success else 1)
 
 
 if __name__ == "__main__":
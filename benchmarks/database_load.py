@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Compare the cold-cache load time of plain and compressed GPU databases
+
+The given supported-gpus.json is copied next to a gzip and an xz
+compressed version in a temporary directory. Before every run the pages of
+the file being loaded are dropped from the page cache with
+posix_fadvise(POSIX_FADV_DONTNEED), so each load has to read the file from
+the storage again, as the first detection after boot does.
+
+Usage:
+    python3 benchmarks/database_load.py /usr/share/nvidia-driver-assistant/supported-gpus/supported-gpus.json
+
+Use --directory to place the copies on the file system you want to measure
+(e.g. a network-backed root), as the default temporary directory is often
+a tmpfs where dropping the cache has no effect.
+"""
+
+# SPDX-License-Identifier: MIT
+
+import argparse
+import gzip
+import lzma
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import nvidia_driver_assistant as nda  # noqa: E402
+
+
+def drop_page_cache(path):
+    """Evict the cached pages of a file (best effort)"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fdatasync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def measure(path, runs, cold=True):
+    """Load a database several times
+
+    Returns:
+        list: Load times in seconds
+    """
+    timings = []
+    for _ in range(runs):
+        if cold:
+            drop_page_cache(path)
+        start = time.perf_counter()
+        nda.load_gpu_database(path)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("database", help="Plain supported-gpus.json to benchmark")
+    parser.add_argument("--runs", type=int, default=10, help="Loads per format (default: %(default)s)")
+    parser.add_argument("--directory", help="Where to write the copies (default: a temporary directory)")
+    parser.add_argument("--warm", action="store_true", help="Do not drop the page cache before each load")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="nda-bench-", dir=args.directory)
+    try:
+        plain = os.path.join(workdir, "supported-gpus.json")
+        shutil.copyfile(args.database, plain)
+        with open(plain, "rb") as src:
+            data = src.read()
+        with gzip.open(plain + ".gz", "wb", compresslevel=9) as dst:
+            dst.write(data)
+        with lzma.open(plain + ".xz", "wb", preset=9) as dst:
+            dst.write(data)
+
+        print("%-24s %10s %12s %12s" % ("file", "bytes", "median ms", "min ms"))
+        for path in (plain, plain + ".gz", plain + ".xz"):
+            timings = measure(path, args.runs, cold=not args.warm)
+            print(
+                "%-24s %10d %12.2f %12.2f"
+                % (os.path.basename(path), os.path.getsize(path),
+                   statistics.median(timings) * 1000, min(timings) * 1000)
+            )
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Importable entry point for the NVIDIA Driver Assistant
+
+The tool itself is shipped as a single executable script without a ``.py``
+suffix (``/usr/bin/nvidia-driver-assistant``, ``MOD-NDA.py`` in this
+repository), which cannot be imported with a plain ``import`` statement.
+This module loads that script once and replaces itself with it, so library
+users can simply write::
+
+    import nvidia_driver_assistant as nda
+
+    session = nda.Session(supported_gpus="/path/to/supported-gpus.json")
+    result = session.recommend()
+    print(result.driver, session.instructions(result.driver, devices=result.devices))
+
+The script is looked up in this order:
+
+1. the path in the ``NVIDIA_DRIVER_ASSISTANT_SCRIPT`` environment variable
+2. ``MOD-NDA.py`` next to this module
+3. ``/usr/bin/nvidia-driver-assistant``
+"""
+
+# SPDX-License-Identifier: MIT
+
+import importlib.machinery
+import importlib.util
+import os
+import sys
+
+_candidates = [
+    os.environ.get("NVIDIA_DRIVER_ASSISTANT_SCRIPT"),
+    os.path.join(os.path.dirname(os.path.realpath(__file__)), "MOD-NDA.py"),
+    "/usr/bin/nvidia-driver-assistant",
+]
+
+for _path in _candidates:
+    if _path and os.path.isfile(_path):
+        break
+else:
+    raise ImportError("cannot find the nvidia-driver-assistant script")
+
+_loader = importlib.machinery.SourceFileLoader(__name__, _path)
+_spec = importlib.util.spec_from_file_location(__name__, _path, loader=_loader)
+_module = importlib.util.module_from_spec(_spec)
+sys.modules[__name__] = _module
+_loader.exec_module(_module)
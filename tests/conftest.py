@@ -0,0 +1,45 @@
+import json
+import os
+import sys
+
+import pytest
+
+# Make nvidia_driver_assistant importable without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def fixtures():
+    """Directory of the sample root and /sys trees"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+# modalias of an NVIDIA GeForce RTX 4070 (10de:2783) on an ASUS board
+RTX_4070_MODALIAS = "pci:v000010DEd00002783sv00001043sd00008894bc03sc00i00"
+
+
+@pytest.fixture
+def add_pci_function():
+    """Create a PCI function in a sysfs tree and link it from bus/pci/devices"""
+    def add(sys_path, slot, parent="pci0000:00", files=None):
+        path = os.path.join(str(sys_path), "devices", parent, slot)
+        os.makedirs(path)
+        for name, value in (files or {}).items():
+            with open(os.path.join(path, name), "w") as f:
+                f.write(value + "\n")
+        devices = os.path.join(str(sys_path), "bus", "pci", "devices")
+        os.makedirs(devices, exist_ok=True)
+        os.symlink(os.path.relpath(path, devices), os.path.join(devices, slot))
+        return path
+    return add
+
+
+@pytest.fixture
+def supported_gpus(tmp_path):
+    """A supported-gpus.json with the RTX 4070"""
+    path = tmp_path / "supported-gpus.json"
+    path.write_text(json.dumps({"chips": [
+        {"devid": "0x2783", "name": "NVIDIA GeForce RTX 4070",
+         "features": ["VDPAUFeatureSetK", "kernelopen", "gsp_proprietary_supported"]},
+    ]}))
+    return str(path)
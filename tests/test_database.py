@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+import nvidia_driver_assistant as nda
+
+
+def write_chips(path, chips):
+    path.write_text(json.dumps({"chips": chips}))
+    return str(path)
+
+
+@pytest.fixture
+def base(tmp_path):
+    return write_chips(tmp_path / "supported-gpus.json", [
+        {"devid": "0x1F95", "name": "NVIDIA GeForce GTX 1650 Ti", "features": ["kernelopen"]},
+        {"devid": "0x1F95", "subvendorid": "0x1043", "subdevid": "0x1F12",
+         "name": "NVIDIA GeForce GTX 1650 Ti with Max-Q Design", "features": ["kernelopen"]},
+        {"devid": "0x2783", "name": "NVIDIA GeForce RTX 4070", "features": ["kernelopen"]},
+    ])
+
+
+def entries(database, devid):
+    return [chip.to_json() for chip in database.lookup(devid)]
+
+
+def test_overlay_update_keeps_indexed_devid(tmp_path, base):
+    overlay = write_chips(tmp_path / "overlay.json", [
+        {"devid": "0x1f95", "merge": "update", "legacybranch": "535.xx"},
+    ])
+    database = nda.load_gpu_database([base, overlay])
+    assert [chip["devid"] for chip in entries(database, "0x1F95")] == ["0x1F95", "0x1F95"]
+    assert [chip.get("legacybranch") for chip in entries(database, "0x1F95")] == ["535.xx", None]
+    assert "0x1f95" not in database
+
+
+def test_cached_merge_equals_fresh_merge(tmp_path, base):
+    overlay = write_chips(tmp_path / "overlay.json", [
+        {"devid": "0x1f95", "merge": "update", "legacybranch": "535.xx"},
+        {"devid": "0x1f95", "subvendorid": "1043", "subdevid": "1f12", "name": "ASUS OEM GTX 1650 Ti",
+         "features": ["kernelopen"]},
+        {"devid": "0x2783", "subvendorid": "1043", "subdevid": "8888", "name": "ASUS OEM RTX 4070",
+         "features": ["kernelopen"], "merge": "append"},
+    ])
+    cache = str(tmp_path / "merged.json")
+    fresh = nda.load_gpu_database([base, overlay], cache)
+    cached = nda.load_gpu_database([base, overlay], cache)
+    assert nda.load_merged_database(cache, [nda.get_file_stamp(path) for path in (base, overlay)]) is not None
+    assert [chip.to_json() for chip in cached] == [chip.to_json() for chip in fresh]
+    assert len(cached) == len(fresh) == 4
+    for devid in ("0x1F95", "0x2783"):
+        assert entries(cached, devid) == entries(fresh, devid)
+
+
+def test_overlay_override_keeps_entry_order(tmp_path, base):
+    overlay = write_chips(tmp_path / "overlay.json", [
+        {"devid": "0x1F95", "name": "NVIDIA GeForce GTX 1650 Ti (rev. 2)", "features": ["kernelopen"]},
+    ])
+    database = nda.load_gpu_database([base, overlay])
+    names = [chip.name for chip in database.lookup("0x1F95")]
+    assert names == ["NVIDIA GeForce GTX 1650 Ti (rev. 2)", "NVIDIA GeForce GTX 1650 Ti with Max-Q Design"]
@@ -0,0 +1,115 @@
+import os
+import stat
+import sys
+import time
+
+import pytest
+
+import nvidia_driver_assistant as nda
+
+
+def write_script(directory, name, body):
+    path = os.path.join(str(directory), name)
+    with open(path, "w") as f:
+        f.write("#!/bin/sh\n" + body)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+
+@pytest.fixture
+def stub_pacman(tmp_path, monkeypatch):
+    """A pacman that prompts without a newline, then fails for "missing" """
+    bin_path = tmp_path / "bin"
+    bin_path.mkdir()
+    write_script(bin_path, "sudo", 'exec "$@"\n')
+    write_script(bin_path, "pacman", (
+        'echo "resolving dependencies..."\n'
+        'printf ":: Proceed with installation? [Y/n] "\n'
+        'sleep 0.5\n'
+        'echo\n'
+        'for arg in "$@"; do\n'
+        '    if [ "$arg" = missing ]; then echo "error: target not found: missing"; exit 1; fi\n'
+        'done\n'
+        'echo "installed: $*"\n'))
+    monkeypatch.setenv("PATH", "%s%s%s" % (bin_path, os.pathsep, os.environ["PATH"]))
+    return bin_path
+
+
+class RecordingStream(object):
+    """Text stream that records when each write arrived"""
+
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+
+    def write(self, text):
+        self.writes.append((time.monotonic(), text))
+
+    def flush(self):
+        pass
+
+    def text(self):
+        return "".join(text for _, text in self.writes)
+
+
+def test_plan_install_one_step_per_line():
+    plan = nda.plan_install([
+        "sudo dnf -y install cuda-drivers",
+        "sudo pacman -S nvidia-utils",
+        "echo done | tee /tmp/log",
+    ])
+    assert [step.argv for step in plan] == [
+        ["sudo", "dnf", "-y", "install", "cuda-drivers"],
+        ["sudo", "pacman", "-S", "nvidia-utils"],
+        None,
+    ]
+    assert [step.command for step in plan][2] == "echo done | tee /tmp/log"
+    assert nda.format_install_step(plan[2]) == "echo done | tee /tmp/log"
+
+
+@pytest.mark.parametrize("line", [
+    "sudo pacman -S",
+    "sudo pacman -S nvidia-open; reboot",
+    "sudo make install",
+    "sudo apt-get update",
+    "sudo pacman -Syu nvidia-open",
+])
+def test_split_install_command_rejects_non_install_lines(line):
+    assert nda.split_install_command(line) is None
+
+
+def test_run_install_plan_shows_prompt_before_input(stub_pacman):
+    stream = RecordingStream()
+    report = nda.run_install_plan(nda.plan_install(["sudo pacman -S nvidia-open"]), stream=stream)
+    assert report[0]["returncode"] == 0
+    assert "installed: -S nvidia-open" in stream.text()
+
+    # The prompt has no trailing newline, yet it must be forwarded while the
+    # package manager waits, not once it prints the next line
+    prompted = [at for at, text in stream.writes if "Proceed with installation?" in text]
+    answered = [at for at, text in stream.writes if "installed:" in text]
+    assert prompted and answered
+    assert answered[0] - prompted[0] >= 0.3
+
+
+def test_run_install_plan_stops_at_first_failure(stub_pacman):
+    stream = RecordingStream()
+    report = nda.run_install_plan(nda.plan_install([
+        "sudo pacman -S missing",
+        "sudo pacman -S nvidia-utils",
+    ]), stream=stream)
+    assert [step["returncode"] for step in report] == [1]
+    assert report[0]["command"] == "sudo pacman -S missing"
+    assert "error: target not found: missing" in stream.text()
+
+
+def test_run_install_plan_shell_and_missing_commands(stub_pacman):
+    stream = RecordingStream()
+    report = nda.run_install_plan(nda.plan_install(["printf 'a\\nb' | tr a-z A-Z"]), stream=stream)
+    assert report[0]["returncode"] == 0
+    lines = stream.text().splitlines()
+    assert lines[-2].endswith("A") and lines[-1].endswith("B")
+    assert lines[-1].lstrip().startswith("[")
+
+    report = nda.run_install_plan([nda.InstallStep(["nda-no-such-command"], "nda-no-such-command")], stream=stream)
+    assert report[0]["returncode"] == 127
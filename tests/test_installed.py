@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+import nvidia_driver_assistant as nda
+
+
+def test_get_installed_packages_dpkg(fixtures):
+    packages = nda.get_installed_packages(os.path.join(fixtures, "root-deb"))
+    # cuda-drivers is only left with its configuration files
+    assert packages == {"nvidia-open": "570.133.07-1", "nvidia-driver-570-open": "570.133.07-1"}
+
+
+def test_get_installed_packages_pacman(fixtures):
+    packages = nda.get_installed_packages(os.path.join(fixtures, "root-arch"))
+    assert packages == {"linux612-nvidia-open": "570.133.07-1", "nvidia-utils": "570.133.07-1"}
+
+
+def test_get_installed_packages_without_database(tmp_path, monkeypatch):
+    # No dpkg or pacman database and no rpm to query
+    monkeypatch.setenv("PATH", str(tmp_path))
+    assert nda.get_installed_packages(str(tmp_path)) is None
+
+
+def test_parse_rpm_query():
+    output = "kmod-nvidia-open-dkms 570.133.07-1.fc41\nbash 5.2.32-1.fc41\nbroken\n"
+    assert nda.parse_rpm_query(output) == {"kmod-nvidia-open-dkms": "570.133.07-1.fc41", "bash": "5.2.32-1.fc41"}
+
+
+def test_get_loaded_driver_from_proc(fixtures):
+    version, flavor = nda.get_loaded_driver(os.path.join(fixtures, "sys-open"), os.path.join(fixtures, "root-deb"))
+    assert (version, flavor) == ("570.133.07", "open")
+
+
+def test_get_loaded_driver_from_taint(fixtures, tmp_path):
+    assert nda.get_loaded_driver(os.path.join(fixtures, "sys-closed"), str(tmp_path)) == ("550.144.03", "closed")
+    assert nda.get_loaded_driver(os.path.join(fixtures, "sys-open"), str(tmp_path)) == ("570.133.07", "open")
+    assert nda.get_loaded_driver(str(tmp_path), str(tmp_path)) == (None, None)
+
+
+def test_get_installed_driver_skips_running_kernel_for_other_root(fixtures):
+    root = os.path.join(fixtures, "root-deb")
+    installed = nda.get_installed_driver(None, root)
+    assert installed.version is None and installed.flavor is None
+    assert "nvidia-open" in installed.packages
+
+    installed = nda.get_installed_driver(os.path.join(fixtures, "sys-open"), root)
+    assert (installed.version, installed.flavor) == ("570.133.07", "open")
+
+
+@pytest.fixture
+def deb_open(fixtures):
+    return nda.get_installed_driver(os.path.join(fixtures, "sys-open"), os.path.join(fixtures, "root-deb"))
+
+
+def test_check_installed_satisfied(deb_open):
+    satisfied, reason = nda.check_installed("open", ["sudo apt-get install -y nvidia-open"], deb_open, 570)
+    assert satisfied
+    assert reason == "installed: nvidia-open 570.133.07-1; loaded: 570.133.07"
+
+
+def test_check_installed_not_loaded_yet(fixtures):
+    installed = nda.get_installed_driver(None, os.path.join(fixtures, "root-deb"))
+    satisfied, reason = nda.check_installed("open", ["sudo apt-get install -y nvidia-open"], installed)
+    assert satisfied and "reboot" in reason
+
+
+def test_check_installed_missing_package(deb_open):
+    satisfied, reason = nda.check_installed("open", ["sudo apt-get install -y nvidia-open cuda-drivers"], deb_open)
+    assert not satisfied
+    assert reason == "not installed: cuda-drivers"
+
+
+def test_check_installed_flavor_and_branch_mismatch(fixtures, tmp_path, deb_open):
+    commands = ["sudo apt-get install -y nvidia-open"]
+    satisfied, reason = nda.check_installed("closed", commands, deb_open)
+    assert not satisfied and "open flavor" in reason
+
+    satisfied, reason = nda.check_installed("open", commands, deb_open, 580)
+    assert not satisfied and "version 570.133.07" in reason
+
+    version, flavor = nda.get_loaded_driver(os.path.join(fixtures, "sys-closed"), str(tmp_path))
+    closed = deb_open._replace(version=version, flavor=flavor)
+    satisfied, reason = nda.check_installed("open", commands, closed)
+    assert not satisfied and "closed flavor" in reason
+
+
+def test_check_installed_without_plain_packages(deb_open):
+    # Module streams name no packages, the loaded module decides
+    satisfied, reason = nda.check_installed("open", ["sudo dnf module install nvidia-driver:open-dkms"], deb_open)
+    assert satisfied and "570.133.07 is loaded" in reason
+
+    unloaded = deb_open._replace(version=None, flavor=None)
+    satisfied, reason = nda.check_installed("open", ["sudo dnf module install nvidia-driver:open-dkms"], unloaded)
+    assert not satisfied and reason == "the installed packages cannot be verified"
@@ -0,0 +1,70 @@
+import nvidia_driver_assistant as nda
+
+
+def device(devid, name, legacy_branch=None, features=("kernelopen",)):
+    entry = {"devid": devid, "name": name, "features": list(features)}
+    if legacy_branch:
+        entry["legacybranch"] = legacy_branch
+    return nda.Device.from_chip(nda.Chip.from_json(entry), devid, nda.Policy.default())
+
+
+def recommended(driver, *devices):
+    options = nda.recommend_module_options(driver, {dev.id: dev for dev in devices})
+    return ["%s.%s" % (option.module, option.name) for option in options]
+
+
+def test_current_gpu_gets_every_option():
+    ada = device("0x2783", "NVIDIA GeForce RTX 4070", features=("kernelopen", "gsp_proprietary_supported"))
+    assert ada.architecture == "ada"
+    assert recommended("open", ada) == [
+        "nvidia_drm.modeset", "nvidia.NVreg_UsePageAttributeTable", "nvidia_drm.fbdev",
+        "nvidia.NVreg_PreserveVideoMemoryAllocations", "nvidia.NVreg_TemporaryFilePath",
+    ]
+    assert recommended("closed", ada)[-1] == "nvidia.NVreg_EnableGpuFirmware"
+
+
+def test_legacy_branches_lack_newer_options():
+    kepler = device("0x1180", "NVIDIA GeForce GTX 680", "470.xx", features=())
+    assert kepler.architecture == "kepler"
+    assert recommended("closed", kepler) == [
+        "nvidia_drm.modeset", "nvidia.NVreg_UsePageAttributeTable",
+        "nvidia.NVreg_PreserveVideoMemoryAllocations", "nvidia.NVreg_TemporaryFilePath",
+    ]
+
+    fermi = device("0x1080", "NVIDIA GeForce GTX 580", "390.xx", features=())
+    assert fermi.architecture == "fermi"
+    assert recommended("closed", fermi) == ["nvidia_drm.modeset", "nvidia.NVreg_UsePageAttributeTable"]
+
+
+def test_legacy_only_gpu_without_nvidia_drm():
+    # The 340.xx branch ships no nvidia_drm module
+    tesla = device("0x05E1", "NVIDIA GeForce GTX 280", "340.xx", features=())
+    assert tesla.architecture == "tesla2"
+    assert recommended("closed", tesla) == ["nvidia.NVreg_UsePageAttributeTable"]
+
+    curie = device("0x0391", "NVIDIA GeForce 7600 GT", "304.xx", features=())
+    assert curie.architecture == "curie"
+    assert recommended("closed", curie) == []
+
+
+def test_gsp_firmware_only_from_turing_on():
+    # A wrongly flagged pre-Turing GPU gets no GSP firmware option
+    pascal = device("0x1B80", "NVIDIA GeForce GTX 1080", features=("gsp_proprietary_supported",))
+    assert pascal.architecture == "pascal"
+    assert "nvidia.NVreg_EnableGpuFirmware" not in recommended("closed", pascal)
+
+    turing = device("0x1E04", "NVIDIA GeForce RTX 2080 Ti", features=("kernelopen", "gsp_proprietary_supported"))
+    assert "nvidia.NVreg_EnableGpuFirmware" in recommended("closed", turing)
+    assert "nvidia.NVreg_EnableGpuFirmware" not in recommended("closed", turing, pascal)
+
+
+def test_shared_modules_get_the_common_options():
+    ada = device("0x2783", "NVIDIA GeForce RTX 4070")
+    kepler = device("0x1180", "NVIDIA GeForce GTX 680", "470.xx", features=())
+    assert recommended("closed", ada, kepler) == recommended("closed", kepler)
+
+
+def test_advice_for_legacy_gpu_leaves_nvidia_drm_alone(tmp_path):
+    tesla = device("0x05E1", "NVIDIA GeForce GTX 280", "340.xx", features=())
+    advice = nda.advise_module_options("closed", {tesla.id: tesla}, str(tmp_path), str(tmp_path / "sys"))
+    assert [entry["module"] for entry in advice["options"]] == ["nvidia"]
@@ -0,0 +1,57 @@
+import os
+import stat
+import threading
+import time
+
+import nvidia_driver_assistant as nda
+
+from conftest import RTX_4070_MODALIAS
+
+
+def slow_pci_device_info(calls, delay):
+    lock = threading.Lock()
+
+    def get_pci_device_info(path):
+        with lock:
+            calls.append(path)
+        time.sleep(delay)
+        return {}
+    return get_pci_device_info
+
+
+def test_recommend_stays_within_deadline(tmp_path, monkeypatch, add_pci_function, supported_gpus):
+    sys_path = tmp_path / "sys"
+    add_pci_function(sys_path, "0000:01:00.0", parent="pci0000:00/0000:00:01.0", files={"modalias": RTX_4070_MODALIAS})
+    add_pci_function(sys_path, "0000:02:00.0", parent="pci0000:00/0000:00:02.0", files={"modalias": RTX_4070_MODALIAS})
+    calls = []
+    monkeypatch.setattr(nda, "get_pci_device_info", slow_pci_device_info(calls, 1.5))
+
+    session = nda.Session(supported_gpus=supported_gpus, sys_path=str(sys_path))
+    start = time.monotonic()
+    session.probe(deadline=0.5, distro=False)
+    result = session.recommend()
+    elapsed = time.monotonic() - start
+
+    assert session.probe_report["pci_info"]["status"] == "timeout"
+    assert result.driver == "open"
+    assert elapsed < 1.0
+    # Only the probe read sysfs, the late functions are not read again
+    assert len(calls) == 2
+    assert all(device.pci_link is None for device in result.devices.values())
+
+
+def test_laptop_check_stays_within_deadline(tmp_path, monkeypatch):
+    bin_path = tmp_path / "bin"
+    bin_path.mkdir()
+    dmidecode = bin_path / "dmidecode"
+    dmidecode.write_text("#!/bin/sh\nexec sleep 5\n")
+    dmidecode.chmod(dmidecode.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv("PATH", "%s%s%s" % (bin_path, os.pathsep, os.environ["PATH"]))
+    monkeypatch.setattr(nda, "dmi_chassis_is_laptop", lambda: False)
+    monkeypatch.setattr(nda, "battery_present", lambda: False)
+
+    session = nda.Session(supported_gpus=str(tmp_path / "unused.json"), sys_path=str(tmp_path / "sys"))
+    start = time.monotonic()
+    session.probe(deadline=0.5, distro=False)
+    assert session.is_laptop is False
+    assert time.monotonic() - start < 1.0
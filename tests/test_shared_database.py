@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+import nvidia_driver_assistant as nda
+
+pytest.importorskip("multiprocessing.shared_memory")
+
+
+def write_chips(path, chips):
+    path.write_text(json.dumps({"chips": chips}))
+    return str(path)
+
+
+def chips(entries):
+    return [chip.to_json() for chip in entries]
+
+
+@pytest.fixture
+def merged(tmp_path):
+    base = write_chips(tmp_path / "supported-gpus.json", [
+        {"devid": "0x1F95", "name": "NVIDIA GeForce GTX 1650 Ti", "features": ["kernelopen"]},
+        {"devid": "0x2783", "name": "NVIDIA GeForce RTX 4070", "features": ["kernelopen", "VDPAUFeatureSetK"]},
+        {"devid": "0x1F95", "subvendorid": "0x1043", "subdevid": "0x1F12",
+         "name": "NVIDIA GeForce GTX 1650 Ti with Max-Q Design", "features": ["kernelopen"]},
+    ])
+    overlay = write_chips(tmp_path / "overlay.json", [
+        {"devid": "0x1f95", "merge": "update", "legacybranch": "535.xx"},
+        {"devid": "0x2783", "subvendorid": "1043", "subdevid": "8888", "name": "ASUS OEM RTX 4070",
+         "features": ["kernelopen"], "merge": "append"},
+        {"devid": "0x9999", "name": "NVIDIA Test Board", "features": []},
+    ])
+    return nda.load_gpu_database([base, overlay])
+
+
+def test_shared_lookups_equal_merged_database(merged):
+    with nda.SharedGpuDatabase.create(merged) as shared:
+        attached = nda.SharedGpuDatabase.attach(shared.name)
+        try:
+            for database in (shared, attached):
+                assert len(database) == len(merged) == 5
+                assert database.overlays == merged.overlays
+                assert chips(database) == chips(merged)
+                for devid in list(merged.index) + ["0x1f95", "0x0000"]:
+                    assert chips(database.lookup(devid)) == chips(merged.lookup(devid))
+                    assert (devid in database) == (devid in merged)
+        finally:
+            attached.close()
+
+
+def test_shared_database_long_strings():
+    name = "NVIDIA " + "X" * 70000
+    database = nda.GpuDatabase([nda.Chip.from_json({"devid": "0x2783", "name": name, "features": []})])
+    with nda.SharedGpuDatabase.create(database) as shared:
+        assert shared.lookup("0x2783")[0].name == name
+
+
+def test_shared_database_groups_by_index_key():
+    # Records listed under an index key spelled unlike their devid
+    database = nda.GpuDatabase([
+        nda.Chip.from_json({"devid": "0x2783", "name": "NVIDIA GeForce RTX 4070", "features": []}),
+        nda.Chip.from_json({"devid": "0x1f95", "name": "NVIDIA GeForce GTX 1650 Ti", "features": []}),
+    ])
+    database.index = {"0x1F95": database.index["0x1f95"], "0x2783": database.index["0x2783"]}
+    with nda.SharedGpuDatabase.create(database) as shared:
+        assert chips(shared.lookup("0x1F95")) == chips(database.lookup("0x1F95"))
+        assert shared.lookup("0x1f95") == ()
+        assert chips(shared) == chips(database)
@@ -0,0 +1,143 @@
+import os
+
+import pytest
+
+import nvidia_driver_assistant as nda
+
+from conftest import RTX_4070_MODALIAS
+
+GPU_FILES = {"modalias": RTX_4070_MODALIAS, "class": "0x030000", "vendor": "0x10de", "device": "0x2783"}
+
+
+def remove_function(sys_path, slot):
+    os.unlink(os.path.join(str(sys_path), "bus", "pci", "devices", slot))
+
+
+@pytest.fixture
+def scripted_sleep(monkeypatch):
+    """Replace the polling sleep by the next queued change to the tree"""
+    changes = []
+
+    def sleep(seconds):
+        if changes:
+            changes.pop(0)()
+
+    monkeypatch.setattr(nda.time, "sleep", sleep)
+    return changes
+
+
+def test_watch_pci_events_polls_alternative_sys(tmp_path, scripted_sleep, add_pci_function):
+    add_pci_function(tmp_path, "0000:00:02.0")
+    add_pci_function(tmp_path, "0000:01:00.0")
+    scripted_sleep.extend([
+        lambda: add_pci_function(tmp_path, "0000:05:00.0"),
+        lambda: (remove_function(tmp_path, "0000:01:00.0"), add_pci_function(tmp_path, "0000:01:00.1")),
+    ])
+    events = nda.watch_pci_events(str(tmp_path), interval=0.01)
+    assert next(events) == ("add", "0000:05:00.0")
+    assert next(events) == ("remove", "0000:01:00.0")
+    assert next(events) == ("add", "0000:01:00.1")
+    events.close()
+
+
+def test_watch_pci_events_without_pci_bus(tmp_path, scripted_sleep, add_pci_function):
+    # The bus directory appearing later reports every function as added
+    scripted_sleep.append(lambda: add_pci_function(tmp_path, "0000:01:00.0"))
+    events = nda.watch_pci_events(str(tmp_path), interval=0.01)
+    assert next(events) == ("add", "0000:01:00.0")
+    events.close()
+
+
+def test_parse_uevent():
+    message = b"add@/devices/pci0000:00/0000:00:01.0/0000:01:00.0\0ACTION=add\0SUBSYSTEM=pci\0" \
+              b"PCI_SLOT_NAME=0000:01:00.0\0SEQNUM=4242\0"
+    assert nda.parse_uevent(message) == ("add", "0000:01:00.0")
+    message = b"remove@/devices/pci0000:00/0000:00:01.0/0000:01:00.4\0ACTION=remove\0SUBSYSTEM=pci\0" \
+              b"DEVPATH=/devices/pci0000:00/0000:00:01.0/0000:01:00.4\0"
+    assert nda.parse_uevent(message) == ("remove", "0000:01:00.4")
+    assert nda.parse_uevent(b"change@/devices/x\0ACTION=change\0SUBSYSTEM=pci\0PCI_SLOT_NAME=x\0") is None
+    assert nda.parse_uevent(b"add@/devices/usb1\0ACTION=add\0SUBSYSTEM=usb\0") is None
+
+
+@pytest.fixture
+def sriov_gpu(tmp_path, add_pci_function):
+    """A sysfs tree with an SR-IOV capable RTX 4070 and an audio function"""
+    sys_path = tmp_path / "sys"
+    pf = add_pci_function(sys_path, "0000:01:00.0", files=dict(GPU_FILES, sriov_totalvfs="16", sriov_numvfs="0"))
+    add_pci_function(sys_path, "0000:00:1f.3", files={"modalias": "pci:v00008086d000051C8sv00001043sd00008894bc04sc03i80"})
+
+    def enable_vf(index, slot):
+        vf = add_pci_function(sys_path, slot, files=GPU_FILES)
+        os.symlink(os.path.relpath(pf, vf), os.path.join(vf, "physfn"))
+        os.symlink(os.path.relpath(vf, pf), os.path.join(pf, "virtfn%d" % index))
+        write_numvfs(pf, index + 1)
+
+    def disable_vf(index, slot):
+        remove_function(sys_path, slot)
+        os.unlink(os.path.join(pf, "virtfn%d" % index))
+        write_numvfs(pf, index)
+
+    return sys_path, enable_vf, disable_vf
+
+
+def write_numvfs(pf, count):
+    with open(os.path.join(pf, "sriov_numvfs"), "w") as f:
+        f.write("%d\n" % count)
+
+
+def test_pci_inventory_follows_virtual_functions(supported_gpus, sriov_gpu):
+    sys_path, enable_vf, disable_vf = sriov_gpu
+    database = nda.load_gpu_database(supported_gpus)
+
+    inventory = nda.PciInventory(database, nda.Policy.default(), sys_path=str(sys_path), is_laptop=False)
+    inventory.scan()
+    assert list(inventory.devices) == ["0000:01:00.0"]
+    assert inventory.devices["0000:01:00.0"].sriov["enabled_vfs"] == 0
+
+    # Enabling two VFs: each add re-evaluates the physical function
+    for index, slot in enumerate(["0000:01:00.4", "0000:01:00.5"]):
+        enable_vf(index, slot)
+        change = inventory.add(slot)
+        assert (change.kind, change.slot) == ("change", "0000:01:00.0")
+        assert change.device.sriov["enabled_vfs"] == index + 1
+    assert list(inventory.devices) == ["0000:01:00.0"]
+    assert inventory.devices["0000:01:00.0"].sriov["virtual_functions"] == ["0000:01:00.4", "0000:01:00.5"]
+
+    # The VF node and its physfn link are gone when the removal is reported
+    disable_vf(1, "0000:01:00.5")
+    change = inventory.remove("0000:01:00.5")
+    assert (change.kind, change.slot) == ("change", "0000:01:00.0")
+    assert change.device is inventory.devices["0000:01:00.0"]
+    assert change.device.sriov["enabled_vfs"] == 1
+
+    change = inventory.remove("0000:01:00.0")
+    assert change.kind == "remove" and change.device.sriov["enabled_vfs"] == 1
+    assert inventory.devices == {}
+    assert inventory.remove("0000:01:00.4") is None
+    assert inventory.add("0000:00:1f.3") is None
+
+
+def test_session_watch_reports_virtual_function_changes(supported_gpus, sriov_gpu, scripted_sleep):
+    sys_path, enable_vf, disable_vf = sriov_gpu
+    scripted_sleep.extend([
+        lambda: enable_vf(0, "0000:01:00.4"),
+        lambda: disable_vf(0, "0000:01:00.4"),
+    ])
+    session = nda.Session(supported_gpus=supported_gpus, sys_path=str(sys_path))
+    events = session.watch(interval=0.01)
+
+    snapshot = next(events)
+    assert snapshot["event"] == "snapshot" and snapshot["module_flavor"] == "open"
+    assert [device["slot"] for device in snapshot["devices"]] == ["0000:01:00.0"]
+
+    event = next(events)
+    assert (event["event"], event["slot"]) == ("change", "0000:01:00.0")
+    assert event["virtual_function"] == {"action": "add", "slot": "0000:01:00.4"}
+    assert event["device"]["sriov"]["enabled_vfs"] == 1
+    assert event["changed"] is False
+
+    event = next(events)
+    assert (event["event"], event["slot"]) == ("change", "0000:01:00.0")
+    assert event["virtual_function"] == {"action": "remove", "slot": "0000:01:00.4"}
+    assert event["device"]["sriov"]["enabled_vfs"] == 0
+    events.close()